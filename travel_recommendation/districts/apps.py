@@ -1,6 +1,20 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.models.signals import post_delete, post_migrate, post_save
 
 
 class DistrictsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'districts'
+
+    def ready(self):
+        from .gazetteer import seed_districts
+        from .models import District
+        from .registry import invalidate_registry
+        post_save.connect(invalidate_registry, sender=District, dispatch_uid='districts_registry_save')
+        post_delete.connect(invalidate_registry, sender=District, dispatch_uid='districts_registry_delete')
+        post_migrate.connect(seed_districts, sender=self, dispatch_uid='districts_seed')
+
+        if getattr(settings, 'METRICS_REFRESH_IN_PROCESS', False):
+            from .scheduler import refresher
+            refresher.start()
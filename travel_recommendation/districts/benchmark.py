@@ -0,0 +1,293 @@
+import gc
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from . import codec, services, snapshot_file
+from .models import ForecastDay
+from .records import DistrictMetrics, metrics_json
+from .registry import get_registry
+from .replay import FAMILIES, ReplayServer
+from .serializers import TopDistrictSerializer
+from .spatial import snap_to_grid
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 95, 99)
+COLD_ROUNDS = 5  # Cache resets in the cold scenario; each is hit by `concurrency` simultaneous requests
+SETTLE_TIMEOUT = 60
+TRAVEL_FORM = {'current_district': 'Dhaka', 'destination_district': 'Sylhet'}
+
+
+class Benchmark:
+    # Runs the app against a ReplayServer with a throwaway database, cache and snapshot file, so neither the
+    # real Open-Meteo API nor the project's db.sqlite3 / cache.sqlite3 are touched.
+
+    def __init__(self, server):
+        self.server = server
+        self._directory = None
+        self._settings = None
+        self._old_database = None
+        self._old_snapshot_file = None
+        self._old_urls = None
+        self._local = threading.local()
+
+    def __enter__(self):
+        self._directory = tempfile.mkdtemp(prefix='districts-benchmark-')
+        setup_test_environment()
+        self._settings = override_settings(CACHES={
+            'default': {
+                'BACKEND': 'districts.cache_backend.SQLiteCache',
+                'LOCATION': os.path.join(self._directory, 'cache.sqlite3'),
+            },
+            'fragments': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'},
+        })
+        self._settings.enable()
+        # Migrating also seeds the districts (post_migrate)
+        connection.settings_dict['TEST']['NAME'] = os.path.join(self._directory, 'db.sqlite3')
+        self._old_database = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        self._old_snapshot_file = snapshot_file.SNAPSHOT_FILE
+        snapshot_file.SNAPSHOT_FILE = os.path.join(self._directory, 'metrics_snapshot.bin')
+        self._old_urls = services.WEATHER_API_URL, services.AIR_QUALITY_API_URL
+        self.server.start()
+        services.WEATHER_API_URL, services.AIR_QUALITY_API_URL = self.server.weather_url, self.server.air_quality_url
+        return self
+
+    def __exit__(self, *exc_info):
+        self.settle()
+        self.server.stop()
+        services.WEATHER_API_URL, services.AIR_QUALITY_API_URL = self._old_urls
+        snapshot_file.SNAPSHOT_FILE = self._old_snapshot_file
+        connection.creation.destroy_test_db(self._old_database, verbosity=0)
+        self._settings.disable()
+        teardown_test_environment()
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    @property
+    def client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = Client()
+        return client
+
+    def settle(self, quiet=0.2):
+        # Wait for background refreshes (stale-while-revalidate, budget overruns) to finish, so their upstream
+        # calls are counted in the scenario that caused them and do not leak into the next one
+        deadline = time.monotonic() + SETTLE_TIMEOUT
+        idle_since = None
+        while time.monotonic() < deadline:
+            if self.server.in_flight or cache.get(services.METRICS_LOCK_KEY):
+                idle_since = None
+            elif idle_since is None:
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since >= quiet:
+                return
+            time.sleep(0.02)
+        logger.warning(f"Background work still running after {SETTLE_TIMEOUT}s")
+
+    def reset(self):
+        cache.clear()
+        ForecastDay.objects.all().delete()
+        try:
+            os.unlink(snapshot_file.SNAPSHOT_FILE)
+        except FileNotFoundError:
+            pass
+
+    def expire_forecasts(self, locations=None):
+        # Age the cached forecasts past their freshness, as if the refresh interval had gone by
+        locations = locations or get_registry().locations()
+        keys = {
+            f"{prefix}_{latitude}_{longitude}"
+            for prefix, _, resolution in services.FORECAST_FAMILIES
+            for latitude, longitude in (
+                snap_to_grid(location['latitude'], location['longitude'], resolution) for location in locations
+            )
+        }
+        expired_at = time.time() - max(services.FORECAST_FRESHNESS.values(), default=0) - services.DEFAULT_FRESHNESS
+        forecasts = cache.get_many(list(keys))
+        for forecast in forecasts.values():
+            forecast.fetched_at = expired_at
+        cache.set_many(forecasts, timeout=services.FORECAST_CACHE_TIMEOUT)
+        return len(forecasts)
+
+    def expire_snapshots(self):
+        snapshots = cache.get_many([services.METRICS_CACHE_KEY, services.RANKINGS_CACHE_KEY,
+                                    services.FEATURES_CACHE_KEY])
+        for snapshot in snapshots.values():
+            snapshot['computed_at'] -= services.METRICS_REFRESH_INTERVAL
+        cache.set_many(snapshots, timeout=services.METRICS_SNAPSHOT_TIMEOUT)
+        snapshot_file.write_snapshot_file(snapshots)
+
+    def prime(self):
+        response = self.client.get('/top-districts/')
+        if response.status_code != 200:
+            raise RuntimeError(f"Priming /top-districts/ failed with {response.status_code}")
+        self.settle()
+
+    def measure(self, request, count, concurrency):
+        def timed(_):
+            start = time.perf_counter()
+            try:
+                response = request(self.client)
+                ok = response.status_code < 400
+            except Exception as e:
+                logger.error(f"Benchmark request failed: {e}")
+                ok = False
+            return time.perf_counter() - start, ok
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(timed, range(count)))
+        return {'latencies': [latency for latency, _ in results], 'errors': sum(not ok for _, ok in results),
+                'elapsed': time.perf_counter() - start}
+
+    def run(self, name, count, concurrency):
+        self.settle()
+        before = self.server.stats()
+        samples = SCENARIOS[name](self, count, concurrency)
+        self.settle()
+        after = self.server.stats()
+        latencies = np.array(samples['latencies']) * 1000
+        return {
+            'scenario': name,
+            'requests': len(latencies),
+            'concurrency': concurrency,
+            'errors': samples['errors'],
+            **{f'p{q}_ms': float(value) for q, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES))},
+            'requests_per_second': len(latencies) / samples['elapsed'] if samples['elapsed'] else 0.0,
+            'upstream': {key: after[key] - before[key] for key in (*FAMILIES, 'throttled', 'locations')},
+        }
+
+
+def _top_districts(client):
+    return client.get('/top-districts/')
+
+
+def cold_scenario(bench, count, concurrency):
+    # Empty cache, no forecast history and no snapshot file: the first request computes the metrics inline
+    # and the rest of the round waits on the metrics lock
+    rounds = max(1, min(COLD_ROUNDS, count // concurrency))
+    latencies, errors, elapsed = [], 0, 0.0
+    for _ in range(rounds):
+        bench.settle()
+        bench.reset()
+        samples = bench.measure(_top_districts, concurrency, concurrency)
+        latencies += samples['latencies']
+        errors += samples['errors']
+        elapsed += samples['elapsed']
+    return {'latencies': latencies, 'errors': errors, 'elapsed': elapsed}
+
+
+def warm_scenario(bench, count, concurrency):
+    bench.prime()
+    return bench.measure(_top_districts, count, concurrency)
+
+
+def stampede_scenario(bench, count, concurrency):
+    # Every forecast and the snapshot expire at once; requests should keep getting the stale ranking while
+    # exactly one refresh goes upstream
+    bench.prime()
+    bench.expire_forecasts()
+    bench.expire_snapshots()
+    return bench.measure(_top_districts, count, concurrency)
+
+
+def burst_scenario(bench, count, concurrency):
+    # Many users asking for the same trip right after its forecasts expired
+    registry = get_registry()
+    bench.prime()
+    bench.expire_forecasts([{'latitude': record.latitude, 'longitude': record.longitude}
+                            for record in map(registry.get, TRAVEL_FORM.values())])
+    form = {**TRAVEL_FORM, 'travel_date': (services.local_now().date() + timedelta(days=1)).isoformat()}
+    return bench.measure(
+        lambda client: client.post('/travel-recommendation/', form, HTTP_X_REQUESTED_WITH='XMLHttpRequest'),
+        count, concurrency
+    )
+
+
+SCENARIOS = {
+    'cold': cold_scenario,
+    'warm': warm_scenario,
+    'stampede': stampede_scenario,
+    'burst': burst_scenario,
+}
+
+
+def run_benchmark(scenarios, count, concurrency, **server_options):
+    with Benchmark(ReplayServer(**server_options)) as bench:
+        return [bench.run(name, count, concurrency) for name in scenarios]
+
+
+def _dict_metrics(count):
+    return [
+        {'name': f"District {i}", 'latitude': 20.5 + i * 0.01, 'longitude': 88.0 + i * 0.02,
+         'avg_temperature': round(25.0 + (i % 70) / 10, 2), 'avg_pm25': round(30.0 + (i % 50) / 3, 2)}
+        for i in range(count)
+    ]
+
+
+def _record_metrics(count):
+    return [
+        DistrictMetrics(f"District {i}", 20.5 + i * 0.01, 88.0 + i * 0.02, round(25.0 + (i % 70) / 10, 2),
+                        round(30.0 + (i % 50) / 3, 2))
+        for i in range(count)
+    ]
+
+
+def _render_dicts(metrics):
+    # What the views did before DistrictMetrics: DRF serializer, then JSONRenderer's compact UTF-8 JSON
+    return json.dumps(TopDistrictSerializer(metrics, many=True).data, ensure_ascii=False, allow_nan=False,
+                      separators=(',', ':')).encode('utf-8')
+
+
+SERIALIZATION_PATHS = {  # name -> (build a snapshot's metrics, render them as the API JSON)
+    'dict + serializer': (_dict_metrics, _render_dicts),
+    'DistrictMetrics': (_record_metrics, metrics_json),
+}
+
+
+def _timed(function, argument, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(argument)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def serialization_benchmark(count, repeat):
+    # Per metrics snapshot of `count` districts: time to render the JSON, Python heap held by the list,
+    # and the cache entry's encoded size and decode time
+    results = []
+    rendered = set()
+    for name, (build, render) in SERIALIZATION_PATHS.items():
+        build(count)  # Warm up, so one-off allocations are not counted
+        gc.collect()
+        tracemalloc.start()
+        metrics = build(count)
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        encoded = codec.encode(metrics)
+        rendered.add(render(metrics))
+        results.append({
+            'path': name,
+            'districts': count,
+            'render_us': _timed(render, metrics, repeat),
+            'decode_us': _timed(codec.decode, encoded, repeat),
+            'memory_bytes': memory,
+            'cache_bytes': len(encoded),
+        })
+    if len(rendered) != 1:
+        raise RuntimeError("Serialization paths rendered different JSON")
+    return results
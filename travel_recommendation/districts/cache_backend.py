@@ -0,0 +1,152 @@
+import os
+import sqlite3
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from . import codec
+
+CULL_EVERY = 100  # Check for expired/excess rows once per this many writes
+
+
+class SQLiteCache(BaseCache):
+    # Host-wide cache shared by every worker process through one SQLite file in WAL mode.
+    # Values are stored with the compact districts.codec encoding instead of pickles.
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = str(location)
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        # One connection per thread, reopened after a fork so workers never share a handle
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self._path, timeout=10, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL) WITHOUT ROWID"
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _expiry(self, timeout):
+        # get_backend_timeout() already returns an absolute expiry time (or None for no expiry)
+        return self.get_backend_timeout(timeout)
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._connection().execute(
+            "SELECT value FROM cache_entries WHERE key = ? AND (expires IS NULL OR expires > ?)",
+            (key, time.time())
+        ).fetchone()
+        return codec.decode(row[0]) if row else default
+
+    def get_many(self, keys, version=None):
+        keys_by_cache_key = {self.make_and_validate_key(key, version=version): key for key in keys}
+        if not keys_by_cache_key:
+            return {}
+        placeholders = ",".join("?" * len(keys_by_cache_key))
+        rows = self._connection().execute(
+            f"SELECT key, value FROM cache_entries WHERE key IN ({placeholders}) "
+            f"AND (expires IS NULL OR expires > ?)",
+            (*keys_by_cache_key, time.time())
+        ).fetchall()
+        return {keys_by_cache_key[key]: codec.decode(value) for key, value in rows}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout=timeout, version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self._expiry(timeout)
+        rows = [
+            (self.make_and_validate_key(key, version=version), codec.encode(value), expires)
+            for key, value in data.items()
+        ]
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany("INSERT OR REPLACE INTO cache_entries (key, value, expires) VALUES (?, ?, ?)",
+                                   rows)
+        self._maybe_cull(len(rows))
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        # Single statement, so concurrent workers racing for the same key get exactly one winner
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        cursor = self._connection().execute(
+            "INSERT INTO cache_entries (key, value, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires = excluded.expires "
+            "WHERE cache_entries.expires IS NOT NULL AND cache_entries.expires <= ?",
+            (key, codec.encode(value), self._expiry(timeout), now)
+        )
+        self._maybe_cull(1)
+        return cursor.rowcount == 1
+
+    # BaseCache's async bulk methods loop over single-key calls; one executor hop runs the whole batch instead
+    async def aget_many(self, keys, version=None):
+        return await sync_to_async(self.get_many, thread_sensitive=True)(keys, version)
+
+    async def aset_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        return await sync_to_async(self.set_many, thread_sensitive=True)(data, timeout, version)
+
+    async def adelete_many(self, keys, version=None):
+        return await sync_to_async(self.delete_many, thread_sensitive=True)(keys, version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._connection().execute(
+            "UPDATE cache_entries SET expires = ? WHERE key = ? AND (expires IS NULL OR expires > ?)",
+            (self._expiry(timeout), key, time.time())
+        )
+        return cursor.rowcount == 1
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._connection().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+        return cursor.rowcount == 1
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_and_validate_key(key, version=version) for key in keys]
+        if keys:
+            placeholders = ",".join("?" * len(keys))
+            self._connection().execute(f"DELETE FROM cache_entries WHERE key IN ({placeholders})", keys)
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._connection().execute(
+            "SELECT 1 FROM cache_entries WHERE key = ? AND (expires IS NULL OR expires > ?)",
+            (key, time.time())
+        ).fetchone()
+        return row is not None
+
+    def clear(self):
+        self._connection().execute("DELETE FROM cache_entries")
+
+    def close(self, **kwargs):
+        # Connections are kept per thread for reuse across requests
+        pass
+
+    def _maybe_cull(self, writes):
+        self._writes += writes
+        if self._writes < CULL_EVERY:
+            return
+        self._writes = 0
+        connection = self._connection()
+        connection.execute("DELETE FROM cache_entries WHERE expires IS NOT NULL AND expires <= ?", (time.time(),))
+        (count,) = connection.execute("SELECT COUNT(*) FROM cache_entries").fetchone()
+        if count > self._max_entries:
+            # Same policy as Django's database cache: drop 1/CULL_FREQUENCY of the entries, soonest to expire first
+            excess = count // self._cull_frequency if self._cull_frequency else count
+            connection.execute(
+                "DELETE FROM cache_entries WHERE key IN ("
+                "SELECT key FROM cache_entries ORDER BY expires IS NULL, expires LIMIT ?)",
+                (excess,)
+            )
@@ -0,0 +1,121 @@
+import json
+import pickle
+import struct
+
+from .forecast_store import HourlyForecast
+from .rankings import FeatureIndex, RankingIndex
+from .records import DistrictMetrics
+
+# Wire format, first byte is the tag:
+#   J <json>                                 plain JSON values (str keys, lists, numbers, strings)
+#   X <u32 header len> <json header> (<u32 len> <bytes>)*
+#                                            JSON with binary segments, referenced as {"__ext__": [type, index]}
+#   P <pickle>                               anything else
+# Lists of dicts sharing the same keys (e.g. metrics records) are written once as {"__ext__": ["table", [keys, rows]]}
+# in either JSON form, so the keys are not repeated per record; lists of DistrictMetrics are bare rows in field
+# order, {"__ext__": ["district_metrics", rows]}.
+TAG_JSON = b'J'
+TAG_EXTENDED = b'X'
+TAG_PICKLE = b'P'
+
+EXTENSIONS = {
+    'forecast': HourlyForecast,
+    'rankings': RankingIndex,
+    'features': FeatureIndex,
+}
+EXTENSION_NAMES = {cls: name for name, cls in EXTENSIONS.items()}
+
+_U32 = struct.Struct('<I')
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def _pack(value, segments):
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, list):
+        if value and all(type(item) is DistrictMetrics for item in value):
+            return {'__ext__': ['district_metrics', [item.to_row() for item in value]]}
+        if len(value) > 1 and all(type(item) is dict for item in value):
+            keys = list(value[0])
+            if all(isinstance(key, str) for key in keys) and all(list(item) == keys for item in value):
+                return {'__ext__': ['table', [keys, [[_pack(item[key], segments) for key in keys]
+                                                     for item in value]]]}
+        return [_pack(item, segments) for item in value]
+    if isinstance(value, dict):
+        # Non-str keys would silently come back as strings, so leave those to pickle
+        if '__ext__' in value or not all(isinstance(key, str) for key in value):
+            raise _Unsupported
+        return {key: _pack(item, segments) for key, item in value.items()}
+    if isinstance(value, bytes):
+        segments.append(value)
+        return {'__ext__': ['bytes', len(segments) - 1]}
+    name = EXTENSION_NAMES.get(type(value))
+    if name is None:
+        raise _Unsupported
+    segments.append(value.to_bytes())
+    return {'__ext__': [name, len(segments) - 1]}
+
+
+def encode(value):
+    segments = []
+    try:
+        header = json.dumps(_pack(value, segments), separators=(',', ':')).encode('utf-8')
+    except (_Unsupported, ValueError, RecursionError):
+        return TAG_PICKLE + pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    if not segments:
+        return TAG_JSON + header
+    parts = [TAG_EXTENDED, _U32.pack(len(header)), header]
+    for segment in segments:
+        parts.append(_U32.pack(len(segment)))
+        parts.append(segment)
+    return b''.join(parts)
+
+
+def _restore_rows(obj):
+    ref = obj.get('__ext__')
+    if ref is None or len(obj) != 1:
+        return obj
+    if ref[0] == 'district_metrics':
+        return [DistrictMetrics.from_row(row) for row in ref[1]]
+    if ref[0] != 'table':
+        return obj
+    keys, rows = ref[1]
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def decode(data):
+    # data is bytes or any buffer (e.g. an mmap); binary segments are passed on as slices of it, not copies
+    body = memoryview(data)
+    tag, body = bytes(body[:1]), body[1:]
+    if tag == TAG_JSON:
+        return json.loads(bytes(body), object_hook=_restore_rows)
+    if tag == TAG_PICKLE:
+        return pickle.loads(body)
+    if tag != TAG_EXTENDED:
+        raise ValueError(f"Unknown cache value tag {tag!r}")
+
+    (header_length,) = _U32.unpack_from(body, 0)
+    offset = _U32.size + header_length
+    header = bytes(body[_U32.size:offset])
+    segments = []
+    while offset < len(body):
+        (length,) = _U32.unpack_from(body, offset)
+        offset += _U32.size
+        segments.append(body[offset:offset + length])
+        offset += length
+
+    def restore(obj):
+        ref = obj.get('__ext__')
+        if ref is None or len(obj) != 1:
+            return obj
+        name, index = ref
+        if name in ('table', 'district_metrics'):
+            return _restore_rows(obj)
+        if name == 'bytes':
+            return bytes(segments[index])
+        return EXTENSIONS[name].from_bytes(segments[index])
+
+    return json.loads(header, object_hook=restore)
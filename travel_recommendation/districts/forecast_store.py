@@ -0,0 +1,217 @@
+import struct
+import time
+import warnings
+from datetime import datetime, time as dt_time
+
+import numpy as np
+
+HOUR = np.timedelta64(1, 'h')
+FLOAT32 = np.dtype('<f4')
+
+_FORECAST_HEADER = struct.Struct('<qB')  # start (hours since epoch), variable count
+_VARIABLE_HEADER = struct.Struct('<BI')  # name length, value count
+_FETCHED_AT = struct.Struct('<d')  # Trailer; older encodings without it decode as never fetched
+
+
+def to_hour(moment):
+    if isinstance(moment, datetime):
+        moment = moment.replace(tzinfo=None)
+    elif not isinstance(moment, (str, np.datetime64)):
+        moment = datetime.combine(moment, dt_time(0))
+    return np.datetime64(moment, 'h')
+
+
+def at_2pm(travel_date):
+    return to_hour(datetime.combine(travel_date, dt_time(14)))
+
+
+def _hour_of_day(moment):
+    return int((moment - moment.astype('datetime64[D]')) // HOUR)
+
+
+def _nanmean(values, axis=None):
+    # All-NaN slices are expected (missing upstream data) and map to NaN without a warning
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        return np.nanmean(values, axis=axis, dtype=np.float64)
+
+
+def _as_float(value):
+    # Shortest repr of the float32 value, i.e. the number upstream actually sent (27.2, not 27.200000762939453)
+    return float(str(value))
+
+
+class HourlyForecast:
+    __slots__ = ('start', 'variables', 'fetched_at')
+
+    def __init__(self, start, variables, fetched_at=None):
+        self.start = to_hour(start)
+        self.variables = {name: np.asarray(values, dtype=np.float32) for name, values in variables.items()}
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+
+    @classmethod
+    def from_response(cls, data, variables):
+        hourly = data.get('hourly') if data else None
+        if not hourly or not hourly.get('time') or not any(name in hourly for name in variables):
+            return None
+        times = np.array(hourly['time'], dtype='datetime64[h]')
+        start = times[0]
+        offsets = ((times - start) // HOUR).astype(np.intp)
+        length = int(offsets[-1]) + 1
+        contiguous = length == len(times)
+        series = {}
+        for name in variables:
+            if name not in hourly:
+                continue
+            values = np.array(hourly[name], dtype=np.float32)  # None becomes NaN
+            if not contiguous:
+                aligned = np.full(length, np.nan, dtype=np.float32)
+                aligned[offsets] = values
+                values = aligned
+            series[name] = values
+        return cls(start, series)
+
+    def to_bytes(self):
+        parts = [_FORECAST_HEADER.pack(int(self.start.astype(np.int64)), len(self.variables))]
+        for name, values in self.variables.items():
+            encoded = name.encode('utf-8')
+            parts.append(_VARIABLE_HEADER.pack(len(encoded), len(values)))
+            parts.append(encoded)
+            parts.append(values.astype(FLOAT32, copy=False).tobytes())
+        parts.append(_FETCHED_AT.pack(self.fetched_at))
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        start, count = _FORECAST_HEADER.unpack_from(data, 0)
+        offset = _FORECAST_HEADER.size
+        variables = {}
+        for _ in range(count):
+            name_length, length = _VARIABLE_HEADER.unpack_from(data, offset)
+            offset += _VARIABLE_HEADER.size
+            name = bytes(data[offset:offset + name_length]).decode('utf-8')
+            offset += name_length
+            variables[name] = np.frombuffer(data, dtype=FLOAT32, count=length, offset=offset)
+            offset += length * FLOAT32.itemsize
+        fetched_at = _FETCHED_AT.unpack_from(data, offset)[0] if len(data) - offset >= _FETCHED_AT.size else 0.0
+        return cls(np.datetime64(start, 'h'), variables, fetched_at)
+
+    @property
+    def hours(self):
+        return max((len(values) for values in self.variables.values()), default=0)
+
+    @property
+    def end(self):
+        return self.start + self.hours * HOUR
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for values in self.variables.values())
+
+    def merged(self, newer, start=None, end=None):
+        # Hours present in newer replace ours; the result is clipped to [start, end) when given
+        start = start if start is not None else min(self.start, newer.start)
+        end = end if end is not None else max(self.end, newer.end)
+        length = max(int((end - start) // HOUR), 0)
+        variables = {}
+        for name in dict.fromkeys([*self.variables, *newer.variables]):
+            values = np.full(length, np.nan, dtype=np.float32)
+            for forecast in (self, newer):
+                series = forecast.variables.get(name)
+                if series is None:
+                    continue
+                offset = int((forecast.start - start) // HOUR)
+                first, last = max(offset, 0), min(offset + len(series), length)
+                if first >= last:
+                    continue
+                window = series[first - offset:last - offset]
+                target = values[first:last]
+                present = ~np.isnan(window)
+                target[present] = window[present]
+            variables[name] = values
+        return HourlyForecast(start, variables, max(self.fetched_at, newer.fetched_at))
+
+    def index_of(self, moment):
+        index = int((to_hour(moment) - self.start) // HOUR)
+        return index if 0 <= index < self.hours else None
+
+    def value_at(self, variable, moment):
+        values = self.variables.get(variable)
+        index = self.index_of(moment)
+        if values is None or index is None or index >= len(values) or np.isnan(values[index]):
+            return None
+        return _as_float(values[index])
+
+
+class ForecastStore:
+    __slots__ = ('names', 'time', 'matrices', '_rows')
+
+    def __init__(self, names, time, matrices):
+        self.names = list(names)
+        self.time = time
+        self.matrices = matrices
+        self._rows = {name: row for row, name in enumerate(self.names)}
+
+    @classmethod
+    def build(cls, names, *sources):
+        # Each source is a list of HourlyForecast (or None) aligned with names, e.g. weather and air quality
+        forecasts = [forecast for source in sources for forecast in source if forecast is not None]
+        if not forecasts:
+            return cls(names, np.array([], dtype='datetime64[h]'), {})
+        start = min(forecast.start for forecast in forecasts)
+        end = max(forecast.start + forecast.hours * HOUR for forecast in forecasts)
+        time = start + np.arange(int((end - start) // HOUR)) * HOUR
+
+        matrices = {}
+        for source in sources:
+            for row, forecast in enumerate(source):
+                if forecast is None:
+                    continue
+                offset = int((forecast.start - start) // HOUR)
+                for variable, values in forecast.variables.items():
+                    if variable not in matrices:
+                        matrices[variable] = np.full((len(names), len(time)), np.nan, dtype=np.float32)
+                    matrices[variable][row, offset:offset + len(values)] = values
+        return cls(names, time, matrices)
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def nbytes(self):
+        return self.time.nbytes + sum(matrix.nbytes for matrix in self.matrices.values())
+
+    def row(self, name):
+        return self._rows.get(name)
+
+    def column(self, moment):
+        if not len(self.time):
+            return None
+        index = int((to_hour(moment) - self.time[0]) // HOUR)
+        return index if 0 <= index < len(self.time) else None
+
+    def hour_columns(self, hour=14):
+        if not len(self.time):
+            return np.array([], dtype=np.intp)
+        first = (hour - _hour_of_day(self.time[0])) % 24
+        return np.arange(first, len(self.time), 24)
+
+    def matrix(self, variable):
+        matrix = self.matrices.get(variable)
+        if matrix is None:
+            return np.full((len(self.names), len(self.time)), np.nan, dtype=np.float32)
+        return matrix
+
+    def mean_at_hour(self, variable, hour=14, default=np.nan):
+        means = _nanmean(self.matrix(variable)[:, self.hour_columns(hour)], axis=1)
+        return np.where(np.isnan(means), default, means)
+
+    def hour_of_day_means(self, variable):
+        # districts x 24: the mean of each local hour of the day over every day in the store
+        if not len(self.time):
+            return np.full((len(self.names), 24), np.nan)
+        first = _hour_of_day(self.time[0])
+        days = -(-(first + len(self.time)) // 24)
+        padded = np.full((len(self.names), days * 24), np.nan, dtype=np.float32)
+        padded[:, first:first + len(self.time)] = self.matrix(variable)
+        return _nanmean(padded.reshape(len(self.names), days, 24), axis=1)
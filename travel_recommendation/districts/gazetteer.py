@@ -0,0 +1,105 @@
+import csv
+import json
+import logging
+import os
+from itertools import islice
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .models import District
+from .registry import invalidate_registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GAZETTEER = os.path.join(settings.BASE_DIR, 'data', 'bd-districts.json')
+LOAD_BATCH_SIZE = 1000
+FORMATS = ('json', 'jsonl', 'csv')
+
+LATITUDE_FIELDS = ('latitude', 'lat')
+LONGITUDE_FIELDS = ('longitude', 'long', 'lon', 'lng')
+
+
+def _field(row, names):
+    for name in names:
+        value = row.get(name)
+        if value not in (None, ''):
+            return value
+    raise ValueError(f"missing one of: {', '.join(names)}")
+
+
+def _record(row):
+    return {
+        'name': row['name'].strip(),
+        'latitude': float(_field(row, LATITUDE_FIELDS)),
+        'longitude': float(_field(row, LONGITUDE_FIELDS)),
+    }
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    if extension in FORMATS:
+        return extension
+    raise ValueError(f"Cannot tell the gazetteer format of {path}; pass one of: {', '.join(FORMATS)}")
+
+
+def _rows(path, file_format):
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if file_format == 'csv':
+            yield from csv.DictReader(f)
+        elif file_format == 'jsonl':
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            # A single JSON document has to be parsed whole; use JSON Lines or CSV for large gazetteers
+            data = json.load(f)
+            yield from data.get('districts', []) if isinstance(data, dict) else data
+
+
+def iter_gazetteer(path, file_format=None):
+    file_format = file_format or detect_format(path)
+    for number, row in enumerate(_rows(path, file_format), start=1):
+        try:
+            yield _record(row)
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            logger.warning(f"Skipping gazetteer row {number} in {path}: {e}")
+
+
+def load_gazetteer(path=DEFAULT_GAZETTEER, file_format=None, batch_size=LOAD_BATCH_SIZE, using=DEFAULT_DB_ALIAS,
+                   model=District):
+    # Upserts on the unique name, so reloading the same or an updated file is idempotent
+    records = iter_gazetteer(path, file_format)
+    count = 0
+    with transaction.atomic(using=using):
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                break
+            # A name repeated within one INSERT cannot be upserted twice; the last row wins
+            rows = {record['name']: record for record in batch}
+            model.objects.using(using).bulk_create(
+                [model(**record) for record in rows.values()],
+                update_conflicts=True,
+                unique_fields=['name'],
+                update_fields=['latitude', 'longitude'],
+            )
+            count += len(rows)
+        transaction.on_commit(invalidate_registry, using=using)
+    logger.info(f"Loaded {count} districts from {path}")
+    return count
+
+
+def seed_districts(sender, app_config=None, using=DEFAULT_DB_ALIAS, apps=None, verbosity=1, **kwargs):
+    # post_migrate hook: fill an empty table from the bundled gazetteer so requests never have to
+    try:
+        model = apps.get_model('districts', 'District') if apps else District
+    except LookupError:
+        return  # Migrated back past the District table
+    if model.objects.using(using).exists():
+        return
+    count = load_gazetteer(using=using, model=model)
+    if verbosity >= 2:
+        print(f"  Seeded {count} districts from {DEFAULT_GAZETTEER}")
@@ -0,0 +1,125 @@
+import logging
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .forecast_store import FLOAT32, HOUR, _nanmean
+from .models import ForecastDay
+from .records import DistrictMetrics
+
+logger = logging.getLogger(__name__)
+
+HOURS_PER_DAY = 24
+HISTORY_RETENTION_DAYS = getattr(settings, 'FORECAST_HISTORY_DAYS', 365)
+RECORD_BATCH_SIZE = 1000
+
+
+def _days(forecast, variable):
+    # Splits a forecast series into whole local days: (date, 24 float32 values) for every day with any data
+    values = forecast.variables[variable]
+    first_day = forecast.start.astype('datetime64[D]')
+    lead = int((forecast.start - first_day) // HOUR)
+    count = -(-(lead + len(values)) // HOURS_PER_DAY)
+    padded = np.full(count * HOURS_PER_DAY, np.nan, dtype=FLOAT32)
+    padded[lead:lead + len(values)] = values
+    per_day = padded.reshape(count, HOURS_PER_DAY)
+    for day in np.nonzero(~np.isnan(per_day).all(axis=1))[0]:
+        yield (first_day + day).item(), per_day[day]
+
+
+def record_forecasts(district_ids, *sources):
+    # Each source is a list of HourlyForecast (or None) aligned with district_ids, as for ForecastStore.build.
+    # The newest forecast for a day replaces the stored one, so past days end up with their last known values.
+    rows = {}
+    for source in sources:
+        for district_id, forecast in zip(district_ids, source):
+            if district_id is None or forecast is None:
+                continue
+            for variable in forecast.variables:
+                for date, values in _days(forecast, variable):
+                    rows[(district_id, variable, date)] = ForecastDay(
+                        district_id=district_id, variable=variable, date=date,
+                        values=values.tobytes(), fetched_at=forecast.fetched_at
+                    )
+    if not rows:
+        return 0
+
+    cutoff = max(date for _, _, date in rows) - timedelta(days=HISTORY_RETENTION_DAYS)
+    with transaction.atomic():
+        ForecastDay.objects.bulk_create(
+            list(rows.values()),
+            batch_size=RECORD_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['district', 'variable', 'date'],
+            update_fields=['values', 'fetched_at'],
+        )
+        ForecastDay.objects.filter(date__lt=cutoff).delete()
+    logger.info(f"Recorded {len(rows)} forecast days")
+    return len(rows)
+
+
+def load_days(variable, start_date, end_date, district_ids=None):
+    # Returns (district ids, [districts x hours] float32 matrix from start_date 00:00, oldest fetched_at per district)
+    days = (end_date - start_date).days + 1
+    queryset = ForecastDay.objects.filter(variable=variable, date__gte=start_date, date__lte=end_date)
+    if district_ids is not None:
+        queryset = queryset.filter(district_id__in=district_ids)
+    rows = list(queryset.values_list('district_id', 'date', 'values', 'fetched_at'))
+
+    ids = sorted({district_id for district_id, _, _, _ in rows})
+    positions = {district_id: position for position, district_id in enumerate(ids)}
+    matrix = np.full((len(ids), days * HOURS_PER_DAY), np.nan, dtype=FLOAT32)
+    fetched_at = np.full(len(ids), np.inf)
+    for district_id, date, values, row_fetched_at in rows:
+        position = positions[district_id]
+        offset = (date - start_date).days * HOURS_PER_DAY
+        matrix[position, offset:offset + HOURS_PER_DAY] = np.frombuffer(values, dtype=FLOAT32)
+        fetched_at[position] = min(fetched_at[position], row_fetched_at)
+    return ids, matrix, fetched_at
+
+
+def daily_at_hour(matrix, hour=14):
+    # [districts x days] values at the given local hour
+    return matrix[:, hour::HOURS_PER_DAY]
+
+
+def mean_at_hour(matrix, hour=14):
+    return _nanmean(daily_at_hour(matrix, hour), axis=1)
+
+
+def _value(value):
+    return None if np.isnan(value) else round(float(value), 2)
+
+
+def historical_metrics(registry, start_date, end_date, hour=14):
+    # Same shape as the live district metrics, averaged over the stored days instead of the forecast window
+    ids, temperatures, _ = load_days('temperature_2m', start_date, end_date)
+    temperature = dict(zip(ids, mean_at_hour(temperatures, hour)))
+    ids, pm25s, _ = load_days('pm2_5', start_date, end_date)
+    pm25 = dict(zip(ids, mean_at_hour(pm25s, hour)))
+    metrics = []
+    for record in registry:
+        avg_temperature = _value(temperature.get(record.id, np.nan))
+        avg_pm25 = _value(pm25.get(record.id, np.nan))
+        if avg_temperature is None or avg_pm25 is None:
+            continue
+        metrics.append(DistrictMetrics(record.name, record.latitude, record.longitude, avg_temperature, avg_pm25))
+    return metrics
+
+
+def district_history(record, start_date, end_date, hour=14):
+    days = (end_date - start_date).days + 1
+    series = {}
+    for variable in ('temperature_2m', 'pm2_5'):
+        ids, matrix, _ = load_days(variable, start_date, end_date, [record.id])
+        series[variable] = daily_at_hour(matrix, hour)[0] if ids else np.full(days, np.nan)
+    return [
+        {
+            'date': (start_date + timedelta(days=day)).isoformat(),
+            'temperature': _value(series['temperature_2m'][day]),
+            'pm25': _value(series['pm2_5'][day])
+        }
+        for day in range(days)
+    ]
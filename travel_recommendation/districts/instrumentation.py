@@ -0,0 +1,156 @@
+import math
+import threading
+from bisect import bisect_left
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+# Prometheus-text metrics kept in process memory. Each worker process exposes its own on /metrics,
+# so scrape every worker (or sum them in the query). Label values are passed positionally.
+
+_metrics = []
+_collectors = []
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}' for labels, value in values]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(set(buckets)))  # A repeated bound would be a duplicate series
+        self._lock = threading.Lock()
+        self._values = {}  # labels -> [per-bucket counts (last is +Inf), sum]
+        _metrics.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def count(self, *labels):
+        with self._lock:
+            entry = self._values.get(labels)
+            return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        lines = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+def register_collector(collector):
+    # collector() returns (name, type, documentation, [(labels dict, value)]) tuples, read at scrape time
+    _collectors.append(collector)
+    return collector
+
+
+def render_metrics():
+    lines = []
+    for metric in _metrics:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        lines.extend(metric.samples())
+    for collector in _collectors:
+        for name, metric_type, documentation, samples in collector():
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for labels, value in samples:
+                lines.append(f'{name}{_labels(labels.keys(), labels.values())} {_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+REQUEST_SECONDS = Histogram(
+    'districts_request_duration_seconds', 'Time to produce a response, by view', ('view', 'method', 'status')
+)
+UPSTREAM_SECONDS = Histogram(
+    'districts_upstream_request_duration_seconds', 'Open-Meteo request time until the body is read',
+    ('endpoint', 'status')
+)
+JSON_PARSE_SECONDS = Histogram(
+    'districts_upstream_json_parse_seconds', 'Time to parse an Open-Meteo response body', ('endpoint',),
+    buckets=FAST_BUCKETS
+)
+RATE_LIMIT_WAIT_SECONDS = Histogram(
+    'districts_upstream_rate_limit_wait_seconds', 'Time waiting for a rate limiter token', ('endpoint',),
+    buckets=FAST_BUCKETS + LATENCY_BUCKETS[7:]
+)
+SEMAPHORE_WAIT_SECONDS = Histogram(
+    'districts_upstream_semaphore_wait_seconds', 'Time waiting for an upstream concurrency slot', ('endpoint',),
+    buckets=FAST_BUCKETS + LATENCY_BUCKETS[7:]
+)
+UPSTREAM_THROTTLED = Counter('districts_upstream_throttled_total', '429 responses from Open-Meteo', ('endpoint',))
+UPSTREAM_RETRIED = Counter('districts_upstream_retries_total', 'Upstream requests retried', ('endpoint',))
+UPSTREAM_HEDGED = Counter('districts_upstream_hedged_total', 'Hedged duplicate upstream requests sent', ('endpoint',))
+UPSTREAM_SHORT_CIRCUITED = Counter(
+    'districts_upstream_short_circuited_total', 'Upstream calls skipped because the circuit was open', ('endpoint',)
+)
+CACHE_REQUESTS = Counter(
+    'districts_cache_requests_total',
+    'Cache lookups by key family and result: hit, stale (served or refreshed past its freshness), miss, '
+    'file (loaded from the metrics snapshot file)',
+    ('family', 'result')
+)
+LATENCY_BUDGET_EXCEEDED = Counter(
+    'districts_latency_budget_exceeded_total', 'Travel forecasts answered from the cache when the budget ran out',
+    ('family',)
+)
@@ -0,0 +1,125 @@
+import json
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from districts.benchmark import SCENARIOS, run_benchmark, serialization_benchmark
+from districts.registry import get_registry
+from districts.replay import load_recordings, record_responses
+from districts.runtime import get_session_pool, runtime
+from districts.services import (
+    AIR_QUALITY_API_URL, AIR_QUALITY_GRID_RESOLUTION, AIR_QUALITY_VARIABLES, WEATHER_API_URL, WEATHER_GRID_RESOLUTION,
+    WEATHER_VARIABLES
+)
+from districts.throttle import get_upstream_semaphore
+
+
+class Command(BaseCommand):
+    help = ("Load-test /top-districts/ and /travel-recommendation/ against a local Open-Meteo replay server, "
+            "with a throwaway database and cache")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS),
+                            help="Scenarios to run, in order")
+        parser.add_argument('--requests', type=int, default=200,
+                            help="Requests per scenario (repetitions with --serialization)")
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help="Simultaneous clients")
+        parser.add_argument('--latency', type=float, default=0.05,
+                            help="Seconds the replay server waits before answering")
+        parser.add_argument('--jitter', type=float, default=0.02,
+                            help="Random extra latency, up to this many seconds")
+        parser.add_argument('--throttle-rate', type=float, default=0.0,
+                            help="Fraction of upstream requests answered with 429")
+        parser.add_argument('--retry-after', type=int, default=1,
+                            help="Retry-After seconds sent with injected 429s")
+        parser.add_argument('--recordings',
+                            help="Responses saved with --record; synthetic forecasts are served without one")
+        parser.add_argument('--record', metavar='PATH',
+                            help="Fetch the current forecasts for every district from Open-Meteo into PATH and exit")
+        parser.add_argument('--seed', type=int, default=0,
+                            help="Seed for jitter and 429 injection")
+        parser.add_argument('--serialization', action='store_true',
+                            help="Compare metrics snapshot rendering, memory and cache size of the dict + DRF "
+                                 "serializer path and DistrictMetrics records instead of load-testing")
+        parser.add_argument('--districts', type=int, default=64,
+                            help="Districts per snapshot with --serialization")
+        parser.add_argument('--json', action='store_true',
+                            help="Print the results as JSON")
+
+    def handle(self, *args, **options):
+        if options['record']:
+            self.record(options['record'])
+            return
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError("--requests and --concurrency must be positive integers")
+        if options['serialization']:
+            self.serialization(options)
+            return
+        if not 0.0 <= options['throttle_rate'] <= 1.0:
+            raise CommandError("--throttle-rate must be between 0 and 1")
+
+        recordings = None
+        if options['recordings']:
+            try:
+                recordings = load_recordings(options['recordings'])
+            except (OSError, ValueError) as e:
+                raise CommandError(str(e))
+
+        if not options['json'] and options['verbosity'] < 2:
+            # Stale-while-revalidate and budget warnings are expected under load
+            logging.getLogger('districts').setLevel(logging.ERROR)
+        results = run_benchmark(
+            options['scenarios'], options['requests'], options['concurrency'], recordings=recordings,
+            latency=options['latency'], jitter=options['jitter'], throttle_rate=options['throttle_rate'],
+            retry_after=options['retry_after'], seed=options['seed']
+        )
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'scenario':<10}{'requests':>9}{'errors':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+                          f"{'req/s':>9}{'weather':>9}{'air':>6}{'429':>6}")
+        for result in results:
+            upstream = result['upstream']
+            self.stdout.write(
+                f"{result['scenario']:<10}{result['requests']:>9}{result['errors']:>7}{result['p50_ms']:>9.1f}"
+                f"{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}{result['requests_per_second']:>9.1f}"
+                f"{upstream['weather']:>9}{upstream['air_quality']:>6}{upstream['throttled']:>6}"
+            )
+
+    def serialization(self, options):
+        if options['districts'] < 1:
+            raise CommandError("--districts must be a positive integer")
+        results = serialization_benchmark(options['districts'], options['requests'])
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'path':<20}{'districts':>10}{'render us':>11}{'decode us':>11}{'memory KiB':>12}"
+                          f"{'cache bytes':>13}")
+        for result in results:
+            self.stdout.write(
+                f"{result['path']:<20}{result['districts']:>10}{result['render_us']:>11.1f}"
+                f"{result['decode_us']:>11.1f}{result['memory_bytes'] / 1024:>12.1f}{result['cache_bytes']:>13}"
+            )
+
+    def record(self, path):
+        districts = get_registry().locations()
+        if not districts:
+            raise CommandError("No districts to record")
+        locations = [(district['latitude'], district['longitude']) for district in districts]
+        families = [
+            ('weather', WEATHER_API_URL, WEATHER_VARIABLES, WEATHER_GRID_RESOLUTION),
+            ('air_quality', AIR_QUALITY_API_URL, AIR_QUALITY_VARIABLES, AIR_QUALITY_GRID_RESOLUTION),
+        ]
+
+        async def fetch():
+            return await record_responses(path, locations, families, get_session_pool(), get_upstream_semaphore())
+
+        try:
+            counts = runtime.run(fetch())
+        except OSError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Recorded {counts['weather']} weather and {counts['air_quality']} air quality locations to {path}"
+        ))
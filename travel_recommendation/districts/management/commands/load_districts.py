@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from districts.gazetteer import DEFAULT_GAZETTEER, FORMATS, LOAD_BATCH_SIZE, load_gazetteer
+
+
+class Command(BaseCommand):
+    help = "Insert or update districts from a gazetteer file (JSON, JSON Lines or CSV) in one transaction"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=DEFAULT_GAZETTEER,
+                            help="Gazetteer file with name and lat/long per row (defaults to the bundled districts)")
+        parser.add_argument('--format', choices=FORMATS,
+                            help="File format; guessed from the extension when omitted")
+        parser.add_argument('--batch-size', type=int, default=LOAD_BATCH_SIZE,
+                            help="Rows per bulk upsert")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help="Database to load into")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be a positive integer")
+        try:
+            count = load_gazetteer(options['path'], file_format=options['format'],
+                                   batch_size=options['batch_size'], using=options['database'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"Loaded {count} districts from {options['path']}"))
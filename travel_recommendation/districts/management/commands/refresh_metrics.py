@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from districts.scheduler import MetricsRefresher
+from districts.services import METRICS_REFRESH_INTERVAL
+
+
+class Command(BaseCommand):
+    help = "Recompute the cached district metrics snapshot ahead of expiry"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help="Recompute even if the current snapshot is still fresh")
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep running and refresh whenever the snapshot is due")
+        parser.add_argument('--interval', type=int, default=METRICS_REFRESH_INTERVAL,
+                            help="Refresh the snapshot once it is older than this many seconds")
+
+    def handle(self, *args, **options):
+        refresher = MetricsRefresher(interval=options['interval'])
+        if options['loop']:
+            try:
+                refresher.run_forever()
+            except KeyboardInterrupt:
+                pass
+            return
+
+        try:
+            snapshot = refresher.run_once(force=options['force'])
+        except Exception as e:
+            raise CommandError(f"District metrics refresh failed: {e}")
+        if snapshot is None:
+            self.stdout.write(self.style.WARNING("Refresh skipped: another worker holds the metrics lock"))
+            return
+        self.stdout.write(self.style.SUCCESS(f"District metrics snapshot holds {len(snapshot['metrics'])} districts"))
@@ -0,0 +1,37 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .instrumentation import REQUEST_SECONDS
+
+
+class RequestMetricsMiddleware:
+    # Times every request, labelled by URL name, into districts_request_duration_seconds.
+    # Streaming responses are timed until the response object is returned, not until the last byte.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self._acall(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self._observe(request, response, started)
+        return response
+
+    async def _acall(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self._observe(request, response, started)
+        return response
+
+    def _observe(self, request, response, started):
+        match = request.resolver_match
+        view = match.url_name if match and match.url_name else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - started, view, request.method, str(response.status_code))
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('districts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ForecastDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('variable', models.CharField(max_length=32)),
+                ('date', models.DateField()),
+                ('values', models.BinaryField()),
+                ('fetched_at', models.FloatField()),
+                ('district', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='forecast_days', to='districts.district')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['variable', 'date'], name='districts_f_variabl_37d4bd_idx')],
+                'constraints': [models.UniqueConstraint(fields=('district', 'variable', 'date'), name='unique_forecast_day')],
+            },
+        ),
+    ]
@@ -6,4 +6,24 @@ class District(models.Model):
     longitude = models.FloatField()
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+
+class ForecastDay(models.Model):
+    # One row per district, variable and local day: 24 hourly values as little-endian float32 (NaN = missing)
+    district = models.ForeignKey(District, on_delete=models.CASCADE, related_name='forecast_days')
+    variable = models.CharField(max_length=32)
+    date = models.DateField()
+    values = models.BinaryField()
+    fetched_at = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['district', 'variable', 'date'], name='unique_forecast_day'),
+        ]
+        indexes = [
+            models.Index(fields=['variable', 'date']),
+        ]
+
+    def __str__(self):
+        return f"{self.district} {self.variable} {self.date}"
@@ -0,0 +1,225 @@
+import json
+import struct
+import warnings
+
+import numpy as np
+from django.conf import settings
+
+DEFAULT_SORT = 'temperature'
+DEFAULT_LIMIT = 10
+
+# Criteria for weighted rankings: API name -> Open-Meteo hourly variable. Higher values count against a district
+# unless its weight is negative.
+FEATURES = {
+    'temperature': 'temperature_2m',
+    'humidity': 'relative_humidity_2m',
+    'precipitation': 'precipitation',
+    'uv_index': 'uv_index',
+    'pm25': 'pm2_5',
+    'pm10': 'pm10',
+    'ozone': 'ozone',
+}
+DEFAULT_PROFILE = 'combined'
+PROFILES = {
+    'combined': {'temperature': 1.0, 'pm25': 1.0},
+    'outdoor': {'temperature': 1.0, 'precipitation': 1.0, 'uv_index': 0.5, 'pm25': 1.0},
+    'clean_air': {'pm25': 1.0, 'pm10': 0.5, 'ozone': 0.5},
+    'comfort': {'temperature': 1.0, 'humidity': 1.0, 'precipitation': 0.5},
+    **getattr(settings, 'RANKING_PROFILES', {}),
+}
+
+_ORDERING_HEADER = struct.Struct('<BII')  # sort name length, JSON length, element count
+_FEATURES_HEADER = struct.Struct('<III')  # JSON length, district count, variable count
+
+
+def _normalized(values):
+    spread = values.max() - values.min() if len(values) else 0
+    return (values - values.min()) / spread if spread else np.zeros_like(values)
+
+
+def _orderings(metrics):
+    temps = np.array([district.avg_temperature for district in metrics], dtype=np.float64)
+    pm25s = np.array([district.avg_pm25 for district in metrics], dtype=np.float64)
+    # np.lexsort sorts by the last key first
+    return {
+        'temperature': np.lexsort((pm25s, temps)),  # coolest first, cleaner air breaks ties
+        'pm25': np.lexsort((temps, pm25s)),  # cleanest first, cooler breaks ties
+        'combined': np.lexsort((temps, (_normalized(temps) + _normalized(pm25s)) / 2)),
+    }
+
+
+class RankingIndex:
+    __slots__ = ('orderings',)
+
+    SORTS = ('temperature', 'pm25', 'combined')
+
+    def __init__(self, orderings):
+        # sort -> (JSON array of every district in that order, end offset of each element in it)
+        self.orderings = orderings
+
+    @classmethod
+    def build(cls, metrics):
+        # Same bytes DRF's JSONRenderer would produce for TopDistrictSerializer, rendered once per refresh
+        items = [metric.to_json() for metric in metrics]
+        orderings = {}
+        for sort, order in _orderings(metrics).items():
+            parts = [items[i] for i in order]
+            offsets = []
+            end = 0
+            for part in parts:
+                end += 1 + len(part)  # opening bracket or separating comma, then the element
+                offsets.append(end)
+            orderings[sort] = (b'[' + b','.join(parts) + b']', tuple(offsets))
+        return cls(orderings)
+
+    def to_bytes(self):
+        parts = []
+        for sort, (blob, offsets) in self.orderings.items():
+            name = sort.encode('utf-8')
+            parts.append(_ORDERING_HEADER.pack(len(name), len(blob), len(offsets)))
+            parts.append(name)
+            parts.append(blob)
+            parts.append(np.asarray(offsets, dtype='<u4').tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        orderings = {}
+        offset = 0
+        while offset < len(data):
+            name_length, blob_length, count = _ORDERING_HEADER.unpack_from(data, offset)
+            offset += _ORDERING_HEADER.size
+            sort = bytes(data[offset:offset + name_length]).decode('utf-8')
+            offset += name_length
+            blob = bytes(data[offset:offset + blob_length])
+            offset += blob_length
+            offsets = tuple(np.frombuffer(data, dtype='<u4', count=count, offset=offset).tolist())
+            offset += count * 4
+            orderings[sort] = (blob, offsets)
+        return cls(orderings)
+
+    def __len__(self):
+        return len(self.orderings['temperature'][1]) if self.orderings else 0
+
+    def top(self, sort=DEFAULT_SORT, limit=DEFAULT_LIMIT):
+        blob, offsets = self.orderings[sort]
+        if limit >= len(offsets):
+            return blob
+        if limit <= 0:
+            return b'[]'
+        return blob[:offsets[limit - 1]] + b']'
+
+
+class FeatureIndex:
+    __slots__ = ('names', 'coordinates', 'variables', 'minimums', 'spans', 'prefix', 'missing')
+
+    def __init__(self, names, coordinates, variables, minimums, spans, prefix, missing=None):
+        self.names = names
+        self.coordinates = coordinates  # districts x 2 (latitude, longitude)
+        self.variables = variables
+        # Per-variable min-max normalization: raw = normalized * span + minimum (NaN if nothing was forecast)
+        self.minimums = minimums
+        self.spans = spans
+        # districts x 25 x variables running sums of the normalized hour-of-day means, so the mean over any hour
+        # window is two lookups whatever its length
+        self.prefix = prefix
+        # districts x variables, True where the district had no forecast at all and the prefix holds only the fill
+        self.missing = np.zeros((len(names), len(variables)), dtype=bool) if missing is None else missing
+
+    @classmethod
+    def build(cls, districts, store, variables=tuple(FEATURES.values())):
+        # store is the ForecastStore the metrics were computed from; built once per refresh
+        hourly = np.stack([store.hour_of_day_means(variable) for variable in variables], axis=-1)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)  # Variables missing for every district
+            minimums = np.nanmin(hourly, axis=(0, 1))
+            spans = np.nanmax(hourly, axis=(0, 1)) - minimums
+            # A district missing a value scores as the average of the others at that hour, so it is neither
+            # favoured nor penalized; a variable missing everywhere is 0 for all and does not change the order
+            fill = np.nanmean(hourly, axis=0, keepdims=True)
+        spans = np.where(np.isnan(spans) | (spans == 0), 1.0, spans)
+        missing = np.isnan(hourly).all(axis=1)
+        hourly = np.where(np.isnan(hourly), fill, hourly)
+        normalized = np.nan_to_num((hourly - minimums) / spans)
+        prefix = np.zeros((len(districts), 25, len(variables)))
+        np.cumsum(normalized, axis=1, out=prefix[:, 1:])
+        coordinates = np.array([[district['latitude'], district['longitude']] for district in districts],
+                               dtype=np.float64).reshape(-1, 2)
+        return cls([district['name'] for district in districts], coordinates, list(variables), minimums, spans, prefix,
+                   missing)
+
+    def to_bytes(self):
+        header = json.dumps({'names': self.names, 'variables': self.variables}, ensure_ascii=False).encode('utf-8')
+        return b''.join([
+            _FEATURES_HEADER.pack(len(header), len(self.names), len(self.variables)),
+            header,
+            *(np.asarray(array, dtype='<f8').tobytes()
+              for array in (self.coordinates, self.minimums, self.spans, self.prefix)),
+            np.asarray(self.missing, dtype=np.uint8).tobytes(),
+        ])
+
+    @classmethod
+    def from_bytes(cls, data):
+        header_length, districts, variables = _FEATURES_HEADER.unpack_from(data, 0)
+        offset = _FEATURES_HEADER.size
+        header = json.loads(bytes(data[offset:offset + header_length]))
+        offset += header_length
+        arrays = []
+        for shape in ((districts, 2), (variables,), (variables,), (districts, 25, variables)):
+            count = int(np.prod(shape))
+            arrays.append(np.frombuffer(data, dtype='<f8', count=count, offset=offset).reshape(shape))
+            offset += count * 8
+        coordinates, minimums, spans, prefix = arrays
+        # Encodings from before the mask have none; every value then counts as forecast
+        missing = None
+        if len(data) - offset >= districts * variables:
+            missing = np.frombuffer(data, dtype=np.uint8, count=districts * variables, offset=offset)
+            missing = missing.reshape(districts, variables).astype(bool)
+        return cls(header['names'], coordinates, header['variables'], minimums, spans, prefix, missing)
+
+    def __len__(self):
+        return len(self.names)
+
+    def window_means(self, first_hour, last_hour):
+        # Normalized means over local hours first_hour..last_hour inclusive, wrapping past midnight if last < first
+        if first_hour <= last_hour:
+            total = self.prefix[:, last_hour + 1] - self.prefix[:, first_hour]
+            hours = last_hour - first_hour + 1
+        else:
+            total = self.prefix[:, 24] - self.prefix[:, first_hour] + self.prefix[:, last_hour + 1]
+            hours = 24 - first_hour + last_hour + 1
+        return total / hours
+
+    def scores(self, weights, first_hour=14, last_hour=14):
+        # weights: API feature name -> weight. The score is the weighted mean of the normalized window means,
+        # so with non-negative weights it is between 0 and 1, lower being better.
+        vector = np.array([weights.get(name, 0.0) for name in self._feature_names()])
+        total = np.abs(vector).sum()
+        window = self.window_means(first_hour, last_hour)
+        return window @ (vector / total if total else vector), window
+
+    def top(self, weights, first_hour=14, last_hour=14, limit=DEFAULT_LIMIT):
+        scores, window = self.scores(weights, first_hour, last_hour)
+        count = min(limit, len(scores))
+        if count <= 0:
+            return []
+        # Only the requested top-k are sorted; ties keep the district order
+        candidates = np.argpartition(scores, count - 1)[:count] if count < len(scores) else np.arange(len(scores))
+        order = candidates[np.lexsort((candidates, scores[candidates]))]
+        # Filled values only keep the district neutral in the score; they are not reported as its own
+        values = np.where(self.missing[order], np.nan, (window[order] * self.spans + self.minimums).round(2))
+        names = self._feature_names()
+        return [
+            {
+                'name': self.names[i],
+                'latitude': float(self.coordinates[i, 0]),
+                'longitude': float(self.coordinates[i, 1]),
+                'score': round(float(scores[i]), 4),
+                **{name: None if np.isnan(value) else float(value) for name, value in zip(names, row)},
+            }
+            for i, row in zip(order.tolist(), values)
+        ]
+
+    def _feature_names(self):
+        variables = {variable: name for name, variable in FEATURES.items()}
+        return [variables.get(variable, variable) for variable in self.variables]
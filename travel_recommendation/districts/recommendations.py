@@ -0,0 +1,156 @@
+import numpy as np
+
+from .forecast_store import HOUR, at_2pm, to_hour
+
+DEFAULT_TEMPERATURE = 35.0
+DEFAULT_PM25 = 50.0
+DEFAULT_WINDOWS = ((14, 14), (6, 11), (12, 17), (18, 23))  # Local hours, inclusive; 14 is the single-date answer
+
+
+def recommendation_text(temp_diff, pm25_diff):
+    if temp_diff > 0 and pm25_diff > 0:
+        recommendation = "Recommended"
+        reason = f"Your destination is {temp_diff:.1f}°C cooler and has {pm25_diff:.1f} µg/m³ better air quality. Enjoy your trip!"
+    else:
+        recommendation = "Not Recommended"
+        reasons = []
+        if temp_diff <= 0:
+            reasons.append(f"hotter by {abs(temp_diff):.1f}°C" if temp_diff < 0 else "same temperature")
+        if pm25_diff <= 0:
+            reasons.append(
+                f"worse air quality by {abs(pm25_diff):.1f} µg/m³" if pm25_diff < 0 else "same air quality")
+        reason = f"Your destination is {' and '.join(reasons)} than your current district. It’s better to stay where you are."
+    return recommendation, reason
+
+
+def build_recommendation(current_data, dest_data):
+    current_temp = current_data['temp']
+    current_pm25 = current_data['pm25']
+    dest_temp = dest_data['temp']
+    dest_pm25 = dest_data['pm25']
+
+    recommendation, reason = recommendation_text(current_temp - dest_temp, current_pm25 - dest_pm25)
+    return {
+        'recommendation': recommendation,
+        'reason': reason,
+        'current': {'temp': current_temp, 'pm25': current_pm25},
+        'destination': {'temp': dest_temp, 'pm25': dest_pm25},
+        'degraded': current_data.get('degraded', False) or dest_data.get('degraded', False)
+    }
+
+
+def _lookup(matrix, rows, columns, default):
+    values = np.full(len(rows), np.nan, dtype=np.float64)
+    found = columns >= 0
+    values[found] = matrix[rows[found], columns[found]]
+    # float32 storage noise (27.200000762939453) is rounded away; upstream sends at most two decimals
+    return np.where(np.isnan(values), default, values).round(4)
+
+
+def compare_trips(store, trips):
+    # trips: (origin name, destination name, travel date) tuples whose districts are all in the store
+    origins = np.array([store.row(origin) for origin, _, _ in trips], dtype=np.intp)
+    destinations = np.array([store.row(destination) for _, destination, _ in trips], dtype=np.intp)
+    columns = [store.column(at_2pm(travel_date)) for _, _, travel_date in trips]
+    columns = np.array([-1 if column is None else column for column in columns], dtype=np.intp)
+
+    temperature = store.matrix('temperature_2m')
+    pm25 = store.matrix('pm2_5')
+    current_temps = _lookup(temperature, origins, columns, DEFAULT_TEMPERATURE)
+    current_pm25s = _lookup(pm25, origins, columns, DEFAULT_PM25)
+    dest_temps = _lookup(temperature, destinations, columns, DEFAULT_TEMPERATURE)
+    dest_pm25s = _lookup(pm25, destinations, columns, DEFAULT_PM25)
+    temp_diffs = current_temps - dest_temps
+    pm25_diffs = current_pm25s - dest_pm25s
+
+    results = []
+    for i in range(len(trips)):
+        recommendation, reason = recommendation_text(temp_diffs[i], pm25_diffs[i])
+        results.append({
+            'recommendation': recommendation,
+            'reason': reason,
+            'current': {'temp': float(current_temps[i]), 'pm25': float(current_pm25s[i])},
+            'destination': {'temp': float(dest_temps[i]), 'pm25': float(dest_pm25s[i])}
+        })
+    return results
+
+
+def window_label(first, last):
+    return str(first) if first == last else f"{first}-{last}"
+
+
+def _day_columns(store, dates):
+    # days x 24 store columns for each local hour of each date, -1 where the store does not cover it
+    if not len(store.time):
+        return np.full((len(dates), 24), -1, dtype=np.intp)
+    offsets = np.array([(to_hour(day) - store.time[0]) // HOUR for day in dates], dtype=np.intp)
+    columns = offsets[:, None] + np.arange(24)
+    return np.where((columns >= 0) & (columns < len(store.time)), columns, -1)
+
+
+def _window_means(values, windows):
+    # values: ... x 24 hours, NaN where missing. Means over each window from running sums of the values and of
+    # how many are present, so every window of every day comes out of the same two arrays: ... x windows.
+    present = ~np.isnan(values)
+    sums = np.zeros(values.shape[:-1] + (25,))
+    counts = np.zeros(values.shape[:-1] + (25,))
+    np.cumsum(np.where(present, values, 0.0), axis=-1, out=sums[..., 1:])
+    np.cumsum(present, axis=-1, out=counts[..., 1:])
+    firsts = np.array([first for first, _ in windows], dtype=np.intp)
+    ends = np.array([last + 1 for _, last in windows], dtype=np.intp)
+    count = counts[..., ends] - counts[..., firsts]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, (sums[..., ends] - sums[..., firsts]) / count, np.nan)
+
+
+def _normalized_days(values):
+    spread = values.max(axis=0) - values.min(axis=0)
+    return np.divide(values - values.min(axis=0), spread, out=np.zeros_like(values), where=spread > 0)
+
+
+def compare_days(store, origin, destination, dates, windows=DEFAULT_WINDOWS):
+    # Every date x hour window for one trip, from the two districts' rows of the store. Returns the per-day
+    # results and, per window, the date with the best recommended conditions (None if no day is recommended).
+    # A day without any forecast for either district gets None windows rather than answers made of defaults.
+    rows = np.array([store.row(origin), store.row(destination)], dtype=np.intp)
+    columns = _day_columns(store, dates)
+    covered = columns >= 0
+    means = []
+    available = np.ones(len(dates), dtype=bool)
+    for variable, default in (('temperature_2m', DEFAULT_TEMPERATURE), ('pm2_5', DEFAULT_PM25)):
+        values = np.full((2, len(dates), 24), np.nan)
+        values[:, covered] = store.matrix(variable)[rows][:, columns[covered]]
+        available &= ~np.isnan(values).all(axis=2).any(axis=0)
+        variable_means = _window_means(values, windows)  # origin/destination x days x windows
+        means.append(np.where(np.isnan(variable_means), default, variable_means).round(2))
+    (current_temps, dest_temps), (current_pm25s, dest_pm25s) = means
+    temp_diffs = current_temps - dest_temps
+    pm25_diffs = current_pm25s - dest_pm25s
+    recommended = (temp_diffs > 0) & (pm25_diffs > 0) & available[:, None]
+
+    # Best day per window: the largest combined improvement among recommended days, each normalised over the days
+    scores = np.where(recommended, _normalized_days(temp_diffs) + _normalized_days(pm25_diffs), -np.inf)
+    best = np.argmax(scores, axis=0)
+
+    days = []
+    for d, day in enumerate(dates):
+        if not available[d]:
+            days.append({'date': day.isoformat(), 'windows': None})
+            continue
+        day_windows = []
+        for w, (first, last) in enumerate(windows):
+            recommendation, reason = recommendation_text(temp_diffs[d, w], pm25_diffs[d, w])
+            day_windows.append({
+                'hours': window_label(first, last),
+                'recommendation': recommendation,
+                'reason': reason,
+                'current': {'temp': float(current_temps[d, w]), 'pm25': float(current_pm25s[d, w])},
+                'destination': {'temp': float(dest_temps[d, w]), 'pm25': float(dest_pm25s[d, w])}
+            })
+        days.append({'date': day.isoformat(), 'windows': day_windows})
+    best_dates = [
+        {'hours': window_label(first, last),
+         'best_date': dates[best[w]].isoformat() if recommended[best[w], w] else None}
+        for w, (first, last) in enumerate(windows)
+    ]
+    return days, best_dates
@@ -0,0 +1,69 @@
+import math
+from json.encoder import encode_basestring
+
+
+def _float(value):
+    # json.dumps(allow_nan=False) semantics: repr of the float, NaN and infinities rejected
+    if not math.isfinite(value):
+        raise ValueError(f"Out of range float values are not JSON compliant: {value!r}")
+    return repr(value)
+
+
+def _string(value):
+    # JSONRenderer also escapes the two line separators JavaScript does not allow in string literals
+    return encode_basestring(value).replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+
+
+class DistrictMetrics:
+    # One district's 2pm averages. Replaces the per-district dict: no per-instance __dict__, a fixed field
+    # order the cache codec writes as a bare row, and a JSON encoder producing the same bytes as
+    # TopDistrictSerializer + JSONRenderer without going through DRF. Read access by key still works,
+    # so code written against the dicts (and snapshots cached as dicts) keeps working.
+    __slots__ = ('name', 'latitude', 'longitude', 'avg_temperature', 'avg_pm25')
+
+    FIELDS = __slots__
+
+    def __init__(self, name, latitude, longitude, avg_temperature, avg_pm25):
+        self.name = str(name)
+        self.latitude = float(latitude)
+        self.longitude = float(longitude)
+        self.avg_temperature = float(avg_temperature)
+        self.avg_pm25 = float(avg_pm25)
+
+    @classmethod
+    def from_row(cls, row):
+        # Rows come from the cache codec and already hold the right types; skip the conversions in __init__
+        record = cls.__new__(cls)
+        record.name, record.latitude, record.longitude, record.avg_temperature, record.avg_pm25 = row
+        return record
+
+    def to_row(self):
+        return [self.name, self.latitude, self.longitude, self.avg_temperature, self.avg_pm25]
+
+    def to_json(self):
+        return (
+            f'{{"name":{_string(self.name)},"latitude":{_float(self.latitude)},'
+            f'"longitude":{_float(self.longitude)},"avg_temperature":{_float(self.avg_temperature)},'
+            f'"avg_pm25":{_float(self.avg_pm25)}}}'
+        ).encode('utf-8')
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.FIELDS else default
+
+    def __eq__(self, other):
+        if isinstance(other, DistrictMetrics):
+            return self.to_row() == other.to_row()
+        return NotImplemented
+
+    def __repr__(self):
+        return f"DistrictMetrics({', '.join(f'{field}={getattr(self, field)!r}' for field in self.FIELDS)})"
+
+
+def metrics_json(metrics):
+    # JSON array of DistrictMetrics, as the list serializer would render it
+    return b'[' + b','.join(metric.to_json() for metric in metrics) + b']'
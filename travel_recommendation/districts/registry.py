@@ -0,0 +1,144 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import namedtuple
+from types import MappingProxyType
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import District
+from .spatial import SpatialIndex
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_VERSION_KEY = 'district_registry_version'
+REGISTRY_CHECK_INTERVAL = getattr(settings, 'DISTRICT_REGISTRY_CHECK_INTERVAL', 30)  # Seconds between cross-process checks
+
+DistrictRecord = namedtuple('DistrictRecord', ['id', 'name', 'latitude', 'longitude'])
+
+
+def fetch_districts_data():
+    json_path = os.path.join(settings.BASE_DIR, 'data', 'bd-districts.json')
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        districts = [
+            {
+                'name': district['name'],
+                'latitude': float(district['lat']),
+                'longitude': float(district['long'])
+            }
+            for district in data.get('districts', [])
+        ]
+        logger.info(f"Loaded {len(districts)} districts from JSON")
+        return districts
+    except Exception as e:
+        logger.error(f"Error loading districts data: {e}")
+        return []
+
+
+class DistrictRegistry:
+    # Immutable snapshot of the District table, shared by every request in the process.
+    # Falls back to the bundled JSON (records without ids) while the table is still empty.
+
+    __slots__ = ('districts', 'by_name', 'by_id', 'source', 'version', 'spatial')
+
+    def __init__(self, records, source):
+        self.districts = tuple(sorted(records, key=lambda record: record.name))
+        self.by_name = MappingProxyType({record.name: record for record in self.districts})
+        self.by_id = MappingProxyType({record.id: record for record in self.districts if record.id is not None})
+        self.source = source
+        self.version = hashlib.sha1(repr(self.districts).encode('utf-8')).hexdigest()[:12]
+        self.spatial = SpatialIndex([record.latitude for record in self.districts],
+                                    [record.longitude for record in self.districts])
+
+    @classmethod
+    def load(cls):
+        records = [DistrictRecord(*row) for row in District.objects.values_list('id', 'name', 'latitude', 'longitude')]
+        if records:
+            return cls(records, 'database')
+        records = [
+            DistrictRecord(None, district['name'], district['latitude'], district['longitude'])
+            for district in fetch_districts_data()
+        ]
+        return cls(records, 'file')
+
+    def __len__(self):
+        return len(self.districts)
+
+    def __iter__(self):
+        return iter(self.districts)
+
+    def get(self, name):
+        # Raises like District.objects.get(name=...) so views keep their error handling
+        try:
+            return self.by_name[name]
+        except KeyError:
+            raise District.DoesNotExist(f"District {name!r} does not exist") from None
+
+    def nearest(self, latitude, longitude, k=1):
+        indices, distances = self.spatial.nearest(latitude, longitude, k)
+        return [(self.districts[i], float(distance)) for i, distance in zip(indices, distances)]
+
+    def within(self, latitude, longitude, radius_km):
+        indices, distances = self.spatial.within(latitude, longitude, radius_km)
+        return [(self.districts[i], float(distance)) for i, distance in zip(indices, distances)]
+
+    def locations(self):
+        return [
+            {'name': record.name, 'latitude': record.latitude, 'longitude': record.longitude}
+            for record in self.districts
+        ]
+
+
+_lock = threading.Lock()
+_registry = None
+_registry_token = None
+_checked_at = 0.0
+
+
+def _current_token():
+    token = cache.get(REGISTRY_VERSION_KEY)
+    if token is None:
+        token = uuid.uuid4().hex
+        if not cache.add(REGISTRY_VERSION_KEY, token, timeout=None):
+            token = cache.get(REGISTRY_VERSION_KEY)
+    return token
+
+
+def get_registry():
+    global _registry, _registry_token, _checked_at
+    registry = _registry
+    now = time.monotonic()
+    if registry is not None and now - _checked_at < REGISTRY_CHECK_INTERVAL:
+        return registry
+
+    with _lock:
+        # Another worker process may have changed the table; it bumps the shared token when it does
+        token = _current_token()
+        if _registry is None or token != _registry_token:
+            _registry = DistrictRegistry.load()
+            _registry_token = token
+            logger.info(f"Loaded {len(_registry)} districts into the registry from {_registry.source}")
+        _checked_at = now
+        return _registry
+
+
+async def aget_registry():
+    registry = _registry
+    if registry is not None and time.monotonic() - _checked_at < REGISTRY_CHECK_INTERVAL:
+        return registry
+    return await sync_to_async(get_registry)()
+
+
+def invalidate_registry(**kwargs):
+    global _registry
+    with _lock:
+        _registry = None
+    cache.set(REGISTRY_VERSION_KEY, uuid.uuid4().hex, timeout=None)
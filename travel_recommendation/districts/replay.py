@@ -0,0 +1,191 @@
+import asyncio
+import json
+import logging
+import math
+import random
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from aiohttp import web
+
+from .services import fetch_forecast_chunk, forecast_params
+from .spatial import snap_to_grid
+
+logger = logging.getLogger(__name__)
+
+FAMILIES = ('weather', 'air_quality')
+HOURS = 168
+
+
+def _family(path):
+    return 'air_quality' if 'air-quality' in path else 'weather'
+
+
+def _location_key(latitude, longitude):
+    return f"{float(latitude)},{float(longitude)}"
+
+
+def synthetic_series(variable, latitude, longitude):
+    # Deterministic stand-in values: a daily cycle peaking mid-afternoon, offset per location
+    base = {
+        'temperature_2m': 24.0 + (latitude - 20.0), 'relative_humidity_2m': 75.0 - 2.0 * (latitude - 20.0),
+        'precipitation': 0.3, 'uv_index': 4.0, 'pm2_5': 35.0 + 4.0 * (longitude - 88.0),
+        'pm10': 55.0 + 5.0 * (longitude - 88.0), 'ozone': 60.0,
+    }.get(variable, 10.0)
+    swing = {
+        'temperature_2m': 5.0, 'relative_humidity_2m': -15.0, 'precipitation': 0.3, 'uv_index': 4.0, 'pm2_5': -10.0,
+        'pm10': -15.0, 'ozone': 25.0,
+    }.get(variable, 2.0)
+    return [round(max(base + swing * math.cos((hour % 24 - 14) * math.pi / 12), 0.0), 1) for hour in range(HOURS)]
+
+
+class ReplayServer:
+    # Local stand-in for the Open-Meteo forecast and air-quality endpoints, for benchmarks. Answers single and
+    # multi-location requests with recorded hourly series (see load_recordings) re-dated to the current 7-day
+    # window, or synthetic ones for locations that were not recorded, after an injected latency. A fraction
+    # of requests can be answered with 429 and a Retry-After instead.
+
+    def __init__(self, recordings=None, latency=0.0, jitter=0.0, throttle_rate=0.0, retry_after=1, seed=0,
+                 timezone='Asia/Dhaka', host='127.0.0.1', port=0):
+        self.recordings = recordings or {}
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.timezone = timezone
+        self.host = host
+        self.port = port
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = Counter()  # Requests per family, plus 'throttled'
+        self.locations = Counter()  # Locations answered per family
+        self.in_flight = 0
+        self._loop = None
+        self._runner = None
+
+    @property
+    def weather_url(self):
+        return f"http://{self.host}:{self.port}/v1/forecast"
+
+    @property
+    def air_quality_url(self):
+        return f"http://{self.host}:{self.port}/v1/air-quality"
+
+    def stats(self):
+        with self._lock:
+            return {**{family: self.calls[family] for family in FAMILIES}, 'throttled': self.calls['throttled'],
+                    'locations': sum(self.locations.values())}
+
+    def _window_start(self):
+        now = datetime.now(ZoneInfo(self.timezone)).replace(tzinfo=None)
+        return now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def _series(self, family, variable, latitude, longitude):
+        recorded = self.recordings.get(family, {}).get(_location_key(latitude, longitude))
+        if recorded and variable in recorded:
+            return recorded[variable]
+        return synthetic_series(variable, latitude, longitude)
+
+    def _response(self, family, query, latitude, longitude):
+        start = self._window_start()
+        first, last = 0, HOURS - 1
+        if query.get('start_hour') and query.get('end_hour'):
+            first = int((datetime.fromisoformat(query['start_hour']) - start) // timedelta(hours=1))
+            last = int((datetime.fromisoformat(query['end_hour']) - start) // timedelta(hours=1))
+            first, last = max(first, 0), min(last, HOURS - 1)
+        hours = range(first, last + 1)
+        hourly = {'time': [(start + timedelta(hours=hour)).strftime('%Y-%m-%dT%H:%M') for hour in hours]}
+        for variable in query.get('hourly', '').split(','):
+            if variable:
+                series = self._series(family, variable, latitude, longitude)
+                hourly[variable] = [series[hour] if hour < len(series) else None for hour in hours]
+        return {'latitude': latitude, 'longitude': longitude, 'timezone': self.timezone, 'hourly': hourly}
+
+    async def _handle(self, request):
+        family = _family(request.path)
+        with self._lock:
+            self.calls[family] += 1
+            self.in_flight += 1
+            throttled = self._random.random() < self.throttle_rate
+            delay = self.latency + self._random.uniform(0, self.jitter) if self.jitter else self.latency
+        try:
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if throttled:
+                with self._lock:
+                    self.calls['throttled'] += 1
+                return web.Response(status=429, headers={'Retry-After': str(self.retry_after)})
+            try:
+                latitudes = [float(value) for value in request.query['latitude'].split(',')]
+                longitudes = [float(value) for value in request.query['longitude'].split(',')]
+            except (KeyError, ValueError):
+                return web.json_response({'error': True, 'reason': 'Invalid coordinates'}, status=400)
+            data = [self._response(family, request.query, latitude, longitude)
+                    for latitude, longitude in zip(latitudes, longitudes)]
+            with self._lock:
+                self.locations[family] += len(data)
+            return web.json_response(data if len(data) > 1 else data[0])
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def start(self):
+        started = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        async def serve():
+            app = web.Application()
+            app.router.add_get('/v1/forecast', self._handle)
+            app.router.add_get('/v1/air-quality', self._handle)
+            self._runner = web.AppRunner(app, access_log=None)
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, self.host, self.port)
+            await site.start()
+            self.port = self._runner.addresses[0][1]
+            started.set()
+
+        def run():
+            self._loop.run_until_complete(serve())
+            self._loop.run_forever()
+
+        threading.Thread(target=run, name='replay-server', daemon=True).start()
+        started.wait(10)
+        logger.info(f"Replay server listening on {self.host}:{self.port}")
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop = None
+
+
+def load_recordings(path):
+    # {"weather": {"lat,lon": {"temperature_2m": [168 hourly values], ...}}, "air_quality": {...}}, as written
+    # by record_responses; the hours are relative to local midnight of the day they were recorded
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return {family: data.get(family, {}) for family in FAMILIES}
+
+
+async def record_responses(path, locations, families, session, semaphore, chunk_size=50):
+    # families: (cache prefix, url, variables, grid resolution). Fetches the full 7-day window for every
+    # distinct grid node once and writes it in the load_recordings format.
+    recordings = {family: {} for family in FAMILIES}
+    for family, url, variables, resolution in families:
+        nodes = list(dict.fromkeys(snap_to_grid(latitude, longitude, resolution) for latitude, longitude in locations))
+        for i in range(0, len(nodes), chunk_size):
+            chunk = nodes[i:i + chunk_size]
+            data = await fetch_forecast_chunk(session, url, forecast_params(",".join(variables)), chunk, semaphore)
+            for (latitude, longitude), response in zip(chunk, data or []):
+                hourly = (response or {}).get('hourly', {})
+                series = {variable: hourly[variable] for variable in variables if hourly.get(variable)}
+                if series:
+                    recordings[family][_location_key(latitude, longitude)] = series
+    recordings['recorded_at'] = datetime.now().isoformat(timespec='seconds')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(recordings, f)
+    return {family: len(recordings[family]) for family in FAMILIES}
@@ -0,0 +1,167 @@
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import weakref
+
+import aiohttp
+from django.conf import settings
+from yarl import URL
+
+from .instrumentation import register_collector
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = getattr(settings, 'OPEN_METEO_POOL_SIZE', 100)  # Total open connections per upstream host session
+POOL_SIZE_PER_HOST = getattr(settings, 'OPEN_METEO_POOL_SIZE_PER_HOST', 10)
+DNS_CACHE_TTL = getattr(settings, 'OPEN_METEO_DNS_CACHE_TTL', 300)
+KEEPALIVE_TIMEOUT = getattr(settings, 'OPEN_METEO_KEEPALIVE_TIMEOUT', 60)
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(
+            ('requests', 'connections_reused', 'connections_created', 'dns_cache_hits', 'dns_cache_misses'), 0
+        )
+
+    def increment(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+pool_stats = PoolStats()
+
+
+@register_collector
+def _pool_metrics():
+    samples = [({'event': name}, value) for name, value in pool_stats.snapshot().items()]
+    return [('districts_upstream_pool_events_total', 'counter', 'Upstream connection pool events', samples)]
+
+
+def _trace_config():
+    trace_config = aiohttp.TraceConfig()
+
+    def counter(name):
+        async def handler(session, context, params):
+            pool_stats.increment(name)
+        return handler
+
+    trace_config.on_request_start.append(counter('requests'))
+    trace_config.on_connection_reuseconn.append(counter('connections_reused'))
+    trace_config.on_connection_create_end.append(counter('connections_created'))
+    trace_config.on_dns_cache_hit.append(counter('dns_cache_hits'))
+    trace_config.on_dns_cache_miss.append(counter('dns_cache_misses'))
+    return trace_config
+
+
+class SessionPool:
+    # Duck-types the session.get() the fetch functions use, routing each URL to a long-lived
+    # keep-alive ClientSession for its host. Sessions are bound to the loop that created them.
+
+    def __init__(self):
+        self._sessions = {}
+
+    def session_for(self, url):
+        host = URL(url).host
+        session = self._sessions.get(host)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=POOL_SIZE,
+                limit_per_host=POOL_SIZE_PER_HOST,
+                ttl_dns_cache=DNS_CACHE_TTL,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+            )
+            session = aiohttp.ClientSession(connector=connector, trace_configs=[_trace_config()])
+            self._sessions[host] = session
+        return session
+
+    def get(self, url, **kwargs):
+        return self.session_for(url).get(url, **kwargs)
+
+    async def close(self):
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+
+
+_pools = weakref.WeakKeyDictionary()
+
+
+def get_session_pool():
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = _pools[loop] = SessionPool()
+    return pool
+
+
+class AsyncRuntime:
+    # A long-lived event loop on a daemon thread that sync code submits coroutines to,
+    # so connection pools, DNS cache and keep-alive survive across requests.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._pid = None
+
+    def loop(self):
+        with self._lock:
+            # The thread does not survive a fork, so each worker process starts its own
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name='districts-async', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+                logger.info("Started background event loop for upstream requests")
+            return self._loop
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop())
+
+    def run(self, coro, timeout=None):
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("AsyncRuntime.run() would deadlock when called from its own loop")
+        return self.submit(coro).result(timeout)
+
+    def iterate(self, agen, timeout=None):
+        # Drives an async generator on the loop one item at a time, for sync consumers such as StreamingHttpResponse
+        async def step():
+            return await agen.__anext__()
+
+        try:
+            while True:
+                try:
+                    yield self.run(step(), timeout)
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.run(agen.aclose(), timeout)
+
+    def stop(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None or self._pid != os.getpid() or not loop.is_running():
+            return
+
+        async def close_pools():
+            pool = _pools.get(loop)
+            if pool is not None:
+                await pool.close()
+
+        try:
+            asyncio.run_coroutine_threadsafe(close_pools(), loop).result(timeout=5)
+        except Exception as e:
+            logger.warning(f"Error closing upstream sessions: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+
+
+runtime = AsyncRuntime()
+atexit.register(runtime.stop)
@@ -0,0 +1,51 @@
+import logging
+import threading
+
+from .services import METRICS_REFRESH_INTERVAL, refresh_district_metrics, warm_forecast_cache
+
+logger = logging.getLogger(__name__)
+
+CHECK_INTERVAL = 60
+
+
+class MetricsRefresher:
+    def __init__(self, interval=METRICS_REFRESH_INTERVAL, check_interval=CHECK_INTERVAL):
+        self.interval = interval
+        self.check_interval = min(check_interval, interval)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self, force=False):
+        # Every worker may run a refresher; the metrics lock and the snapshot age keep it to one recompute
+        snapshot = refresh_district_metrics(force=force, interval=self.interval)
+        if snapshot:
+            logger.debug(f"District metrics snapshot computed at {snapshot['computed_at']:.0f}")
+        return snapshot
+
+    def run_forever(self):
+        logger.info(f"Refreshing district metrics every {self.interval}s")
+        try:
+            warm_forecast_cache()
+        except Exception as e:
+            logger.error(f"Forecast cache warmup failed: {e}")
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"District metrics refresh failed: {e}")
+            self._stop.wait(self.check_interval)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_forever, name='metrics-refresher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+
+refresher = MetricsRefresher()
@@ -1,222 +1,857 @@
 import aiohttp
 import asyncio
-from django.core.cache import cache
 import json
-import os
+from django.core.cache import cache
 from django.conf import settings
+from django.db import DatabaseError
 import logging
-from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from asyncio import Semaphore
+from zoneinfo import ZoneInfo
+import random
+import threading
+import time
+import uuid
+from asgiref.sync import sync_to_async
+from yarl import URL
+from .forecast_store import HOUR, ForecastStore, HourlyForecast, at_2pm, to_hour
+from .history import load_days, record_forecasts
+from .instrumentation import (
+    CACHE_REQUESTS, JSON_PARSE_SECONDS, LATENCY_BUDGET_EXCEEDED, RATE_LIMIT_WAIT_SECONDS, SEMAPHORE_WAIT_SECONDS,
+    UPSTREAM_HEDGED, UPSTREAM_RETRIED, UPSTREAM_SECONDS, UPSTREAM_SHORT_CIRCUITED, UPSTREAM_THROTTLED
+)
+from .rankings import FeatureIndex, RankingIndex
+from .records import DistrictMetrics
+from .registry import aget_registry, get_registry
+from .runtime import get_session_pool, runtime
+from .singleflight import SingleFlight
+from .snapshot_file import read_snapshot_file, write_snapshot_file
+from .spatial import snap_to_grid
+from .throttle import (
+    get_circuit_breaker, get_latency_tracker, get_rate_limiter, get_upstream_semaphore, parse_retry_after
+)
 
 logger = logging.getLogger(__name__)
 
 METRICS_CACHE_KEY = 'district_metrics'
-MAX_CONCURRENT_REQUESTS = 5  # Limit concurrent API calls to avoid 429 errors
-
-
-def fetch_districts_data():
-    json_path = os.path.join(settings.BASE_DIR, 'data', 'bd-districts.json')
-    try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        districts = [
-            {
-                'name': district['name'],
-                'latitude': float(district['lat']),
-                'longitude': float(district['long'])
-            }
-            for district in data.get('districts', [])
-        ]
-        logger.info(f"Loaded {len(districts)} districts from JSON")
-        return districts
-    except Exception as e:
-        logger.error(f"Error loading districts data: {e}")
-        return []
-
-
-async def fetch_weather_data(session, latitude, longitude, semaphore):
+METRICS_LOCK_KEY = 'district_metrics_lock'
+RANKINGS_CACHE_KEY = 'district_rankings'
+FEATURES_CACHE_KEY = 'district_features'
+METRICS_REFRESH_INTERVAL = getattr(settings, 'METRICS_REFRESH_INTERVAL', 6 * 3600)  # Revalidate after 6 hours
+METRICS_SNAPSHOT_TIMEOUT = 7 * 86400  # Keep the last good snapshot around to serve while stale
+METRICS_LOCK_TIMEOUT = 300
+# Share of districts each forecast family must have a forecast for before a refresh may replace the snapshot
+METRICS_MIN_COVERAGE = getattr(settings, 'METRICS_MIN_COVERAGE', 0.5)
+METRICS_LOCK_WAIT = 30
+
+WEATHER_API_URL = getattr(settings, 'OPEN_METEO_WEATHER_URL', "https://api.open-meteo.com/v1/forecast")
+AIR_QUALITY_API_URL = getattr(settings, 'OPEN_METEO_AIR_QUALITY_URL',
+                              "https://air-quality-api.open-meteo.com/v1/air-quality")
+BATCH_FETCH_ENABLED = getattr(settings, 'OPEN_METEO_BATCH_FETCH', True)
+BATCH_CHUNK_SIZE = getattr(settings, 'OPEN_METEO_BATCH_CHUNK_SIZE', 50)  # Locations per multi-location request
+# Forecasts are requested and cached per model grid node rather than per raw coordinate (0 disables snapping).
+# The defaults match the Open-Meteo weather models (~0.1°) and the CAMS global air quality grid (0.4°).
+WEATHER_GRID_RESOLUTION = getattr(settings, 'OPEN_METEO_WEATHER_GRID', 0.1)
+AIR_QUALITY_GRID_RESOLUTION = getattr(settings, 'OPEN_METEO_AIR_QUALITY_GRID', 0.4)
+FORECAST_TIMEZONE = "Asia/Dhaka"
+FORECAST_DAYS = 7
+# Seconds before a cached forecast is refreshed, per variable; unlisted variables use DEFAULT_FRESHNESS
+FORECAST_FRESHNESS = getattr(settings, 'OPEN_METEO_FRESHNESS', {'temperature_2m': 3 * 3600, 'pm2_5': 6 * 3600})
+DEFAULT_FRESHNESS = 86400
+# Stale forecasts are only patched from the current hour onwards instead of refetching all 7 days
+INCREMENTAL_REFRESH = getattr(settings, 'OPEN_METEO_INCREMENTAL_REFRESH', True)
+FORECAST_CACHE_TIMEOUT = (FORECAST_DAYS + 1) * 86400  # Outlives freshness so stale entries can be patched
+# Requested together in each upstream call, for the weighted rankings; the first one decides freshness
+WEATHER_VARIABLES = ("temperature_2m", "relative_humidity_2m", "precipitation", "uv_index")
+AIR_QUALITY_VARIABLES = ("pm2_5", "pm10", "ozone")
+FORECAST_FAMILIES = (  # cache key prefix, variable, grid resolution
+    ('weather', 'temperature_2m', WEATHER_GRID_RESOLUTION),
+    ('air_quality', 'pm2_5', AIR_QUALITY_GRID_RESOLUTION),
+)
+FORECAST_VARIABLES = {'weather': WEATHER_VARIABLES, 'air_quality': AIR_QUALITY_VARIABLES}
+UPSTREAM_RETRIES = 3
+UPSTREAM_TIMEOUT = 5
+# Seconds the travel recommendation waits for upstream before answering from the cache (None waits)
+TRAVEL_LATENCY_BUDGET = getattr(settings, 'TRAVEL_LATENCY_BUDGET', 0.4)
+BATCH_TIMEOUT = 15
+
+forecast_flights = SingleFlight()
+
+
+def is_fresh(forecast, variable):
+    return time.time() - forecast.fetched_at < FORECAST_FRESHNESS.get(variable, DEFAULT_FRESHNESS)
+
+
+def local_now():
+    return datetime.now(ZoneInfo(FORECAST_TIMEZONE)).replace(tzinfo=None)
+
+
+def forecast_window():
+    now = local_now()
+    start = to_hour(now.date())
+    return start, to_hour(now), start + FORECAST_DAYS * 24 * HOUR
+
+
+def forecast_params(hourly, stale=None):
+    params = {"hourly": hourly, "timezone": FORECAST_TIMEZONE}
+    if stale is None or not INCREMENTAL_REFRESH:
+        params["forecast_days"] = FORECAST_DAYS
+        return params
+    # Past hours of the window are settled; request from the current hour (or where the stale series ends)
+    start, current, end = forecast_window()
+    first = max(start, min(current, stale.end))
+    params["start_hour"] = str(first.astype('datetime64[m]'))
+    params["end_hour"] = str((end - HOUR).astype('datetime64[m]'))
+    return params
+
+
+def merge_forecast(stale, fresh):
+    if stale is None or not INCREMENTAL_REFRESH:
+        return fresh
+    if fresh is None:
+        return stale
+    start, _, end = forecast_window()
+    return stale.merged(fresh, start, end)
+
+
+async def fetch_weather_data(session, latitude, longitude, semaphore, use_cache=True, hedge=False):
+    latitude, longitude = snap_to_grid(latitude, longitude, WEATHER_GRID_RESOLUTION)
     cache_key = f"weather_{latitude}_{longitude}"
-    cached_data = cache.get(cache_key)
-    if cached_data:
+    cached_data = await cache.aget(cache_key) if use_cache else None
+    fresh = cached_data is not None and is_fresh(cached_data, "temperature_2m")
+    if use_cache:
+        CACHE_REQUESTS.inc("weather", "hit" if fresh else "stale" if cached_data else "miss")
+    if fresh:
         logger.debug(f"Returning cached weather data for {latitude}, {longitude}")
         return cached_data
 
-    url = "https://api.open-meteo.com/v1/forecast"
+    # Concurrent misses for the same location share a single upstream request
+    return await forecast_flights.do(
+        cache_key,
+        lambda: _download_weather_data(session, latitude, longitude, semaphore, cache_key, cached_data, hedge)
+    )
+
+
+async def _download_weather_data(session, latitude, longitude, semaphore, cache_key, stale=None, hedge=False):
     params = {
         "latitude": latitude,
         "longitude": longitude,
-        "hourly": "temperature_2m",
-        "timezone": "Asia/Dhaka",
-        "forecast_days": 7
+        **forecast_params(",".join(WEATHER_VARIABLES), stale)
     }
-    retries = 3
-    for attempt in range(retries):
-        async with semaphore:  # Limit concurrent requests
-            try:
-                async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=5)) as response:
-                    response.raise_for_status()
-                    data = await response.json()
-                    cache.set(cache_key, data, timeout=86400)  # Cache for 24 hours
-                    return data
-            except aiohttp.ClientResponseError as e:
-                if e.status == 429 and attempt < retries - 1:
-                    wait_time = 2 ** attempt  # Exponential backoff: 1s, 2s, 4s
-                    logger.warning(f"429 error for {latitude}, {longitude}, retrying in {wait_time}s")
-                    await asyncio.sleep(wait_time)
-                    continue
-                logger.error(f"Failed to fetch weather data for {latitude}, {longitude}: {e}")
-                return None
-            except Exception as e:
-                logger.error(f"Failed to fetch weather data for {latitude}, {longitude}: {e}")
-                return None
-    return None
+    data = await fetch_upstream_json(session, WEATHER_API_URL, params, semaphore, UPSTREAM_TIMEOUT,
+                                     f"weather data for {latitude}, {longitude}", hedge=hedge)
+    if data is None:
+        # If the refresh fails, the stale copy (if any) is still better than nothing
+        return stale
+    forecast = merge_forecast(stale, HourlyForecast.from_response(data, WEATHER_VARIABLES))
+    if forecast is None:
+        logger.warning(f"No valid temperature data for {latitude}, {longitude}")
+        return None
+    await cache.aset(cache_key, forecast, timeout=FORECAST_CACHE_TIMEOUT)
+    return forecast
 
 
-async def fetch_air_quality_data(session, latitude, longitude, semaphore):
+async def fetch_air_quality_data(session, latitude, longitude, semaphore, use_cache=True, hedge=False):
+    latitude, longitude = snap_to_grid(latitude, longitude, AIR_QUALITY_GRID_RESOLUTION)
     cache_key = f"air_quality_{latitude}_{longitude}"
-    cached_data = cache.get(cache_key)
-    if cached_data:
+    cached_data = await cache.aget(cache_key) if use_cache else None
+    fresh = cached_data is not None and is_fresh(cached_data, "pm2_5")
+    if use_cache:
+        CACHE_REQUESTS.inc("air_quality", "hit" if fresh else "stale" if cached_data else "miss")
+    if fresh:
         logger.debug(f"Returning cached air quality data for {latitude}, {longitude}")
         return cached_data
 
-    url = "https://air-quality-api.open-meteo.com/v1/air-quality"
+    # Concurrent misses for the same location share a single upstream request
+    return await forecast_flights.do(
+        cache_key,
+        lambda: _download_air_quality_data(session, latitude, longitude, semaphore, cache_key, cached_data, hedge)
+    )
+
+
+async def _download_air_quality_data(session, latitude, longitude, semaphore, cache_key, stale=None, hedge=False):
     params = {
         "latitude": latitude,
         "longitude": longitude,
-        "hourly": "pm2_5",
-        "timezone": "Asia/Dhaka",
-        "forecast_days": 7
+        **forecast_params(",".join(AIR_QUALITY_VARIABLES), stale)
     }
-    retries = 3
-    for attempt in range(retries):
-        async with semaphore:
-            try:
-                async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=5)) as response:
-                    response.raise_for_status()
-                    data = await response.json()
-                    if 'hourly' not in data or 'pm2_5' not in data['hourly']:
-                        logger.warning(f"No valid PM2.5 data for {latitude}, {longitude}")
-                        return None
-                    cache.set(cache_key, data, timeout=86400)
-                    return data
-            except aiohttp.ClientResponseError as e:
-                if e.status == 429 and attempt < retries - 1:
-                    wait_time = 2 ** attempt
-                    logger.warning(f"429 error for {latitude}, {longitude}, retrying in {wait_time}s")
-                    await asyncio.sleep(wait_time)
-                    continue
-                logger.error(f"Failed to fetch air quality data for {latitude}, {longitude}: {e}")
-                return None
-            except Exception as e:
-                logger.error(f"Failed to fetch air quality data for {latitude}, {longitude}: {e}")
-                return None
-    return None
+    data = await fetch_upstream_json(session, AIR_QUALITY_API_URL, params, semaphore, UPSTREAM_TIMEOUT,
+                                     f"air quality data for {latitude}, {longitude}", hedge=hedge)
+    if data is None:
+        return stale
+    forecast = merge_forecast(stale, HourlyForecast.from_response(data, AIR_QUALITY_VARIABLES))
+    if forecast is None:
+        logger.warning(f"No valid PM2.5 data for {latitude}, {longitude}")
+        return None
+    await cache.aset(cache_key, forecast, timeout=FORECAST_CACHE_TIMEOUT)
+    return forecast
 
 
-def get_avg_temperature_at_2pm(data):
-    if not data or 'hourly' not in data or 'temperature_2m' not in data['hourly']:
-        return 35.0
-    temperatures = [temp for time, temp in zip(data['hourly']['time'], data['hourly']['temperature_2m'])
-                    if time.endswith("14:00") and temp is not None]
-    return sum(temperatures) / len(temperatures) if temperatures else 35.0
+async def _upstream_attempt(session, url, params, semaphore, timeout, limiter, breaker, latency, endpoint):
+    # One request. Returns (data, error, retry): the JSON on success, otherwise what went wrong and
+    # whether another attempt may help.
+    outcome = None
+    status = "error"
+    started = received = None
+    try:
+        waited = time.perf_counter()
+        await limiter.acquire()  # Wait for a token before taking a concurrency slot
+        acquired = time.perf_counter()
+        RATE_LIMIT_WAIT_SECONDS.observe(acquired - waited, endpoint)
+        async with semaphore:
+            started = time.perf_counter()
+            SEMAPHORE_WAIT_SECONDS.observe(started - acquired, endpoint)
+            async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                status = str(response.status)
+                if response.status == 429:
+                    UPSTREAM_THROTTLED.inc(endpoint)
+                    limiter.record_throttled(parse_retry_after(response.headers.get("Retry-After")))
+                    return None, "429 Too Many Requests", True
+                if response.status >= 500:
+                    outcome = 'failure'
+                    return None, f"{response.status} {response.reason}", True
+                if response.status >= 400:
+                    outcome = 'success'  # The host is up; retrying the same request will not help
+                    return None, f"{response.status} {response.reason}", False
+                body = await response.read()
+            received = time.perf_counter()
+            data = json.loads(body)
+            JSON_PARSE_SECONDS.observe(time.perf_counter() - received, endpoint)
+            outcome = 'success'
+            limiter.record_success()
+            latency.record(received - started)
+            return data, None, False
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        outcome = 'failure'
+        return None, repr(e), True
+    finally:
+        if started is not None:
+            UPSTREAM_SECONDS.observe((received or time.perf_counter()) - started, endpoint, status)
+        if outcome == 'success':
+            breaker.record_success()
+        elif outcome == 'failure':
+            breaker.record_failure()
+        else:
+            breaker.release()
+
+
+async def _hedged(request, delay, endpoint):
+    # Sends a duplicate if the first request has not answered within delay; the first success wins
+    tasks = {asyncio.ensure_future(request())}
+    try:
+        done, tasks = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            return done.pop().result()
+        UPSTREAM_HEDGED.inc(endpoint)
+        tasks.add(asyncio.ensure_future(request()))
+        while True:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                if result[1] is None or not tasks:
+                    return result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def fetch_upstream_json(session, url, params, semaphore, timeout, description, retries=UPSTREAM_RETRIES,
+                              hedge=False):
+    # Every upstream call goes through its host's circuit breaker and shared rate limiter. Returns None
+    # when the request fails or the circuit is open, so callers fall back to the stale data they have.
+    # With hedge, a slow attempt (past the host's recent p95) is raced against a duplicate.
+    limiter = get_rate_limiter(url)
+    breaker = get_circuit_breaker(url)
+    latency = get_latency_tracker(url)
+    endpoint = URL(url).path
+    for attempt in range(retries):
+        if not breaker.allow():
+            UPSTREAM_SHORT_CIRCUITED.inc(endpoint)
+            logger.warning(f"Circuit open, serving stale {description}")
+            return None
+
+        def request():
+            return _upstream_attempt(session, url, params, semaphore, timeout, limiter, breaker, latency, endpoint)
+
+        data, error, retry = await (_hedged(request, latency.hedge_delay(), endpoint) if hedge else request())
+        if error is None:
+            return data
+        if not retry or attempt == retries - 1:
+            logger.error(f"Failed to fetch {description}: {error}")
+            break
+        # Full jitter, slept outside the semaphore so other requests keep its slots
+        wait_time = random.uniform(0, 2 ** attempt)
+        UPSTREAM_RETRIED.inc(endpoint)
+        logger.warning(f"{error} fetching {description}, retrying in {wait_time:.1f}s")
+        await asyncio.sleep(wait_time)
+    return None
 
 
-def get_avg_pm25_at_2pm(data):
-    if not data or 'hourly' not in data or 'pm2_5' not in data['hourly']:
-        return 50.0
-    pm25_values = [pm25 for time, pm25 in zip(data['hourly']['time'], data['hourly']['pm2_5'])
-                   if time.endswith("14:00") and pm25 is not None]
-    return sum(pm25_values) / len(pm25_values) if pm25_values else 50.0
+async def fetch_forecast_chunk(session, url, params, locations, semaphore):
+    # Open-Meteo answers a comma-separated coordinate list with one response per location, in order
+    params = dict(params,
+                  latitude=",".join(str(latitude) for latitude, _ in locations),
+                  longitude=",".join(str(longitude) for _, longitude in locations))
+    data = await fetch_upstream_json(session, url, params, semaphore, BATCH_TIMEOUT,
+                                     f"chunk of {len(locations)} locations from {url}")
+    if data is None:
+        return None
+    if isinstance(data, dict):
+        data = [data]
+    if len(data) != len(locations):
+        logger.error(f"Expected {len(locations)} locations from {url}, got {len(data)}")
+        return None
+    return data
+
+
+async def fetch_forecasts_batched(session, url, variables, cache_prefix, locations, semaphore,
+                                  chunk_size=BATCH_CHUNK_SIZE, use_cache=True, resolution=0):
+    # Keyed by the requested locations; nearby ones snapped to the same grid node share one download
+    nodes = {location: snap_to_grid(*location, resolution) for location in locations}
+    forecasts = await _fetch_nodes_batched(session, url, variables, cache_prefix,
+                                           list(dict.fromkeys(nodes.values())), semaphore, chunk_size, use_cache)
+    return {location: forecasts[node] for location, node in nodes.items() if node in forecasts}
+
+
+async def _fetch_nodes_batched(session, url, variables, cache_prefix, locations, semaphore, chunk_size, use_cache):
+    cache_keys = {location: f"{cache_prefix}_{location[0]}_{location[1]}" for location in locations}
+    cached = await cache.aget_many(list(cache_keys.values())) if use_cache else {}
+    stale = {location: cached.get(key) for location, key in cache_keys.items()}
+    results = {location: forecast for location, forecast in stale.items()
+               if forecast and is_fresh(forecast, variables[0])}
+    missing = [location for location in locations if location not in results]
+    if use_cache:
+        stale_count = sum(1 for location in missing if stale[location] is not None)
+        CACHE_REQUESTS.inc(cache_prefix, "hit", amount=len(results))
+        CACHE_REQUESTS.inc(cache_prefix, "stale", amount=stale_count)
+        CACHE_REQUESTS.inc(cache_prefix, "miss", amount=len(missing) - stale_count)
+    if not missing:
+        return results
+
+    # Locations needing the same window (full horizon, or patched from the same hour) go in the same requests
+    groups = {}
+    for location in missing:
+        params = forecast_params(",".join(variables), stale[location])
+        groups.setdefault(tuple(params.items()), []).append(location)
+    chunks = [
+        (dict(params), group[i:i + chunk_size])
+        for params, group in groups.items() for i in range(0, len(group), chunk_size)
+    ]
+    responses = await asyncio.gather(*[
+        forecast_flights.do(
+            f"{cache_prefix}_chunk_{params.get('start_hour')}_{chunk}",
+            lambda params=params, chunk=chunk: fetch_forecast_chunk(session, url, params, chunk, semaphore)
+        )
+        for params, chunk in chunks
+    ])
+    fresh = {}
+    for (_, chunk), chunk_data in zip(chunks, responses):
+        for location, data in zip(chunk, chunk_data or [None] * len(chunk)):
+            forecast = merge_forecast(stale[location], HourlyForecast.from_response(data, variables))
+            if forecast is None:
+                logger.warning(f"No valid {cache_prefix} data for {location[0]}, {location[1]}")
+                continue
+            results[location] = forecast
+            if data is not None:
+                fresh[cache_keys[location]] = forecast
+    if fresh:
+        await cache.aset_many(fresh, timeout=FORECAST_CACHE_TIMEOUT)
+    logger.info(f"Fetched {len(fresh)}/{len(missing)} {cache_prefix} forecasts in {len(chunks)} batched requests")
+    return results
 
 
 def get_temperature_at_2pm(data, travel_date):
-    if not data or 'hourly' not in data or 'temperature_2m' not in data['hourly']:
-        return None
-    target_date = travel_date.strftime("%Y-%m-%d")
-    target_time = f"{target_date}T14:00"
-    if target_time not in data['hourly']['time']:
+    if not data:
         return None
-    index = data['hourly']['time'].index(target_time)
-    temp = data['hourly']['temperature_2m'][index]
-    return temp if temp is not None else None
+    return data.value_at('temperature_2m', at_2pm(travel_date))
 
 
 def get_pm25_at_2pm(data, travel_date):
-    if not data or 'hourly' not in data or 'pm2_5' not in data['hourly']:
-        return 50.0
-    target_date = travel_date.strftime("%Y-%m-%d")
-    target_time = f"{target_date}T14:00"
-    if target_time not in data['hourly']['time']:
-        return 50.0
-    index = data['hourly']['time'].index(target_time)
-    pm25 = data['hourly']['pm2_5'][index]
+    pm25 = data.value_at('pm2_5', at_2pm(travel_date)) if data else None
     return pm25 if pm25 is not None else 50.0
 
 
-async def fetch_district_metrics(session, district, semaphore):
-    weather_data = await fetch_weather_data(session, district['latitude'], district['longitude'], semaphore)
-    air_quality_data = await fetch_air_quality_data(session, district['latitude'], district['longitude'], semaphore)
-    avg_temp = get_avg_temperature_at_2pm(weather_data)
-    avg_pm25 = get_avg_pm25_at_2pm(air_quality_data)
-    return {
-        'name': district['name'],
-        'latitude': district['latitude'],
-        'longitude': district['longitude'],
-        'avg_temperature': round(avg_temp, 2),
-        'avg_pm25': round(avg_pm25, 2)
-    }
+async def fetch_district_forecasts(session, district, semaphore, use_cache=True):
+    weather_data = await fetch_weather_data(session, district['latitude'], district['longitude'], semaphore,
+                                            use_cache)
+    air_quality_data = await fetch_air_quality_data(session, district['latitude'], district['longitude'],
+                                                    semaphore, use_cache)
+    return weather_data, air_quality_data
+
+
+def build_forecast_store(districts, weather, air_quality):
+    return ForecastStore.build([district['name'] for district in districts], weather, air_quality)
+
+
+def build_district_metrics(districts, weather, air_quality, store=None):
+    # One districts x hours matrix per variable, so the 2pm averages are a single slice for all districts
+    if store is None:
+        store = build_forecast_store(districts, weather, air_quality)
+    avg_temps = store.mean_at_hour('temperature_2m', 14, default=35.0).round(2)
+    avg_pm25s = store.mean_at_hour('pm2_5', 14, default=50.0).round(2)
+    return [
+        DistrictMetrics(district['name'], district['latitude'], district['longitude'], avg_temp, avg_pm25)
+        for district, avg_temp, avg_pm25 in zip(districts, avg_temps.tolist(), avg_pm25s.tolist())
+    ]
 
 
-async def fetch_travel_data(session, district, travel_date, semaphore):
-    weather_data = await fetch_weather_data(session, district['latitude'], district['longitude'], semaphore)
-    air_quality_data = await fetch_air_quality_data(session, district['latitude'], district['longitude'], semaphore)
+async def aget_cached_forecast(cache_prefix, latitude, longitude, resolution):
+    # Whatever is cached for the location, fresh or not
+    latitude, longitude = snap_to_grid(latitude, longitude, resolution)
+    return await cache.aget(f"{cache_prefix}_{latitude}_{longitude}")
+
+
+def travel_data(weather_data, air_quality_data, travel_date):
     temp = get_temperature_at_2pm(weather_data, travel_date)
     pm25 = get_pm25_at_2pm(air_quality_data, travel_date)
     return {
         'temp': temp if temp is not None else 35.0,
-        'pm25': pm25 if pm25 is not None else 50.0
+        'pm25': pm25 if pm25 is not None else 50.0,
+        # Answered from a stale forecast or the defaults rather than a fresh one
+        'degraded': not (weather_data and is_fresh(weather_data, "temperature_2m")
+                         and air_quality_data and is_fresh(air_quality_data, "pm2_5"))
     }
 
 
-async def fetch_all_district_metrics(districts):
-    semaphore = Semaphore(MAX_CONCURRENT_REQUESTS)
-    async with aiohttp.ClientSession() as session:
-        tasks = [fetch_district_metrics(session, district, semaphore) for district in districts]
-        return await asyncio.gather(*tasks)
+async def fetch_travel_data(session, district, travel_date, semaphore, budget=None):
+    # With a budget (seconds), slow upstream calls are hedged, and whatever has not arrived when it runs out
+    # is answered from the cache while the fetch finishes in the background for the next request. With
+    # nothing cached there is nothing honest to answer from, so the request keeps waiting for upstream.
+    latitude, longitude = district['latitude'], district['longitude']
+    hedge = budget is not None
+    fetches = [
+        asyncio.ensure_future(fetch_weather_data(session, latitude, longitude, semaphore, hedge=hedge)),
+        asyncio.ensure_future(fetch_air_quality_data(session, latitude, longitude, semaphore, hedge=hedge)),
+    ]
+    await asyncio.wait(fetches, timeout=budget)
+    forecasts = []
+    for task, (cache_prefix, _, resolution) in zip(fetches, FORECAST_FAMILIES):
+        if not task.done():
+            LATENCY_BUDGET_EXCEEDED.inc(cache_prefix)
+            cached = await aget_cached_forecast(cache_prefix, latitude, longitude, resolution)
+            if cached is not None:
+                logger.warning(f"Latency budget of {budget}s spent on {cache_prefix} for {latitude}, {longitude}, "
+                               f"answering from the cache")
+                _background_tasks.add(task)
+                task.add_done_callback(_background_tasks.discard)
+                forecasts.append(cached)
+                continue
+            logger.warning(f"Latency budget of {budget}s spent on {cache_prefix} for {latitude}, {longitude}, "
+                           f"nothing cached, waiting for upstream")
+        forecasts.append(await task)
+    return travel_data(*forecasts, travel_date)
+
+
+async def fetch_all_district_forecasts_batched(session, districts, semaphore, chunk_size=BATCH_CHUNK_SIZE,
+                                             use_cache=True):
+    locations = [(district['latitude'], district['longitude']) for district in districts]
+    weather, air_quality = await asyncio.gather(
+        fetch_forecasts_batched(session, WEATHER_API_URL, WEATHER_VARIABLES, "weather",
+                                locations, semaphore, chunk_size, use_cache, WEATHER_GRID_RESOLUTION),
+        fetch_forecasts_batched(session, AIR_QUALITY_API_URL, AIR_QUALITY_VARIABLES, "air_quality",
+                                locations, semaphore, chunk_size, use_cache, AIR_QUALITY_GRID_RESOLUTION)
+    )
+    return [weather.get(location) for location in locations], [air_quality.get(location) for location in locations]
+
+
+async def fetch_all_district_forecasts(districts, batched=BATCH_FETCH_ENABLED, use_cache=True):
+    semaphore = get_upstream_semaphore()
+    session = get_session_pool()
+    if batched:
+        return await fetch_all_district_forecasts_batched(session, districts, semaphore, use_cache=use_cache)
+    tasks = [fetch_district_forecasts(session, district, semaphore, use_cache) for district in districts]
+    forecasts = await asyncio.gather(*tasks)
+    return [weather_data for weather_data, _ in forecasts], [air_quality_data for _, air_quality_data in forecasts]
+
+
+async def iter_district_metrics(districts, batched=BATCH_FETCH_ENABLED, chunk_size=BATCH_CHUNK_SIZE, use_cache=True):
+    # Yields lists of metrics in completion order: one district at a time, or one multi-location chunk when batched
+    semaphore = get_upstream_semaphore()
+    session = get_session_pool()
+
+    async def fetch_group(group):
+        if batched:
+            weather, air_quality = await fetch_all_district_forecasts_batched(session, group, semaphore, chunk_size,
+                                                                              use_cache)
+        else:
+            weather_data, air_quality_data = await fetch_district_forecasts(session, group[0], semaphore, use_cache)
+            weather, air_quality = [weather_data], [air_quality_data]
+        return build_district_metrics(group, weather, air_quality)
+
+    size = chunk_size if batched else 1
+    tasks = [asyncio.ensure_future(fetch_group(districts[i:i + size])) for i in range(0, len(districts), size)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        # A client that disconnects mid-stream should not leave fetches running
+        for task in tasks:
+            task.cancel()
+
+
+async def fetch_forecast_store(districts, use_cache=True):
+    weather, air_quality = await fetch_all_district_forecasts(districts, use_cache=use_cache)
+    return build_forecast_store(districts, weather, air_quality)
 
 
-async def fetch_travel_metrics(current_district, destination_district, travel_date):
-    semaphore = Semaphore(MAX_CONCURRENT_REQUESTS)
-    async with aiohttp.ClientSession() as session:
-        tasks = [
-            fetch_travel_data(session, current_district, travel_date, semaphore),
-            fetch_travel_data(session, destination_district, travel_date, semaphore)
-        ]
-        return await asyncio.gather(*tasks)
+async def fetch_travel_metrics(current_district, destination_district, travel_date, budget=TRAVEL_LATENCY_BUDGET):
+    semaphore = get_upstream_semaphore()
+    session = get_session_pool()
+    tasks = [
+        fetch_travel_data(session, current_district, travel_date, semaphore, budget),
+        fetch_travel_data(session, destination_district, travel_date, semaphore, budget)
+    ]
+    return await asyncio.gather(*tasks)
 
 
-def run_async_fetch_districts(districts):
-    return asyncio.run(fetch_all_district_metrics(districts))
+def run_async_fetch_forecasts(districts):
+    return runtime.run(fetch_all_district_forecasts(districts))
+
+
+def run_async_iter_districts(districts):
+    return runtime.iterate(iter_district_metrics(districts))
+
+
+def run_async_fetch_store(districts):
+    return runtime.run(fetch_forecast_store(districts))
 
 
 def run_async_fetch_travel(current_district, destination_district, travel_date):
-    return asyncio.run(fetch_travel_metrics(current_district, destination_district, travel_date))
+    return runtime.run(fetch_travel_metrics(current_district, destination_district, travel_date))
 
 
-def get_district_metrics():
-    cached_metrics = cache.get(METRICS_CACHE_KEY)
-    if cached_metrics:
-        logger.info("Returning cached district metrics")
-        return cached_metrics
+def _acquire_metrics_lock():
+    # cache.add is atomic, so only one worker at a time gets to recompute the snapshot
+    token = uuid.uuid4().hex
+    if cache.add(METRICS_LOCK_KEY, token, timeout=METRICS_LOCK_TIMEOUT):
+        return token
+    return None
 
-    districts = fetch_districts_data()
+
+def _release_metrics_lock(token):
+    if cache.get(METRICS_LOCK_KEY) == token:
+        cache.delete(METRICS_LOCK_KEY)
+
+
+class ForecastsUnavailable(Exception):
+    pass
+
+
+def check_forecast_coverage(districts, weather, air_quality):
+    # Metrics built mostly from the 35/50 defaults would replace the last good snapshot and pass for fresh
+    for family, forecasts in (("weather", weather), ("air_quality", air_quality)):
+        received = sum(forecast is not None for forecast in forecasts)
+        if not received or received < METRICS_MIN_COVERAGE * len(districts):
+            raise ForecastsUnavailable(f"only {received}/{len(districts)} {family} forecasts available")
+
+
+def build_metrics_snapshots(districts, weather, air_quality):
+    # The ranking artifacts are derived from the same forecasts and share their computation time
+    store = build_forecast_store(districts, weather, air_quality)
+    metrics = build_district_metrics(districts, weather, air_quality, store)
+    computed_at = time.time()
+    return {
+        METRICS_CACHE_KEY: {'metrics': metrics, 'computed_at': computed_at},
+        RANKINGS_CACHE_KEY: {'rankings': RankingIndex.build(metrics), 'computed_at': computed_at},
+        FEATURES_CACHE_KEY: {'features': FeatureIndex.build(districts, store), 'computed_at': computed_at},
+    }
+
+
+def store_district_metrics(districts, weather, air_quality):
+    snapshots = build_metrics_snapshots(districts, weather, air_quality)
+    cache.set_many(snapshots, timeout=METRICS_SNAPSHOT_TIMEOUT)
+    write_snapshot_file(snapshots)
+    logger.info("Precomputed metrics and rankings stored in cache")
+    return snapshots
+
+
+def _snapshot_from_file(cache_key):
+    # A worker that finds the cache empty (new host, cleared cache) serves the last refresh written to disk
+    snapshots = read_snapshot_file()
+    if not snapshots or cache_key not in snapshots or get_metrics_age(snapshots[cache_key]) >= METRICS_SNAPSHOT_TIMEOUT:
+        return None
+    for key, snapshot in snapshots.items():
+        cache.add(key, snapshot, timeout=METRICS_SNAPSHOT_TIMEOUT)  # Never replaces a newer one from a refresh
+    CACHE_REQUESTS.inc(cache_key, "file")
+    logger.info(f"Loaded {cache_key} from the snapshot file")
+    return snapshots[cache_key]
+
+
+def warm_forecast_cache(registry=None):
+    # Refill missing forecast cache entries from the forecast history table, e.g. after moving to a new host.
+    # They keep their original fetched_at, so the freshness rules still decide when to go upstream.
+    registry = registry or get_registry()
+    start, _, end = forecast_window()
+    start_date = start.astype('datetime64[D]').item()
+    end_date = (end - HOUR).astype('datetime64[D]').item()
+    warmed = {}
+    for prefix, variable, resolution in FORECAST_FAMILIES:
+        keys = {}
+        for record in registry:
+            if record.id is not None:
+                latitude, longitude = snap_to_grid(record.latitude, record.longitude, resolution)
+                keys.setdefault(f"{prefix}_{latitude}_{longitude}", record.id)
+        cached = cache.get_many(list(keys))
+        missing = {key: district_id for key, district_id in keys.items() if key not in cached}
+        if not missing:
+            continue
+        try:
+            ids, matrix, fetched_at = load_days(variable, start_date, end_date, list(missing.values()))
+            # The other variables fetched with it, for the weighted rankings
+            extras = {extra: load_days(extra, start_date, end_date, ids)
+                      for extra in FORECAST_VARIABLES.get(prefix, ()) if extra != variable}
+        except DatabaseError as e:
+            logger.error(f"Error reading forecast history: {e}")
+            return 0
+        rows = {district_id: row for row, district_id in enumerate(ids)}
+        extra_rows = {extra: ({district_id: row for row, district_id in enumerate(extra_ids)}, extra_matrix)
+                      for extra, (extra_ids, extra_matrix, _) in extras.items()}
+        for key, district_id in missing.items():
+            row = rows.get(district_id)
+            if row is not None:
+                series = {variable: matrix[row]}
+                for extra, (positions, extra_matrix) in extra_rows.items():
+                    if district_id in positions:
+                        series[extra] = extra_matrix[positions[district_id]]
+                warmed[key] = HourlyForecast(start, series, fetched_at[row])
+    if warmed:
+        cache.set_many(warmed, timeout=FORECAST_CACHE_TIMEOUT)
+        logger.info(f"Warmed {len(warmed)} forecast cache entries from the forecast history")
+    return len(warmed)
+
+
+def record_district_forecasts(registry, districts, weather, air_quality):
+    district_ids = [registry.by_name[district['name']].id for district in districts]
+    try:
+        return record_forecasts(district_ids, weather, air_quality)
+    except DatabaseError as e:
+        # History is a by-product; the metrics refresh must not fail because of it
+        logger.error(f"Error recording forecast history: {e}")
+        return 0
+
+
+def _compute_metrics():
+    registry = get_registry()
+    districts = registry.locations()
     if not districts:
-        return []
+        return None
+
+    warm_forecast_cache(registry)
+    # Cached forecasts past their per-variable freshness are refreshed (patched, if incremental) on the way
+    weather, air_quality = run_async_fetch_forecasts(districts)
+    record_district_forecasts(registry, districts, weather, air_quality)
+    check_forecast_coverage(districts, weather, air_quality)
+    return store_district_metrics(districts, weather, air_quality)
+
+
+def _recompute_metrics(token):
+    release = True
+    try:
+        return _compute_metrics()
+    except ForecastsUnavailable as e:
+        # The lock is left to expire, so requests do not retry an unreachable upstream on every hit
+        release = False
+        logger.error(f"Keeping the previous district metrics: {e}")
+        return None
+    except Exception as e:
+        logger.error(f"Error recomputing district metrics: {e}")
+        return None
+    finally:
+        if release:
+            _release_metrics_lock(token)
+
+
+def _wait_for_snapshot(cache_key):
+    deadline = time.monotonic() + METRICS_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.2)
+        snapshot = cache.get(cache_key)
+        if snapshot:
+            return snapshot
+    logger.warning(f"No {cache_key} snapshot after waiting {METRICS_LOCK_WAIT}s for another worker")
+    return None
+
+
+def get_metrics_age(snapshot):
+    return max(time.time() - snapshot['computed_at'], 0.0)
+
+
+def refresh_district_metrics(force=False, interval=METRICS_REFRESH_INTERVAL):
+    # Returns the current snapshot, or None if another worker holds the lock; a failed recompute raises
+    if not force:
+        snapshot = cache.get(METRICS_CACHE_KEY)
+        if snapshot and get_metrics_age(snapshot) < interval:
+            return snapshot
+    token = _acquire_metrics_lock()
+    if token is None:
+        logger.info("District metrics refresh already in progress")
+        return None
+    release = True
+    try:
+        snapshots = _compute_metrics()
+    except ForecastsUnavailable:
+        release = False
+        raise
+    finally:
+        if release:
+            _release_metrics_lock(token)
+    if not snapshots:
+        raise RuntimeError("No districts to compute metrics for")
+    return snapshots[METRICS_CACHE_KEY]
+
+
+def refresh_district_metrics_in_background():
+    token = _acquire_metrics_lock()
+    if token is None:
+        return False
+    threading.Thread(target=_recompute_metrics, args=(token,), name='metrics-refresh', daemon=True).start()
+    return True
+
+
+def _get_snapshot(cache_key):
+    snapshot = cache.get(cache_key) or _snapshot_from_file(cache_key)
+    if snapshot:
+        age = get_metrics_age(snapshot)
+        CACHE_REQUESTS.inc(cache_key, "hit" if age < METRICS_REFRESH_INTERVAL else "stale")
+        if age >= METRICS_REFRESH_INTERVAL and refresh_district_metrics_in_background():
+            logger.info(f"Serving {age:.0f}s old {cache_key} while revalidating")
+        return snapshot, age
+
+    # Nothing to serve yet: compute inline, or wait for the worker that holds the lock
+    CACHE_REQUESTS.inc(cache_key, "miss")
+    token = _acquire_metrics_lock()
+    if token:
+        snapshots = _recompute_metrics(token)
+        snapshot = snapshots[cache_key] if snapshots else None
+    else:
+        snapshot = _wait_for_snapshot(cache_key)
+    if not snapshot:
+        return None, None
+    return snapshot, get_metrics_age(snapshot)
+
+
+def get_rankings():
+    snapshot, age = _get_snapshot(RANKINGS_CACHE_KEY)
+    if not snapshot:
+        return None, None
+    return snapshot['rankings'], age
+
+
+def get_features():
+    snapshot, age = _get_snapshot(FEATURES_CACHE_KEY)
+    if not snapshot:
+        return None, None
+    return snapshot['features'], age
+
+
+_metrics_by_name = (None, {})
+
+
+def get_metrics_by_name():
+    global _metrics_by_name
+    snapshot, age = _get_snapshot(METRICS_CACHE_KEY)
+    if not snapshot:
+        return {}, None
+    # Rebuilt once per snapshot rather than per request
+    computed_at, by_name = _metrics_by_name
+    if computed_at != snapshot['computed_at']:
+        by_name = {district['name']: district for district in snapshot['metrics']}
+        _metrics_by_name = (snapshot['computed_at'], by_name)
+    return by_name, age
+
+
+# Async counterparts for the ASGI views: same snapshot, lock and cache keys, but awaited on the
+# request's own event loop instead of being submitted to the background runtime.
+
+_background_tasks = set()
+
+
+async def _aacquire_metrics_lock():
+    token = uuid.uuid4().hex
+    if await cache.aadd(METRICS_LOCK_KEY, token, timeout=METRICS_LOCK_TIMEOUT):
+        return token
+    return None
+
+
+async def _arelease_metrics_lock(token):
+    if await cache.aget(METRICS_LOCK_KEY) == token:
+        await cache.adelete(METRICS_LOCK_KEY)
+
+
+async def _arecompute_metrics(token):
+    release = True
+    try:
+        registry = await aget_registry()
+        districts = registry.locations()
+        if not districts:
+            return None
+
+        await sync_to_async(warm_forecast_cache)(registry)
+        weather, air_quality = await fetch_all_district_forecasts(districts)
+        await sync_to_async(record_district_forecasts)(registry, districts, weather, air_quality)
+        check_forecast_coverage(districts, weather, air_quality)
+        snapshots = build_metrics_snapshots(districts, weather, air_quality)
+        await cache.aset_many(snapshots, timeout=METRICS_SNAPSHOT_TIMEOUT)
+        await sync_to_async(write_snapshot_file)(snapshots)
+        logger.info("Precomputed metrics and rankings stored in cache")
+        return snapshots
+    except ForecastsUnavailable as e:
+        release = False
+        logger.error(f"Keeping the previous district metrics: {e}")
+        return None
+    except Exception as e:
+        logger.error(f"Error recomputing district metrics: {e}")
+        return None
+    finally:
+        if release:
+            await _arelease_metrics_lock(token)
+
+
+async def _await_snapshot(cache_key):
+    deadline = time.monotonic() + METRICS_LOCK_WAIT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.2)
+        snapshot = await cache.aget(cache_key)
+        if snapshot:
+            return snapshot
+    logger.warning(f"No {cache_key} snapshot after waiting {METRICS_LOCK_WAIT}s for another worker")
+    return None
 
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        metrics = executor.submit(run_async_fetch_districts, districts).result()
 
-    cache.set(METRICS_CACHE_KEY, metrics, timeout=86400)
-    logger.info("Precomputed metrics stored in cache")
-    return metrics
\ No newline at end of file
+async def _aget_snapshot(cache_key):
+    snapshot = await cache.aget(cache_key) or await sync_to_async(_snapshot_from_file)(cache_key)
+    if snapshot:
+        age = get_metrics_age(snapshot)
+        CACHE_REQUESTS.inc(cache_key, "hit" if age < METRICS_REFRESH_INTERVAL else "stale")
+        if age >= METRICS_REFRESH_INTERVAL:
+            token = await _aacquire_metrics_lock()
+            if token:
+                logger.info(f"Serving {age:.0f}s old {cache_key} while revalidating")
+                task = asyncio.create_task(_arecompute_metrics(token))
+                _background_tasks.add(task)
+                task.add_done_callback(_background_tasks.discard)
+        return snapshot, age
+
+    CACHE_REQUESTS.inc(cache_key, "miss")
+    token = await _aacquire_metrics_lock()
+    if token:
+        snapshots = await _arecompute_metrics(token)
+        snapshot = snapshots[cache_key] if snapshots else None
+    else:
+        snapshot = await _await_snapshot(cache_key)
+    if not snapshot:
+        return None, None
+    return snapshot, get_metrics_age(snapshot)
+
+
+async def aget_rankings():
+    snapshot, age = await _aget_snapshot(RANKINGS_CACHE_KEY)
+    if not snapshot:
+        return None, None
+    return snapshot['rankings'], age
+
+
+async def aget_features():
+    snapshot, age = await _aget_snapshot(FEATURES_CACHE_KEY)
+    if not snapshot:
+        return None, None
+    return snapshot['features'], age
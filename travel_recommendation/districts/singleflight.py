@@ -0,0 +1,45 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    # Concurrent calls for the same key share one execution. The shared result lives in a
+    # concurrent.futures.Future so callers on other threads/event loops can await it too.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = set()
+
+    async def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+
+        if not leader:
+            # Shielded so a cancelled follower does not cancel the shared future for everyone else
+            return await asyncio.shield(asyncio.wrap_future(future))
+
+        # The call runs in its own task so cancelling the leader (a client disconnecting) leaves it running
+        # for the followers instead of handing them the CancelledError
+        task = asyncio.ensure_future(fn())
+        self._tasks.add(task)
+        task.add_done_callback(lambda task: self._finish(key, future, task))
+        return await asyncio.shield(task)
+
+    def _finish(self, key, future, task):
+        self._tasks.discard(task)
+        with self._lock:
+            self._calls.pop(key, None)
+        if future.done():
+            return
+        if task.cancelled():
+            future.set_exception(asyncio.CancelledError())
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
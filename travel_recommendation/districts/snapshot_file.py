@@ -0,0 +1,56 @@
+import logging
+import mmap
+import os
+import struct
+import tempfile
+
+from django.conf import settings
+
+from . import codec
+
+logger = logging.getLogger(__name__)
+
+# The last computed metrics and rankings, so a worker with an empty cache can serve them straight away.
+# Set METRICS_SNAPSHOT_FILE = None to disable.
+SNAPSHOT_FILE = getattr(settings, 'METRICS_SNAPSHOT_FILE', os.path.join(settings.BASE_DIR, 'metrics_snapshot.bin'))
+
+
+def write_snapshot_file(snapshots, path=None):
+    path = path or SNAPSHOT_FILE
+    if not path:
+        return False
+    data = codec.encode(snapshots)
+    # Write to a temporary file in the same directory and rename it over the old one, so readers
+    # see either the previous snapshot or the new one, never a partial write
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.metrics-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.error(f"Error writing metrics snapshot file {path}: {e}")
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def read_snapshot_file(path=None):
+    path = path or SNAPSHOT_FILE
+    if not path:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # Not closed here: the decoded arrays are read-only views of the mapped pages and keep it alive,
+        # so it is unmapped once they are gone. A newer snapshot renamed over the file does not change them.
+        return codec.decode(mapped)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, struct.error) as e:
+        logger.error(f"Error reading metrics snapshot file {path}: {e}")
+        return None
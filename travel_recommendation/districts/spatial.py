@@ -0,0 +1,132 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+MIN_CELL_SIZE = 0.05  # Degrees
+POINTS_PER_CELL = 4
+
+
+def snap_to_grid(latitude, longitude, resolution):
+    # Nearest node of a regular lat/lon grid (e.g. a forecast model's), so every point in its cell shares one key
+    if not resolution:
+        return latitude, longitude
+    return round(round(latitude / resolution) * resolution, 6), round(round(longitude / resolution) * resolution, 6)
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    lat1, lon1 = math.radians(latitude), math.radians(longitude)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class SpatialIndex:
+    # Uniform lat/lon grid over the points, sized for a handful of points per cell. Points are stored
+    # sorted by cell so each cell is one contiguous slice; queries only measure distances to the
+    # points in the cells they touch.
+
+    __slots__ = ('latitudes', 'longitudes', 'order', 'cell_size', 'origin', 'shape', 'cells')
+
+    def __init__(self, latitudes, longitudes, cell_size=None):
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        count = len(latitudes)
+        if count:
+            self.origin = (latitudes.min(), longitudes.min())
+            extent = max(latitudes.max() - self.origin[0], longitudes.max() - self.origin[1], MIN_CELL_SIZE)
+        else:
+            self.origin = (0.0, 0.0)
+            extent = MIN_CELL_SIZE
+        if cell_size is None:
+            cell_size = max(extent / math.sqrt(max(count, 1) / POINTS_PER_CELL), MIN_CELL_SIZE)
+        self.cell_size = cell_size
+
+        rows, columns = self._cell(latitudes, longitudes)
+        self.shape = (int(rows.max()) + 1, int(columns.max()) + 1) if count else (0, 0)
+        cell_ids = rows * max(self.shape[1], 1) + columns
+        self.order = np.argsort(cell_ids, kind='stable')
+        self.latitudes = latitudes[self.order]
+        self.longitudes = longitudes[self.order]
+
+        sorted_ids = cell_ids[self.order]
+        unique, starts = np.unique(sorted_ids, return_index=True)
+        ends = np.append(starts[1:], count)
+        self.cells = {int(cell): (int(start), int(end)) for cell, start, end in zip(unique, starts, ends)}
+
+    def __len__(self):
+        return len(self.order)
+
+    def _cell(self, latitude, longitude):
+        row = np.floor((np.asarray(latitude) - self.origin[0]) / self.cell_size).astype(np.int64)
+        column = np.floor((np.asarray(longitude) - self.origin[1]) / self.cell_size).astype(np.int64)
+        return row, column
+
+    def _candidates(self, rows, columns):
+        rows = range(max(rows.start, 0), min(rows.stop, self.shape[0]))
+        columns = range(max(columns.start, 0), min(columns.stop, self.shape[1]))
+        slices = []
+        for row in rows:
+            for column in columns:
+                span = self.cells.get(row * self.shape[1] + column)
+                if span:
+                    slices.append(np.arange(*span))
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    def _ring(self, row, column, radius):
+        if radius == 0:
+            return self._candidates(range(row, row + 1), range(column, column + 1))
+        parts = [
+            self._candidates(range(row - radius, row - radius + 1), range(column - radius, column + radius + 1)),
+            self._candidates(range(row + radius, row + radius + 1), range(column - radius, column + radius + 1)),
+            self._candidates(range(row - radius + 1, row + radius), range(column - radius, column - radius + 1)),
+            self._candidates(range(row - radius + 1, row + radius), range(column + radius, column + radius + 1)),
+        ]
+        return np.concatenate(parts)
+
+    def nearest(self, latitude, longitude, k=1):
+        # Returns (point indices, distances in km), closest first
+        k = min(k, len(self))
+        if k < 1:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        row, column = (int(value) for value in self._cell(latitude, longitude))
+        max_radius = max(abs(row), abs(column), abs(self.shape[0] - 1 - row), abs(self.shape[1] - 1 - column))
+
+        found = []
+        # Queries outside the grid start at the first ring that reaches it
+        radius = max(0, -row, row - self.shape[0] + 1, -column, column - self.shape[1] + 1)
+        while radius <= max_radius:
+            found.append(self._ring(row, column, radius))
+            candidates = np.concatenate(found)
+            if len(candidates) >= k:
+                distances = haversine_km(latitude, longitude, self.latitudes[candidates], self.longitudes[candidates])
+                kth = np.partition(distances, k - 1)[k - 1]
+                # Anything outside the rings searched so far is at least this far away
+                edge_latitude = min(abs(latitude) + (radius + 1) * self.cell_size, 89.9)
+                bound = radius * self.cell_size * KM_PER_DEGREE * math.cos(math.radians(edge_latitude))
+                if kth <= bound:
+                    break
+            radius += 1
+
+        candidates = np.concatenate(found)
+        distances = haversine_km(latitude, longitude, self.latitudes[candidates], self.longitudes[candidates])
+        best = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(len(distances))
+        best = best[np.argsort(distances[best], kind='stable')]
+        return self.order[candidates[best]], distances[best]
+
+    def within(self, latitude, longitude, radius_km):
+        # Returns (point indices, distances in km) of every point within radius_km, closest first
+        if not len(self):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        lat_span = radius_km / KM_PER_DEGREE
+        lon_span = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(min(abs(latitude) + lat_span, 89.9))), 1e-6))
+        low_row, low_column = (int(value) for value in self._cell(latitude - lat_span, longitude - lon_span))
+        high_row, high_column = (int(value) for value in self._cell(latitude + lat_span, longitude + lon_span))
+
+        candidates = self._candidates(range(low_row, high_row + 1), range(low_column, high_column + 1))
+        distances = haversine_km(latitude, longitude, self.latitudes[candidates], self.longitudes[candidates])
+        inside = distances <= radius_km
+        candidates, distances = candidates[inside], distances[inside]
+        order = np.argsort(distances, kind='stable')
+        return self.order[candidates[order]], distances[order]
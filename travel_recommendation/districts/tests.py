@@ -1,3 +1,932 @@
-from django.test import TestCase
+import asyncio
+import mmap
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+import aiohttp
+import numpy as np
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.renderers import JSONRenderer
+
+from . import codec, instrumentation, services, throttle
+from .cache_backend import SQLiteCache
+from .forecast_store import ForecastStore, HourlyForecast, to_hour
+from .instrumentation import Counter, Histogram, render_metrics
+from .rankings import FeatureIndex, RankingIndex
+from .recommendations import compare_days
+from .registry import DistrictRegistry, get_registry
+from .records import DistrictMetrics, metrics_json
+from .replay import ReplayServer, synthetic_series
+from .scheduler import MetricsRefresher
+from .serializers import TopDistrictSerializer
+from .services import (
+    FEATURES_CACHE_KEY, METRICS_CACHE_KEY, METRICS_LOCK_KEY, RANKINGS_CACHE_KEY, WEATHER_VARIABLES,
+    fetch_forecast_chunk, fetch_forecasts_batched, forecast_params, local_now, merge_forecast
+)
+from .singleflight import SingleFlight
+from .snapshot_file import read_snapshot_file, write_snapshot_file
+from .spatial import SpatialIndex, haversine_km, snap_to_grid
+from .throttle import CircuitBreaker, RateLimiter, parse_retry_after
+from .views import parse_travel_range
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_calls_share_one_execution(self):
+        flights = SingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'forecast'
+
+        async def scenario():
+            return await asyncio.gather(*(flights.do('key', fetch) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(scenario()), ['forecast'] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_errors_reach_every_caller(self):
+        flights = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise ValueError('upstream down')
+
+        async def scenario():
+            return await asyncio.gather(*(flights.do('key', fetch) for _ in range(3)), return_exceptions=True)
+
+        results = asyncio.run(scenario())
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    def test_cancelled_leader_does_not_cancel_followers(self):
+        flights = SingleFlight()
+        release = None
+
+        async def fetch():
+            await release.wait()
+            return 'forecast'
+
+        async def scenario():
+            nonlocal release
+            release = asyncio.Event()
+            leader = asyncio.ensure_future(flights.do('key', fetch))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(flights.do('key', fetch))
+            await asyncio.sleep(0)
+            leader.cancel()
+            await asyncio.sleep(0)
+            release.set()
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            return await follower
+
+        self.assertEqual(asyncio.run(scenario()), 'forecast')
+
+    def test_key_is_released_after_the_call(self):
+        flights = SingleFlight()
+        results = iter(['first', 'second'])
+
+        async def fetch():
+            return next(results)
+
+        async def scenario():
+            return [await flights.do('key', fetch), await flights.do('key', fetch)]
+
+        self.assertEqual(asyncio.run(scenario()), ['first', 'second'])
+
+
+class TravelRangeTests(SimpleTestCase):
+    def test_body_must_be_an_object(self):
+        with self.assertRaises(ValueError):
+            parse_travel_range([{'current_district': 'Dhaka'}])
+        response = self.client.post('/travel-recommendation/range/', '[]', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_non_string_dates_are_rejected(self):
+        response = self.client.post('/travel-recommendation/range/', {
+            'current_district': 'Dhaka', 'destination_district': 'Sylhet', 'start_date': 20250120,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_dates_are_limited_to_the_forecast(self):
+        today = local_now().date()
+        trip = {'current_district': 'Dhaka', 'destination_district': 'Sylhet'}
+        _, _, dates, _ = parse_travel_range(trip)
+        self.assertEqual(dates, [today + timedelta(days=offset) for offset in range(7)])
+        for day in (today - timedelta(days=1), today + timedelta(days=7)):
+            with self.assertRaises(ValueError):
+                parse_travel_range({**trip, 'start_date': day.isoformat(), 'end_date': day.isoformat()})
+
+    def test_days_without_forecasts_are_not_answered(self):
+        today = local_now().date()
+        time = to_hour(today) + np.arange(24) * np.timedelta64(1, 'h')
+        store = ForecastStore(['Dhaka', 'Sylhet'], time, {
+            'temperature_2m': np.array([[32.0] * 24, [25.0] * 24], dtype=np.float32),
+            'pm2_5': np.array([[80.0] * 24, [20.0] * 24], dtype=np.float32),
+        })
+        days, best = compare_days(store, 'Dhaka', 'Sylhet', [today, today + timedelta(days=1)], ((14, 14),))
+        self.assertEqual(days[0]['windows'][0]['recommendation'], 'Recommended')
+        self.assertIsNone(days[1]['windows'])
+        self.assertEqual(best, [{'hours': '14', 'best_date': today.isoformat()}])
+
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'districts-tests'},
+    'fragments': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'districts-tests-fragments'},
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MetricsRefresherTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.snapshot = {'metrics': [], 'computed_at': time.time() - 100}
+        cache.set(METRICS_CACHE_KEY, self.snapshot)
+
+    def test_interval_decides_when_the_snapshot_is_due(self):
+        recomputed = {'metrics': [], 'computed_at': time.time()}
+        with mock.patch('districts.services._compute_metrics', return_value={METRICS_CACHE_KEY: recomputed}) as compute:
+            self.assertEqual(MetricsRefresher(interval=200).run_once(), self.snapshot)
+            compute.assert_not_called()
+            self.assertEqual(MetricsRefresher(interval=50).run_once(), recomputed)
+            compute.assert_called_once()
+
+    def test_unavailable_forecasts_keep_the_previous_snapshot(self):
+        registry = mock.Mock()
+        registry.locations.return_value = [{'name': 'Dhaka', 'latitude': 23.8103, 'longitude': 90.4125},
+                                           {'name': 'Sylhet', 'latitude': 24.8949, 'longitude': 91.8687}]
+        forecast = HourlyForecast('2025-01-20T00', {'temperature_2m': [30.0] * 24})
+        fetched = ([forecast, None], [None, None])  # One weather forecast out of two, no air quality
+        with mock.patch('districts.services.get_registry', return_value=registry), \
+                mock.patch('districts.services.aget_registry', mock.AsyncMock(return_value=registry)), \
+                mock.patch('districts.services.warm_forecast_cache'), \
+                mock.patch('districts.services.record_district_forecasts'), \
+                mock.patch('districts.services.run_async_fetch_forecasts', return_value=fetched), \
+                mock.patch('districts.services.fetch_all_district_forecasts', mock.AsyncMock(return_value=fetched)), \
+                mock.patch('districts.services.write_snapshot_file') as write_snapshot_file:
+            with self.assertLogs('districts.services', 'ERROR'):
+                self.assertIsNone(services._recompute_metrics(services._acquire_metrics_lock()))
+            # The lock is kept until it expires, so nothing retries right away
+            self.assertIsNone(services._acquire_metrics_lock())
+            cache.delete(METRICS_LOCK_KEY)
+            with self.assertLogs('districts.services', 'ERROR'):
+                self.assertIsNone(asyncio.run(services._arecompute_metrics(services._acquire_metrics_lock())))
+            self.assertIsNone(services._acquire_metrics_lock())
+            cache.delete(METRICS_LOCK_KEY)
+            with self.assertRaises(services.ForecastsUnavailable):
+                MetricsRefresher().run_once(force=True)
+        write_snapshot_file.assert_not_called()
+        self.assertEqual(cache.get(METRICS_CACHE_KEY), self.snapshot)
+
+    def test_command_reports_failures_apart_from_a_held_lock(self):
+        with mock.patch('districts.services._compute_metrics', side_effect=RuntimeError('upstream down')):
+            with self.assertRaisesMessage(CommandError, 'upstream down'):
+                call_command('refresh_metrics', force=True)
+        with mock.patch('districts.services._compute_metrics', return_value=None):
+            with self.assertRaisesMessage(CommandError, 'No districts'):
+                call_command('refresh_metrics', force=True)
+        self.assertIsNone(cache.get(METRICS_LOCK_KEY))
+
+
+def sample_metrics():
+    return [
+        DistrictMetrics('Dhaka', 23.8103, 90.4125, 31.5, 88.2),
+        DistrictMetrics('Sylhet', 24.8949, 91.8687, 27.25, 35.0),
+        DistrictMetrics('Khulna', 22.8456, 89.5403, 30.1, 61.75),
+    ]
+
+
+def sample_store(names):
+    time = to_hour(local_now().date()) + np.arange(48) * np.timedelta64(1, 'h')
+    rows = np.arange(len(names), dtype=np.float32)[:, None]
+    hours = np.arange(48, dtype=np.float32)
+    return ForecastStore(names, time, {
+        'temperature_2m': 25 + rows + np.sin(hours / 4),
+        'pm2_5': 30 + 10 * rows + hours % 24,
+    })
+
+
+class CodecTests(SimpleTestCase):
+    def test_json_values_round_trip(self):
+        value = {'name': 'Dhaka', 'values': [1, 2.5, None, True], 'nested': {'ok': 'yes'}}
+        encoded = codec.encode(value)
+        self.assertEqual(encoded[:1], codec.TAG_JSON)
+        self.assertEqual(codec.decode(encoded), value)
+
+    def test_records_are_written_as_rows(self):
+        metrics = sample_metrics()
+        rows = [dict(zip(DistrictMetrics.FIELDS, metric.to_row())) for metric in metrics]
+        self.assertEqual(codec.decode(codec.encode({'metrics': metrics})), {'metrics': metrics})
+        self.assertEqual(codec.decode(codec.encode(rows)), rows)
+        self.assertNotIn(b'avg_pm25', codec.encode(metrics))
+
+    def test_forecasts_round_trip(self):
+        forecast = HourlyForecast('2025-01-20T00', {
+            'temperature_2m': [20.5, np.nan, 22.25], 'pm2_5': [40.0, 41.5, 39.0],
+        }, fetched_at=1700000000.5)
+        encoded = codec.encode({'forecast': forecast, 'raw': b'\x00\x01'})
+        self.assertEqual(encoded[:1], codec.TAG_EXTENDED)
+        decoded = codec.decode(encoded)
+        self.assertEqual(decoded['raw'], b'\x00\x01')
+        self.assertEqual(decoded['forecast'].start, forecast.start)
+        self.assertEqual(decoded['forecast'].fetched_at, forecast.fetched_at)
+        for name, values in forecast.variables.items():
+            np.testing.assert_array_equal(decoded['forecast'].variables[name], values)
+
+    def test_indexes_round_trip(self):
+        metrics = sample_metrics()
+        rankings = RankingIndex.build(metrics)
+        districts = [{'name': metric.name, 'latitude': metric.latitude, 'longitude': metric.longitude}
+                     for metric in metrics]
+        features = FeatureIndex.build(districts, sample_store([metric.name for metric in metrics]))
+        decoded = codec.decode(codec.encode({'rankings': rankings, 'features': features}))
+        for sort in RankingIndex.SORTS:
+            self.assertEqual(decoded['rankings'].top(sort, 2), rankings.top(sort, 2))
+        weights = {'temperature': 1.0, 'pm25': 0.5}
+        self.assertEqual(decoded['features'].top(weights, 10, 16), features.top(weights, 10, 16))
+
+    def test_other_values_fall_back_to_pickle(self):
+        value = {(23.8, 90.4): 'Dhaka'}
+        encoded = codec.encode(value)
+        self.assertEqual(encoded[:1], codec.TAG_PICKLE)
+        self.assertEqual(codec.decode(encoded), value)
+        with self.assertRaises(ValueError):
+            codec.decode(b'Z{}')
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker(threshold=2, cooldown=60)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        breaker.record_failure()
+        with self.assertLogs('districts.throttle', 'WARNING'):
+            breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_half_open_probe(self):
+        breaker = CircuitBreaker(threshold=1, cooldown=0.01)
+        with self.assertLogs('districts.throttle', 'INFO'):
+            breaker.record_failure()
+            time.sleep(0.02)
+            self.assertTrue(breaker.allow())
+            self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+            self.assertFalse(breaker.allow())  # Only one probe at a time
+            breaker.record_failure()
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+            time.sleep(0.02)
+            self.assertTrue(breaker.allow())
+            breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+
+class RateLimiterTests(SimpleTestCase):
+    def test_waits_for_tokens(self):
+        limiter = RateLimiter(rate=50, burst=1)
+
+        async def scenario():
+            start = time.monotonic()
+            for _ in range(3):
+                await limiter.acquire()
+            return time.monotonic() - start
+
+        self.assertGreaterEqual(asyncio.run(scenario()), 0.035)
+
+    def test_throttling_slows_down_and_honours_retry_after(self):
+        limiter = RateLimiter(rate=100, burst=5, min_rate=10)
+        with self.assertLogs('districts.throttle', 'WARNING'):
+            limiter.record_throttled(0.1)
+        self.assertEqual(limiter.rate, 50)
+
+        async def scenario():
+            start = time.monotonic()
+            await limiter.acquire()
+            return time.monotonic() - start
+
+        self.assertGreaterEqual(asyncio.run(scenario()), 0.09)
+        for _ in range(1000):
+            limiter.record_success()
+        self.assertEqual(limiter.rate, 100)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('3'), 3.0)
+        self.assertEqual(parse_retry_after('-1'), 0.0)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after('soon'))
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+
+
+class UpstreamTestCase(SimpleTestCase):
+    # Fresh per-host limiters and breakers for each test, and no backoff between retries
+    def setUp(self):
+        for registry in (throttle._limiters, throttle._breakers, throttle._latencies):
+            patcher = mock.patch.dict(registry, clear=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('districts.services.random.uniform', return_value=0.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BatchedFetchTests(UpstreamTestCase):
+    LOCATIONS = [(23.8103, 90.4125), (24.8949, 91.8687), (22.8456, 89.5403), (22.701, 90.3535), (24.3745, 88.6042)]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ReplayServer().start()
+        cls.addClassCleanup(cls.server.stop)
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def fetch_batched(self, locations, chunk_size, use_cache=True):
+        async def scenario():
+            async with aiohttp.ClientSession() as session:
+                return await fetch_forecasts_batched(session, self.server.weather_url, WEATHER_VARIABLES, 'weather',
+                                                     locations, asyncio.Semaphore(5), chunk_size, use_cache)
+
+        return asyncio.run(scenario())
+
+    def test_chunks_fan_out_to_their_locations(self):
+        before = self.server.stats()
+        forecasts = self.fetch_batched(self.LOCATIONS, chunk_size=2, use_cache=False)
+        after = self.server.stats()
+        self.assertEqual(after['weather'] - before['weather'], 3)
+        self.assertEqual(after['locations'] - before['locations'], len(self.LOCATIONS))
+        self.assertEqual(set(forecasts), set(self.LOCATIONS))
+        for (latitude, longitude), forecast in forecasts.items():
+            # Each response went to the location it was requested for, in order
+            expected = synthetic_series('temperature_2m', latitude, longitude)[:24]
+            np.testing.assert_allclose(forecast.variables['temperature_2m'][:24], expected, atol=1e-4)
+
+    def test_cached_locations_are_not_requested_again(self):
+        self.fetch_batched(self.LOCATIONS[:3], chunk_size=2)
+        before = self.server.stats()
+        forecasts = self.fetch_batched(self.LOCATIONS, chunk_size=2)
+        after = self.server.stats()
+        self.assertEqual(set(forecasts), set(self.LOCATIONS))
+        self.assertEqual(after['weather'] - before['weather'], 1)
+        self.assertEqual(after['locations'] - before['locations'], 2)
+
+
+class ForecastChunkTests(UpstreamTestCase):
+    LOCATIONS = [(23.8103, 90.4125), (24.8949, 91.8687)]
+
+    def serve(self, *responses):
+        # Answers the n-th request with the n-th (status, JSON body), repeating the last one
+        requests = []
+
+        async def handle(request):
+            requests.append(request.query)
+            status, body = responses[min(len(requests), len(responses)) - 1]
+            headers = {'Retry-After': '0'} if status == 429 else None
+            return web.json_response(body, status=status, headers=headers)
+
+        app = web.Application()
+        app.router.add_get('/v1/forecast', handle)
+        return TestServer(app), requests
+
+    def fetch_chunk(self, *responses):
+        server, requests = self.serve(*responses)
+
+        async def scenario():
+            await server.start_server(access_log=None)
+            try:
+                async with aiohttp.ClientSession() as session:
+                    return await fetch_forecast_chunk(session, str(server.make_url('/v1/forecast')),
+                                                      {'hourly': 'temperature_2m'}, self.LOCATIONS,
+                                                      asyncio.Semaphore(5))
+            finally:
+                await server.close()
+
+        return asyncio.run(scenario()), requests
+
+    def response(self, count):
+        return [{'hourly': {'time': ['2025-01-20T00:00'], 'temperature_2m': [20.0 + i]}} for i in range(count)]
+
+    def test_sends_the_chunk_as_coordinate_lists(self):
+        data, requests = self.fetch_chunk((200, self.response(2)))
+        self.assertEqual(len(data), 2)
+        self.assertEqual(requests[0]['latitude'], '23.8103,24.8949')
+        self.assertEqual(requests[0]['longitude'], '90.4125,91.8687')
+
+    def test_count_mismatch_is_a_failed_chunk(self):
+        with self.assertLogs('districts.services', 'ERROR'):
+            data, requests = self.fetch_chunk((200, self.response(1)))
+        self.assertIsNone(data)
+        self.assertEqual(len(requests), 1)
+
+    def test_retries_throttled_and_failed_chunks(self):
+        with self.assertLogs('districts', 'WARNING'):
+            data, requests = self.fetch_chunk((429, {}), (503, {}), (200, self.response(2)))
+        self.assertEqual(len(data), 2)
+        self.assertEqual(len(requests), 3)
+
+    def test_gives_up_after_the_retries(self):
+        with self.assertLogs('districts.services', 'ERROR'):
+            data, requests = self.fetch_chunk((503, {}))
+        self.assertIsNone(data)
+        self.assertEqual(len(requests), 3)
+
+    def test_client_errors_are_not_retried(self):
+        with self.assertLogs('districts.services', 'ERROR'):
+            data, requests = self.fetch_chunk((400, {'error': True}))
+        self.assertIsNone(data)
+        self.assertEqual(len(requests), 1)
+
+
+class HedgeTests(SimpleTestCase):
+    OK = ({'ok': True}, None, False)
+    FAILED = (None, '503 Service Unavailable', True)
+
+    def race(self, delay, *attempts):
+        # The n-th request answers attempts[n] = (seconds, result); returns the race's result and which were cancelled
+        cancelled = []
+
+        def request():
+            seconds, result = attempts[len(started)]
+            started.append(seconds)
+
+            async def attempt():
+                try:
+                    await asyncio.sleep(seconds)
+                except asyncio.CancelledError:
+                    cancelled.append(seconds)
+                    raise
+                return result
+
+            return attempt()
+
+        async def scenario():
+            result = await services._hedged(request, delay, 'test')
+            await asyncio.sleep(0)
+            return result
+
+        started = []
+        return asyncio.run(scenario()), started, cancelled
+
+    def test_a_fast_answer_is_not_hedged(self):
+        result, started, cancelled = self.race(0.5, (0, self.OK))
+        self.assertEqual(result, self.OK)
+        self.assertEqual(started, [0])
+
+    def test_the_hedged_duplicate_wins(self):
+        fast = ({'fast': True}, None, False)
+        result, started, cancelled = self.race(0.02, (5, self.OK), (0.01, fast))
+        self.assertEqual(result, fast)
+        self.assertEqual(started, [5, 0.01])
+        self.assertEqual(cancelled, [5])
+
+    def test_a_failed_attempt_does_not_end_the_race(self):
+        result, started, cancelled = self.race(0.01, (0.05, self.FAILED), (0.2, self.OK))
+        self.assertEqual(result, self.OK)
+        self.assertEqual(cancelled, [])
+
+    def test_the_last_failure_is_returned_when_both_fail(self):
+        result, started, cancelled = self.race(0.01, (0.05, self.FAILED), (0.1, self.FAILED))
+        self.assertEqual(result, self.FAILED)
+        self.assertEqual(len(started), 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LatencyBudgetTests(SimpleTestCase):
+    DISTRICT = {'name': 'Dhaka', 'latitude': 23.8103, 'longitude': 90.4125}
+
+    def setUp(self):
+        cache.clear()
+        self.travel_date = local_now().date() + timedelta(days=1)
+
+    def forecast(self, variable, value, fetched_at=None):
+        return HourlyForecast(local_now().date(), {variable: np.full(72, value)}, fetched_at)
+
+    def cache_stale(self, cache_prefix, variable, value, resolution):
+        latitude, longitude = snap_to_grid(self.DISTRICT['latitude'], self.DISTRICT['longitude'], resolution)
+        cache.set(f"{cache_prefix}_{latitude}_{longitude}", self.forecast(variable, value, fetched_at=0))
+
+    def fetch(self, weather_seconds, budget):
+        # Upstream answers air quality at once and the weather after weather_seconds, both fresh
+        calls = []
+
+        async def fetch_weather_data(session, latitude, longitude, semaphore, hedge=False):
+            calls.append(hedge)
+            await asyncio.sleep(weather_seconds)
+            return self.forecast('temperature_2m', 30.0)
+
+        async def fetch_air_quality_data(session, latitude, longitude, semaphore, hedge=False):
+            calls.append(hedge)
+            return self.forecast('pm2_5', 40.0)
+
+        async def scenario():
+            result = await services.fetch_travel_data(None, self.DISTRICT, self.travel_date, None, budget)
+            await asyncio.gather(*services._background_tasks)
+            return result
+
+        with mock.patch('districts.services.fetch_weather_data', fetch_weather_data), \
+                mock.patch('districts.services.fetch_air_quality_data', fetch_air_quality_data):
+            return asyncio.run(scenario()), calls
+
+    def test_within_the_budget_upstream_answers(self):
+        self.cache_stale('weather', 'temperature_2m', 20.0, services.WEATHER_GRID_RESOLUTION)
+        data, calls = self.fetch(0, budget=0.5)
+        self.assertEqual(data, {'temp': 30.0, 'pm25': 40.0, 'degraded': False})
+        self.assertEqual(calls, [True, True])
+
+    def test_past_the_budget_the_cache_answers(self):
+        self.cache_stale('weather', 'temperature_2m', 20.0, services.WEATHER_GRID_RESOLUTION)
+        with self.assertLogs('districts.services', 'WARNING') as logs:
+            data, calls = self.fetch(0.2, budget=0.02)
+        self.assertEqual(data, {'temp': 20.0, 'pm25': 40.0, 'degraded': True})
+        self.assertIn('answering from the cache', logs.output[0])
+
+    def test_with_nothing_cached_the_request_waits_for_upstream(self):
+        with self.assertLogs('districts.services', 'WARNING') as logs:
+            data, calls = self.fetch(0.1, budget=0.02)
+        self.assertEqual(data, {'temp': 30.0, 'pm25': 40.0, 'degraded': False})
+        self.assertIn('nothing cached, waiting for upstream', logs.output[0])
+
+    def test_without_a_budget_nothing_is_hedged(self):
+        self.cache_stale('weather', 'temperature_2m', 20.0, services.WEATHER_GRID_RESOLUTION)
+        data, calls = self.fetch(0.05, budget=None)
+        self.assertEqual(data, {'temp': 30.0, 'pm25': 40.0, 'degraded': False})
+        self.assertEqual(calls, [False, False])
+
+
+class InstrumentationTests(SimpleTestCase):
+    def series(self, text):
+        return [line.rsplit(' ', 1)[0] for line in text.splitlines() if line and not line.startswith('#')]
+
+    def test_every_series_is_rendered_once(self):
+        for metric in instrumentation._metrics:
+            labels = ['test'] * len(metric.labelnames)
+            if isinstance(metric, Histogram):
+                metric.observe(0.1, *labels)
+            else:
+                metric.inc(*labels)
+        series = self.series(render_metrics())
+        self.assertEqual(len(series), len(set(series)))
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('districts_test_seconds', 'Test histogram', ('view',), buckets=(0.5, 0.1, 0.1, 1.0))
+        self.addCleanup(instrumentation._metrics.remove, histogram)
+        for value in (0.05, 0.1, 0.7, 3.0):
+            histogram.observe(value, 'index')
+        self.assertEqual(histogram.samples(), [
+            'districts_test_seconds_bucket{view="index",le="0.1"} 2',
+            'districts_test_seconds_bucket{view="index",le="0.5"} 2',
+            'districts_test_seconds_bucket{view="index",le="1.0"} 3',
+            'districts_test_seconds_bucket{view="index",le="+Inf"} 4',
+            'districts_test_seconds_sum{view="index"} 3.85',
+            'districts_test_seconds_count{view="index"} 4',
+        ])
+
+    def test_counter_escapes_label_values(self):
+        counter = Counter('districts_test_total', 'Test counter', ('name',))
+        self.addCleanup(instrumentation._metrics.remove, counter)
+        counter.inc('say "hi"\n')
+        counter.inc('say "hi"\n', amount=2)
+        self.assertEqual(counter.samples(), ['districts_test_total{name="say \\"hi\\"\\n"} 3'])
+
+    def test_requests_are_timed_and_exposed(self):
+        before = instrumentation.REQUEST_SECONDS.count('metrics', 'GET', '200')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], instrumentation.CONTENT_TYPE)
+        self.assertIn('# TYPE districts_request_duration_seconds histogram', response.content.decode())
+        self.assertEqual(instrumentation.REQUEST_SECONDS.count('metrics', 'GET', '200'), before + 1)
+
+
+class SQLiteCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='districts-tests-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.cache = SQLiteCache(os.path.join(directory, 'cache.sqlite3'), {})
+
+    def test_async_bulk_methods_run_one_batch(self):
+        data = {f'weather_{i}': HourlyForecast('2025-01-20T00', {'temperature_2m': [20.0 + i] * 24})
+                for i in range(20)}
+
+        async def scenario():
+            await self.cache.aset_many(data, timeout=60)
+            found = await self.cache.aget_many([*data, 'missing'])
+            await self.cache.adelete_many(list(data)[:5])
+            return found, await self.cache.aget_many(list(data))
+
+        with mock.patch.object(self.cache, 'get_many', wraps=self.cache.get_many) as get_many, \
+                mock.patch.object(self.cache, 'set_many', wraps=self.cache.set_many) as set_many:
+            found, remaining = asyncio.run(scenario())
+        self.assertEqual(get_many.call_count, 2)
+        self.assertEqual(set_many.call_count, 1)
+        self.assertEqual(set(found), set(data))
+        self.assertEqual(found['weather_3'].value_at('temperature_2m', '2025-01-20T05'), 23.0)
+        self.assertEqual(len(remaining), 15)
+
+    def test_add_only_replaces_expired_entries(self):
+        self.assertTrue(self.cache.add('lock', 'first', timeout=60))
+        self.assertFalse(self.cache.add('lock', 'second', timeout=60))
+        self.assertEqual(self.cache.get('lock'), 'first')
+        self.cache.set('lock', 'stale', timeout=-1)
+        self.assertTrue(asyncio.run(self.cache.aadd('lock', 'third', timeout=60)))
+        self.assertEqual(self.cache.get('lock'), 'third')
+
+
+class SnapshotFileTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='districts-tests-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'metrics_snapshot.bin')
+
+    def snapshots(self, offset):
+        metrics = sample_metrics()
+        districts = [{'name': metric.name, 'latitude': metric.latitude, 'longitude': metric.longitude}
+                     for metric in metrics]
+        store = sample_store([metric.name for metric in metrics])
+        store.matrices['temperature_2m'] += offset
+        return {
+            METRICS_CACHE_KEY: {'metrics': metrics, 'computed_at': 1.0},
+            FEATURES_CACHE_KEY: {'features': FeatureIndex.build(districts, store), 'computed_at': 1.0},
+        }
+
+    def test_arrays_are_views_of_the_mapped_file(self):
+        snapshots = self.snapshots(0)
+        self.assertTrue(write_snapshot_file(snapshots, self.path))
+        loaded = read_snapshot_file(self.path)
+        self.assertEqual(loaded[METRICS_CACHE_KEY], snapshots[METRICS_CACHE_KEY])
+        expected = snapshots[FEATURES_CACHE_KEY]['features'].prefix
+        prefix = loaded[FEATURES_CACHE_KEY]['features'].prefix
+        np.testing.assert_array_equal(prefix, expected)
+        self.assertFalse(prefix.flags.writeable)
+        base = prefix
+        while isinstance(base, np.ndarray):
+            base = base.base
+        self.assertIsInstance(base.obj, mmap.mmap)
+
+        # A newer snapshot renamed over the file leaves the one already loaded as it was
+        self.assertTrue(write_snapshot_file(self.snapshots(5), self.path))
+        np.testing.assert_array_equal(prefix, expected)
+        self.assertFalse(np.array_equal(read_snapshot_file(self.path)[FEATURES_CACHE_KEY]['features'].prefix,
+                                        expected))
+
+    def test_a_missing_or_corrupt_file_is_no_snapshot(self):
+        self.assertIsNone(read_snapshot_file(self.path))
+        with open(self.path, 'wb') as f:
+            f.write(b'X\xff\xff')
+        with self.assertLogs('districts.snapshot_file', 'ERROR'):
+            self.assertIsNone(read_snapshot_file(self.path))
+
+
+class FeatureIndexTests(SimpleTestCase):
+    def test_missing_features_are_reported_as_null(self):
+        store = sample_store(['Dhaka', 'Sylhet', 'Khulna'])
+        store.matrices['temperature_2m'][1] = np.nan  # Sylhet never got a weather forecast
+        districts = [{'name': name, 'latitude': 23.0 + i, 'longitude': 90.0 + i}
+                     for i, name in enumerate(store.names)]
+        features = FeatureIndex.build(districts, store)
+        weights = {'temperature': 1.0, 'pm25': 1.0}
+        for index in (features, FeatureIndex.from_bytes(features.to_bytes())):
+            by_name = {row['name']: row for row in index.top(weights, 14, 14)}
+            self.assertIsNone(by_name['Sylhet']['temperature'])
+            self.assertIsNotNone(by_name['Sylhet']['pm25'])
+            self.assertIsNotNone(by_name['Dhaka']['temperature'])
+            self.assertEqual(len(by_name), 3)
+
+    def test_encodings_without_the_mask_still_decode(self):
+        store = sample_store(['Dhaka', 'Sylhet'])
+        districts = [{'name': name, 'latitude': 23.0, 'longitude': 90.0} for name in store.names]
+        features = FeatureIndex.build(districts, store)
+        legacy = features.to_bytes()[:-features.missing.size]
+        self.assertEqual(FeatureIndex.from_bytes(legacy).top({'pm25': 1.0}), features.top({'pm25': 1.0}))
+
+
+class MetricsJSONTests(SimpleTestCase):
+    # The hand-written encoder must produce the bytes DRF would for the same records
+    def render(self, data):
+        return JSONRenderer().render(data)
+
+    def test_matches_the_serializer(self):
+        metrics = sample_metrics() + [
+            DistrictMetrics("Cox's Bazar", 21.4272, 92.0058, 29.0, 1e-07),
+            DistrictMetrics('Chapai "Nawabganj"\\', 24.5965, 88.2775, -0.0, 1e+16),
+            DistrictMetrics('ব্রাহ্মণবাড়িয়া\n', 23.9571, 91.1119, 0.30000000000000004, 123456789.125),
+            DistrictMetrics('Tab\t\u2028\u2029\x00', -1.5e-300, 1.7976931348623157e+308, 5e-324, 2.5e-05),
+        ]
+        for metric in metrics:
+            self.assertEqual(metric.to_json(), self.render(TopDistrictSerializer(metric).data))
+        self.assertEqual(metrics_json(metrics), self.render(TopDistrictSerializer(metrics, many=True).data))
+        self.assertEqual(metrics_json([]), self.render(TopDistrictSerializer([], many=True).data))
+
+    def test_rejects_non_finite_floats_like_the_renderer(self):
+        metric = DistrictMetrics('Dhaka', 23.8103, 90.4125, float('nan'), 88.2)
+        with self.assertRaises(ValueError):
+            self.render(TopDistrictSerializer(metric).data)
+        with self.assertRaises(ValueError):
+            metric.to_json()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TravelRecommendationFormTests(TestCase):
+    def post(self, data, **headers):
+        return self.client.post('/travel-recommendation/', data, **headers)
+
+    def test_non_ajax_posts_get_json(self):
+        travel_date = (local_now().date() + timedelta(days=1)).isoformat()
+        current = {'temp': 32.0, 'pm25': 80.0, 'degraded': False}
+        destination = {'temp': 26.0, 'pm25': 30.0, 'degraded': False}
+        with mock.patch('districts.views.run_async_fetch_travel', return_value=(current, destination)):
+            response = self.post({'current_district': 'Dhaka', 'destination_district': 'Sylhet',
+                                  'travel_date': travel_date})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['recommendation'], 'Recommended')
+
+        with self.assertLogs('django.request', 'WARNING'):
+            response = self.post({'current_district': 'Dhaka'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('required', response.json()['error'])
+
+        with self.assertLogs('django.request', 'WARNING'):
+            response = self.post({'current_district': 'Dhaka', 'destination_district': 'Atlantis',
+                                  'travel_date': travel_date})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'One or both selected districts are invalid')
+
+    def test_ajax_posts_get_the_page(self):
+        response = self.post({'current_district': 'Dhaka'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'required')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ConditionalResponseTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches['fragments'].clear()
+
+    def test_top_districts_revalidates(self):
+        cache.set(RANKINGS_CACHE_KEY, {'rankings': RankingIndex.build(sample_metrics()), 'computed_at': time.time()})
+        response = self.client.get('/top-districts/?limit=2')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get('/top-districts/?limit=2', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+        response = self.client.get('/top-districts/?limit=3', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_index_revalidates_with_a_csrf_cookie(self):
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = 'x' * 32
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_index_without_a_csrf_cookie_is_always_rendered(self):
+        response = self.client.get('/', HTTP_IF_NONE_MATCH='"anything"')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertIn(settings.CSRF_COOKIE_NAME, response.cookies)
+
+    def fragment(self, registry):
+        return caches['fragments'].get(make_template_fragment_key('district_options', [registry.version]))
+
+    def test_district_options_are_keyed_by_registry_version(self):
+        registry = get_registry()
+        self.assertContains(self.client.get('/'), '<option value="Dhaka">')
+        self.assertIsNotNone(self.fragment(registry))
+
+        smaller = DistrictRegistry([record for record in registry if record.name != 'Dhaka'], 'database')
+        self.assertNotEqual(smaller.version, registry.version)
+        with mock.patch('districts.views.get_registry', return_value=smaller):
+            response = self.client.get('/')
+        self.assertNotContains(response, '<option value="Dhaka">')
+        self.assertContains(response, '<option value="Sylhet">')
+        self.assertIsNotNone(self.fragment(smaller))
+
+
+@mock.patch('districts.services.local_now', return_value=datetime(2025, 1, 20, 10, 30))
+class IncrementalRefreshTests(SimpleTestCase):
+    # The forecast window is 2025-01-20T00 (today) to 2025-01-27T00, and the current hour is 10:00
+
+    def forecast(self, start, values, fetched_at=1000.0):
+        return HourlyForecast(start, {'temperature_2m': values}, fetched_at)
+
+    def test_full_horizon_without_a_stale_forecast(self, local_now):
+        self.assertEqual(forecast_params('temperature_2m'),
+                         {'hourly': 'temperature_2m', 'timezone': 'Asia/Dhaka', 'forecast_days': 7})
+
+    def test_patch_from_the_current_hour(self, local_now):
+        params = forecast_params('temperature_2m', self.forecast('2025-01-20T00', [20.0] * 168))
+        self.assertEqual(params['start_hour'], '2025-01-20T10:00')
+        self.assertEqual(params['end_hour'], '2025-01-26T23:00')
+        self.assertNotIn('forecast_days', params)
+
+    def test_patch_from_where_an_old_series_ends(self, local_now):
+        # Ends at 06:00 today, before the current hour: the gap up to now is requested too
+        params = forecast_params('temperature_2m', self.forecast('2025-01-19T00', [20.0] * 30))
+        self.assertEqual(params['start_hour'], '2025-01-20T06:00')
+        # Ended before today: nothing earlier than the window is requested
+        params = forecast_params('temperature_2m', self.forecast('2025-01-17T00', [20.0] * 24))
+        self.assertEqual(params['start_hour'], '2025-01-20T00:00')
+
+    def test_merge_keeps_stale_hours_where_fresh_ones_are_null(self, local_now):
+        stale = self.forecast('2025-01-19T00', np.arange(48, dtype=np.float32), fetched_at=1000.0)
+        fresh = self.forecast('2025-01-20T10', [50.0, np.nan, 52.0], fetched_at=2000.0)
+        merged = merge_forecast(stale, fresh)
+        # Yesterday's hours are clipped and the series runs to the end of the window
+        self.assertEqual(merged.start, to_hour('2025-01-20T00'))
+        self.assertEqual(merged.hours, 168)
+        self.assertEqual(merged.fetched_at, 2000.0)
+        values = merged.variables['temperature_2m']
+        np.testing.assert_array_equal(values[:10], np.arange(24, 34))
+        np.testing.assert_array_equal(values[10:13], [50.0, 35.0, 52.0])
+        np.testing.assert_array_equal(values[13:24], np.arange(37, 48))
+        self.assertTrue(np.isnan(values[24:]).all())
+
+    def test_merge_falls_back_to_whichever_forecast_exists(self, local_now):
+        stale = self.forecast('2025-01-20T00', [20.0] * 24)
+        fresh = self.forecast('2025-01-20T10', [30.0] * 24)
+        self.assertIs(merge_forecast(stale, None), stale)
+        self.assertIs(merge_forecast(None, fresh), fresh)
+
+    def test_without_incremental_refresh(self, local_now):
+        stale = self.forecast('2025-01-20T00', [20.0] * 168)
+        fresh = self.forecast('2025-01-20T00', [30.0] * 168)
+        with mock.patch('districts.services.INCREMENTAL_REFRESH', False):
+            self.assertEqual(forecast_params('temperature_2m', stale)['forecast_days'], 7)
+            self.assertNotIn('start_hour', forecast_params('temperature_2m', stale))
+            self.assertIs(merge_forecast(stale, fresh), fresh)
+            self.assertIsNone(merge_forecast(stale, None))
+
+    def test_responses_with_gaps_are_aligned_by_time(self, local_now):
+        forecast = HourlyForecast.from_response({'hourly': {
+            'time': ['2025-01-20T00:00', '2025-01-20T01:00', '2025-01-20T03:00'],
+            'temperature_2m': [20.0, None, 23.0],
+        }}, ['temperature_2m', 'pm2_5'])
+        self.assertEqual(list(forecast.variables), ['temperature_2m'])
+        np.testing.assert_array_equal(np.isnan(forecast.variables['temperature_2m']), [False, True, True, False])
+        self.assertEqual(forecast.value_at('temperature_2m', '2025-01-20T03'), 23.0)
+
+
+class SpatialIndexTests(SimpleTestCase):
+    QUERIES = [(23.8, 90.4), (20.6, 88.1), (26.6, 92.6), (10.0, 80.0), (35.0, 100.0), (23.0, 120.0)]
+
+    def points(self, count, seed=0):
+        generator = np.random.default_rng(seed)
+        return generator.uniform(20.5, 26.7, count), generator.uniform(88.0, 92.7, count)
+
+    def assert_nearest_matches(self, index, latitudes, longitudes, latitude, longitude, k):
+        distances = haversine_km(latitude, longitude, latitudes, longitudes)
+        expected = np.sort(distances)[:k]
+        found, found_distances = index.nearest(latitude, longitude, k)
+        self.assertEqual(len(found), min(k, len(latitudes)))
+        np.testing.assert_allclose(found_distances, expected)
+        np.testing.assert_allclose(distances[found], found_distances)
+
+    def test_nearest_matches_brute_force(self):
+        for count in (1, 7, 64, 5000, 50000):
+            latitudes, longitudes = self.points(count, seed=count)
+            index = SpatialIndex(latitudes, longitudes)
+            for latitude, longitude in self.QUERIES:
+                for k in (1, 5, count + 3):  # k > n returns every point
+                    with self.subTest(count=count, query=(latitude, longitude), k=k):
+                        self.assert_nearest_matches(index, latitudes, longitudes, latitude, longitude, k)
+
+    def test_within_matches_brute_force(self):
+        for count in (7, 64, 50000):
+            latitudes, longitudes = self.points(count, seed=count)
+            index = SpatialIndex(latitudes, longitudes)
+            for latitude, longitude in self.QUERIES:
+                for radius in (5.0, 50.0, 400.0, 2000.0):
+                    with self.subTest(count=count, query=(latitude, longitude), radius=radius):
+                        distances = haversine_km(latitude, longitude, latitudes, longitudes)
+                        found, found_distances = index.within(latitude, longitude, radius)
+                        self.assertEqual(set(found.tolist()), set(np.flatnonzero(distances <= radius).tolist()))
+                        self.assertTrue(np.all(np.diff(found_distances) >= 0))
+
+    def test_empty_index(self):
+        index = SpatialIndex([], [])
+        self.assertEqual(len(index.nearest(23.8, 90.4, 3)[0]), 0)
+        self.assertEqual(len(index.within(23.8, 90.4, 100.0)[0]), 0)
@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from django.conf import settings
+from yarl import URL
+
+from .instrumentation import register_collector
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT_REQUESTS = getattr(settings, 'OPEN_METEO_MAX_CONCURRENT', 5)  # In-flight upstream requests per event loop
+RATE_LIMIT = getattr(settings, 'OPEN_METEO_RATE_LIMIT', 10.0)  # Requests per second per host (Open-Meteo allows 600/min)
+RATE_BURST = getattr(settings, 'OPEN_METEO_RATE_BURST', 10)
+MIN_RATE = 0.5
+RATE_INCREASE = 0.1  # Added to the rate after each success, up to RATE_LIMIT
+RATE_DECREASE = 0.5  # Rate multiplier after a 429, at most once per second
+BREAKER_THRESHOLD = getattr(settings, 'OPEN_METEO_BREAKER_THRESHOLD', 5)  # Consecutive failures before opening
+BREAKER_COOLDOWN = getattr(settings, 'OPEN_METEO_BREAKER_COOLDOWN', 30)  # Seconds open before a probe request
+HEDGE_PERCENTILE = 95
+HEDGE_DEFAULT_DELAY = getattr(settings, 'OPEN_METEO_HEDGE_DELAY', 0.2)  # Seconds, until there are enough samples
+HEDGE_MIN_DELAY = 0.02
+LATENCY_WINDOW = 200  # Recent latencies kept per host
+LATENCY_MIN_SAMPLES = 20
+
+
+class RateLimiter:
+    # Token bucket shared by every request to one host, across threads and event loops. The rate grows
+    # slowly while requests succeed and is halved on a 429; a Retry-After pauses the whole bucket.
+
+    def __init__(self, rate=RATE_LIMIT, burst=RATE_BURST, min_rate=MIN_RATE):
+        self._lock = threading.Lock()
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._decreased_at = 0.0
+
+    def _reserve(self, now):
+        if now > self._updated:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+        self._tokens -= 1
+        # _updated is in the future while paused by a Retry-After; after that the deficit refills at the current rate
+        return (self._updated - now) + max(-self._tokens, 0.0) / self.rate
+
+    async def acquire(self):
+        with self._lock:
+            wait = self._reserve(time.monotonic())
+        while wait > 0:
+            await asyncio.sleep(wait)
+            with self._lock:
+                wait = self._updated - time.monotonic()  # A Retry-After may have arrived while waiting
+
+    def record_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+
+    def record_throttled(self, retry_after=None):
+        now = time.monotonic()
+        with self._lock:
+            # Requests already in flight get the same 429; count it as one signal
+            if now - self._decreased_at >= 1.0:
+                self.rate = max(self.min_rate, self.rate * RATE_DECREASE)
+                self._decreased_at = now
+            self._tokens = min(self._tokens, 0.0)
+            if retry_after:
+                self._updated = max(self._updated, now + retry_after)
+            rate = self.rate
+        logger.warning(f"Upstream rate limited, slowing to {rate:.2f} requests/s"
+                       + (f" after a {retry_after:.0f}s pause" if retry_after else ""))
+
+
+class CircuitBreaker:
+    # Stops calling a host after BREAKER_THRESHOLD consecutive failures. After the cooldown a single
+    # probe request is let through; its success closes the circuit, its failure re-opens it.
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self._lock = threading.Lock()
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Upstream recovered, closing circuit")
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self._failures >= self.threshold):
+                logger.warning(f"Upstream failing, opening circuit for {self.cooldown}s")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self):
+        # The request ended without telling whether the host is healthy (cancelled, rate limited)
+        with self._lock:
+            self._probing = False
+
+
+class LatencyTracker:
+    # Latencies of the last LATENCY_WINDOW successful requests to one host. A hedged request is sent
+    # once the first has taken longer than the recent p95, so only the slowest few percent are duplicated.
+
+    def __init__(self, size=LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=size)
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q):
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < LATENCY_MIN_SAMPLES:
+            return None
+        return samples[min(int(len(samples) * q / 100), len(samples) - 1)]
+
+    def hedge_delay(self):
+        delay = self.percentile(HEDGE_PERCENTILE)
+        return HEDGE_DEFAULT_DELAY if delay is None else max(delay, HEDGE_MIN_DELAY)
+
+
+_lock = threading.Lock()
+_limiters = {}
+_breakers = {}
+_latencies = {}
+
+
+def _for_host(registry, url, factory):
+    host = URL(url).host
+    with _lock:
+        value = registry.get(host)
+        if value is None:
+            value = registry[host] = factory()
+        return value
+
+
+def get_rate_limiter(url):
+    return _for_host(_limiters, url, RateLimiter)
+
+
+def get_circuit_breaker(url):
+    return _for_host(_breakers, url, CircuitBreaker)
+
+
+def get_latency_tracker(url):
+    return _for_host(_latencies, url, LatencyTracker)
+
+
+@register_collector
+def _throttle_metrics():
+    with _lock:
+        limiters = list(_limiters.items())
+        breakers = list(_breakers.items())
+    return [
+        ('districts_upstream_rate_limit', 'gauge', 'Current adaptive request rate per host (requests/s)',
+         [({'host': host}, limiter.rate) for host, limiter in limiters]),
+        ('districts_upstream_circuit_open', 'gauge', '1 while the host circuit is open or half open',
+         [({'host': host}, int(breaker.state != CircuitBreaker.CLOSED)) for host, breaker in breakers]),
+    ]
+
+
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def get_upstream_semaphore():
+    # asyncio.Semaphore is bound to one loop, so each loop (the background runtime, an ASGI server) gets its own
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    return semaphore
+
+
+def parse_retry_after(value):
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
@@ -1,8 +1,42 @@
+from django.conf import settings
 from django.urls import path
-from .views import IndexView, TravelRecommendationView, TopDistrictsView
+from .views import (
+    AsyncDistrictMetricsStreamView,
+    AsyncRankDistrictsView,
+    AsyncTopDistrictsView,
+    AsyncTravelRecommendationView,
+    DistrictHistoryView,
+    DistrictMetricsStreamView,
+    HistoricalTopDistrictsView,
+    IndexView,
+    MetricsView,
+    NearbyDistrictsView,
+    NearestDistrictsView,
+    RankDistrictsView,
+    TopDistrictsView,
+    TravelRecommendationBatchView,
+    TravelRecommendationRangeView,
+    TravelRecommendationView
+)
+
+# Under ASGI the async-native views await upstream calls on the server's event loop
+if settings.DISTRICTS_ASYNC_VIEWS:
+    TopDistrictsView = AsyncTopDistrictsView
+    DistrictMetricsStreamView = AsyncDistrictMetricsStreamView
+    RankDistrictsView = AsyncRankDistrictsView
+    TravelRecommendationView = AsyncTravelRecommendationView
 
 urlpatterns = [
     path('', IndexView.as_view(), name='index'),
     path('top-districts/', TopDistrictsView.as_view(), name='top_districts'),
+    path('rank-districts/', RankDistrictsView.as_view(), name='rank_districts'),
+    path('top-districts/stream/', DistrictMetricsStreamView.as_view(), name='district_metrics_stream'),
+    path('districts/nearest/', NearestDistrictsView.as_view(), name='nearest_districts'),
+    path('districts/nearby/', NearbyDistrictsView.as_view(), name='nearby_districts'),
+    path('history/top-districts/', HistoricalTopDistrictsView.as_view(), name='historical_top_districts'),
+    path('history/districts/<str:name>/', DistrictHistoryView.as_view(), name='district_history'),
     path('travel-recommendation/', TravelRecommendationView.as_view(), name='travel_recommendation'),
-]
\ No newline at end of file
+    path('travel-recommendation/batch/', TravelRecommendationBatchView.as_view(), name='travel_recommendation_batch'),
+    path('travel-recommendation/range/', TravelRecommendationRangeView.as_view(), name='travel_recommendation_range'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
+]
@@ -1,143 +1,509 @@
+from django.conf import settings
 from django.views.generic import View
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.template.loader import get_template
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from .models import District
-from .serializers import TopDistrictSerializer, TravelRecommendationSerializer
+from .rankings import DEFAULT_LIMIT, DEFAULT_PROFILE, DEFAULT_SORT, FEATURES, PROFILES, RankingIndex
+from .recommendations import DEFAULT_WINDOWS, build_recommendation, compare_days, compare_trips
+from .history import district_history, historical_metrics
+from .instrumentation import CONTENT_TYPE as METRICS_CONTENT_TYPE, render_metrics
+from .registry import aget_registry, get_registry
 from .services import (
-    fetch_districts_data,
-    get_district_metrics,
-    run_async_fetch_travel
+    FORECAST_DAYS,
+    aget_features,
+    aget_rankings,
+    fetch_travel_metrics,
+    get_features,
+    get_metrics_by_name,
+    get_rankings,
+    iter_district_metrics,
+    local_now,
+    run_async_fetch_store,
+    run_async_fetch_travel,
+    run_async_iter_districts
 )
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+import hashlib
+import json
 import logging
+import math
 import time
 
 logger = logging.getLogger(__name__)
 
+MAX_BATCH_TRIPS = 200
+MAX_HOUR_WINDOWS = 24
+MAX_NEAREST = 50
+DEFAULT_RADIUS_KM = 50
+MAX_RADIUS_KM = 1000
+NEARBY_SORTS = ('temperature', 'pm25', 'distance')
+DEFAULT_HISTORY_DAYS = 7
+MAX_HISTORY_DAYS = 366
+TOP_DISTRICTS_MAX_AGE = getattr(settings, 'TOP_DISTRICTS_MAX_AGE', 300)  # Seconds clients may reuse a ranking
 
-class IndexView(View):
-    def get(self, request):
-        districts = District.objects.all().order_by('name')
-        if not districts.exists():
+
+def index_context(registry, **extra):
+    return {
+        'districts': registry.districts,
+        'districts_version': registry.version,  # Keys the cached <option> fragment
+        'today': datetime.now(),
+        'seven_days_later': datetime.now() + timedelta(days=7),
+        **extra
+    }
+
+
+@lru_cache(maxsize=None)
+def template_digest(name):
+    return hashlib.sha1(get_template(name).template.source.encode('utf-8')).hexdigest()
+
+
+def index_etag(request, registry):
+    # The page only changes with the district set, the date (the date picker bounds) and the template. Its form
+    # carries a token masked from the visitor's CSRF cookie, so the cookie is part of the tag too, and a visitor
+    # without one yet always gets a fresh page that sets it.
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME)
+    if not csrf_cookie:
+        return None
+    key = f"{registry.version}:{date.today().isoformat()}:{template_digest('index.html')}:{csrf_cookie}"
+    return quote_etag(hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+
+def render_index(request, registry):
+    # Seeded by the load_districts command / post_migrate; the registry falls back to the bundled JSON until then
+    etag = index_etag(request, registry)
+    response = get_conditional_response(request, etag=etag) if etag else None
+    if response is None:
+        error = None if registry.districts else "No district data available"
+        response = render(request, 'index.html', index_context(registry, error=error))
+    if etag:
+        response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def conditional_json(request, body, max_age):
+    # Strong ETag over the exact bytes, so a client polling an unchanged ranking gets an empty 304
+    etag = quote_etag(hashlib.blake2b(body, digest_size=16).hexdigest())
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=max_age)
+    return response
+
+
+def parse_top_districts_params(params):
+    sort = params.get('sort', DEFAULT_SORT)
+    if sort not in RankingIndex.SORTS:
+        raise ValueError(f"sort must be one of: {', '.join(RankingIndex.SORTS)}")
+    try:
+        limit = int(params.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    return sort, limit
+
+
+def parse_ranking_params(params):
+    # ?profile=outdoor, or ?weights=temperature:1,pm25:0.5 for a custom one; ?hours=10-16 (local, inclusive)
+    if 'weights' in params:
+        weights = {}
+        for part in params['weights'].split(','):
+            name, _, weight = part.partition(':')
+            if name.strip() not in FEATURES:
+                raise ValueError(f"weights must name features from: {', '.join(FEATURES)}")
             try:
-                districts_data = fetch_districts_data()
-                if not districts_data:
-                    context = {
-                        'districts': [],
-                        'today': datetime.now(),
-                        'seven_days_later': datetime.now() + timedelta(days=7),
-                        'error': "No district data available"
-                    }
-                    return render(request, 'index.html', context)
-                for district_data in districts_data:
-                    District.objects.get_or_create(
-                        name=district_data['name'],
-                        latitude=district_data['latitude'],
-                        longitude=district_data['longitude']
-                    )
-                districts = District.objects.all().order_by('name')
-            except Exception as e:
-                context = {
-                    'districts': [],
-                    'today': datetime.now(),
-                    'seven_days_later': datetime.now() + timedelta(days=7),
-                    'error': f"Error loading districts: {str(e)}"
-                }
-                return render(request, 'index.html', context)
+                weights[name.strip()] = float(weight or 1)
+            except ValueError:
+                weights[name.strip()] = math.nan
+            if not math.isfinite(weights[name.strip()]):
+                raise ValueError(f"Invalid weight for {name.strip()}")
+        if not any(weights.values()):
+            raise ValueError("At least one weight must be non-zero")
+    else:
+        profile = params.get('profile', DEFAULT_PROFILE)
+        if profile not in PROFILES:
+            raise ValueError(f"profile must be one of: {', '.join(PROFILES)}")
+        weights = PROFILES[profile]
+
+    first_hour, last_hour = parse_hour_window(params.get('hours', '14'))
+    limit = parse_positive(params, 'limit', DEFAULT_LIMIT)
+    return weights, first_hour, last_hour, limit
+
+
+def parse_hour_window(value):
+    first, _, last = str(value).partition('-')
+    try:
+        first_hour = int(first)
+        last_hour = int(last) if last else first_hour
+    except ValueError:
+        first_hour = last_hour = -1
+    if not (0 <= first_hour < 24 and 0 <= last_hour < 24):
+        raise ValueError("hours must be an hour (0-23) or a range such as 10-16")
+    return first_hour, last_hour
+
+
+def parse_range_date(value, today):
+    # Only days the forecast store covers: today (in the forecast timezone) and the following FORECAST_DAYS - 1
+    day = datetime.strptime(value, '%Y-%m-%d').date()
+    last = today + timedelta(days=FORECAST_DAYS - 1)
+    if day < today or day > last:
+        raise ValueError(f"Dates must be between {today.isoformat()} and {last.isoformat()}")
+    return day
+
+
+def parse_travel_range(data):
+    # One trip over a range of dates (default: every day the forecast covers) and hour windows, e.g.
+    # {"current_district": "Dhaka", "destination_district": "Sylhet", "hours": ["14", "6-11"]}
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object")
+    origin, destination = data.get('current_district'), data.get('destination_district')
+    if not origin or not destination:
+        raise ValueError("current_district and destination_district are required")
+    if not isinstance(origin, str) or not isinstance(destination, str):
+        raise ValueError("One or both selected districts are invalid")
+    today = local_now().date()
+    start = parse_range_date(data['start_date'], today) if data.get('start_date') else today
+    end = parse_range_date(data['end_date'], today) if data.get('end_date') \
+        else today + timedelta(days=FORECAST_DAYS - 1)
+    if start > end:
+        raise ValueError("start_date must not be after end_date")
+
+    hours = data.get('hours')
+    if not hours:
+        windows = DEFAULT_WINDOWS
+    else:
+        if isinstance(hours, str):
+            hours = hours.split(',')
+        if not isinstance(hours, list) or len(hours) > MAX_HOUR_WINDOWS:
+            raise ValueError(f"hours must be a list of at most {MAX_HOUR_WINDOWS} windows")
+        windows = tuple(dict.fromkeys(parse_hour_window(window) for window in hours))
+        if any(first > last for first, last in windows):
+            raise ValueError("Hour windows cannot span midnight")
+    dates = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    return origin, destination, dates, windows
+
+
+def ranking_response(request, features, metrics_age, weights, first_hour, last_hour, limit):
+    body = json.dumps(features.top(weights, first_hour, last_hour, limit), ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8')
+    response = conditional_json(request, body, TOP_DISTRICTS_MAX_AGE)
+    response['X-Metrics-Age'] = str(int(metrics_age))
+    return response
+
+
+def parse_positive(params, name, default, cast=int, maximum=None):
+    try:
+        value = cast(params.get(name, default))
+    except ValueError:
+        value = 0
+    if not value > 0:
+        raise ValueError(f"{name} must be a positive number")
+    if maximum is not None and value > maximum:
+        raise ValueError(f"{name} must be at most {maximum}")
+    return value
+
+
+def parse_coordinates(params):
+    try:
+        latitude = float(params['lat'])
+        longitude = float(params['lon'])
+    except (KeyError, ValueError):
+        raise ValueError("lat and lon query parameters are required and must be numbers")
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("lat must be within [-90, 90] and lon within [-180, 180]")
+    return latitude, longitude
+
+
+def parse_history_range(params):
+    # Defaults to the last week: the 7 local days before today
+    days = parse_positive(params, 'days', DEFAULT_HISTORY_DAYS, maximum=MAX_HISTORY_DAYS)
+    try:
+        end = date.fromisoformat(params['end']) if params.get('end') else local_now().date() - timedelta(days=1)
+        start = date.fromisoformat(params['start']) if params.get('start') else end - timedelta(days=days - 1)
+    except ValueError:
+        raise ValueError("start and end must be dates in YYYY-MM-DD format")
+    if start > end:
+        raise ValueError("start must not be after end")
+    if (end - start).days >= MAX_HISTORY_DAYS:
+        raise ValueError(f"The range can span at most {MAX_HISTORY_DAYS} days")
+    return start, end
+
+
+def nearby_district(record, distance, metrics):
+    metric = metrics.get(record.name, {})
+    return {
+        'name': record.name,
+        'latitude': record.latitude,
+        'longitude': record.longitude,
+        'distance_km': round(distance, 2),
+        'avg_temperature': metric.get('avg_temperature'),
+        'avg_pm25': metric.get('avg_pm25')
+    }
+
+
+def metrics_response(data, metrics_age):
+    response = Response(data, status=status.HTTP_200_OK)
+    if metrics_age is not None:
+        response['X-Metrics-Age'] = str(int(metrics_age))
+    return response
+
+
+def parse_travel_form(data):
+    current_district_name = data.get('current_district')
+    destination_district_name = data.get('destination_district')
+    travel_date_str = data.get('travel_date')
+
+    if not all([current_district_name, destination_district_name, travel_date_str]):
+        raise ValueError("All fields (current district, destination district, travel date) are required")
+    return current_district_name, destination_district_name, parse_travel_date(travel_date_str)
+
+
+def parse_travel_date(travel_date_str):
+    travel_date = datetime.strptime(travel_date_str, '%Y-%m-%d').date()
+    today = datetime.now().date()
+    if travel_date < today or travel_date > (today + timedelta(days=7)):
+        raise ValueError("Travel date must be within the next 7 days from today")
+    return travel_date
+
+
+def parse_batch_trips(data):
+    if 'trips' in data:
+        trips = data['trips']
+        if not isinstance(trips, list) or not all(isinstance(trip, dict) for trip in trips):
+            raise ValueError("trips must be a list of objects")
+        trips = [
+            (trip.get('current_district'), trip.get('destination_district'), trip.get('travel_date'))
+            for trip in trips
+        ]
+    elif 'destination_districts' in data:
+        destinations = data['destination_districts']
+        if not isinstance(destinations, list):
+            raise ValueError("destination_districts must be a list")
+        trips = [
+            (data.get('current_district'), destination, data.get('travel_date'))
+            for destination in destinations
+        ]
+    else:
+        raise ValueError("Provide either trips or current_district with destination_districts")
+
+    if not trips:
+        raise ValueError("At least one trip is required")
+    if len(trips) > MAX_BATCH_TRIPS:
+        raise ValueError(f"At most {MAX_BATCH_TRIPS} trips can be scored per request")
+    return trips
 
-        context = {
-            'districts': districts,
-            'today': datetime.now(),
-            'seven_days_later': datetime.now() + timedelta(days=7)
-        }
-        return render(request, 'index.html', context)
+
+def district_record(metric):
+    return b'{"type":"district",' + metric.to_json()[1:] + b'\n'
+
+
+def ranking_record(metrics, sort, limit):
+    top = RankingIndex.build(metrics).top(sort, limit)
+    return b'{"type":"ranking","sort":"' + sort.encode('utf-8') + b'","districts":' + top + b'}\n'
+
+
+def stream_metrics_records(batches, sort, limit):
+    metrics = []
+    for batch in batches:
+        metrics.extend(batch)
+        for metric in batch:
+            yield district_record(metric)
+    yield ranking_record(metrics, sort, limit)
+
+
+async def astream_metrics_records(batches, sort, limit):
+    metrics = []
+    async for batch in batches:
+        metrics.extend(batch)
+        for metric in batch:
+            yield district_record(metric)
+    yield ranking_record(metrics, sort, limit)
+
+
+def ndjson_response(records):
+    response = StreamingHttpResponse(records, content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Let nginx pass records through as they are produced
+    return response
+
+
+def log_elapsed(label, start_time):
+    elapsed_time = (time.perf_counter() - start_time) * 1000
+    logger.info(f"{label} processed in {elapsed_time:.2f} ms")
+    if elapsed_time > 500:
+        logger.warning(f"Response time exceeded 500 ms: {elapsed_time:.2f} ms")
+
+
+class IndexView(View):
+    def get(self, request):
+        return render_index(request, get_registry())
 
 
 class TopDistrictsView(APIView):
     def get(self, request):
-        start_time = time.time()
+        start_time = time.perf_counter()
 
-        # Fetch precomputed or cached metrics
-        district_data = get_district_metrics()
+        try:
+            sort, limit = parse_top_districts_params(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        if not district_data:
+        # Orderings and their JSON are precomputed on refresh; a stale snapshot is revalidated in the background
+        rankings, metrics_age = get_rankings()
+
+        if not rankings:
             return Response({"error": "No data available"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
-        # Sort by temperature and PM2.5, take top 10
-        district_data.sort(key=lambda x: (x['avg_temperature'], x['avg_pm25']))
-        top_districts = district_data[:10]
-        serializer = TopDistrictSerializer(top_districts, many=True)
+        log_elapsed("Top districts", start_time)
 
-        elapsed_time = (time.time() - start_time) * 1000
-        logger.info(f"Top districts processed in {elapsed_time:.2f} ms")
-        if elapsed_time > 500:
-            logger.warning(f"Response time exceeded 500 ms: {elapsed_time:.2f} ms")
+        response = conditional_json(request, rankings.top(sort, limit), TOP_DISTRICTS_MAX_AGE)
+        response['X-Metrics-Age'] = str(int(metrics_age))
+        return response
 
-        return Response(serializer.data, status=status.HTTP_200_OK)
 
+class RankDistrictsView(APIView):
+    def get(self, request):
+        start_time = time.perf_counter()
 
-class TravelRecommendationView(View):
+        try:
+            weights, first_hour, last_hour, limit = parse_ranking_params(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Normalized per-district features are precomputed on refresh; scoring a profile is one matrix product
+        features, metrics_age = get_features()
+
+        if not features:
+            return Response({"error": "No data available"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        response = ranking_response(request, features, metrics_age, weights, first_hour, last_hour, limit)
+        log_elapsed("Rank districts", start_time)
+        return response
+
+
+class DistrictMetricsStreamView(APIView):
     def get(self, request):
-        districts = District.objects.all().order_by('name')
-        if not districts.exists():
-            try:
-                districts_data = fetch_districts_data()
-                if not districts_data:
-                    context = {
-                        'districts': [],
-                        'today': datetime.now(),
-                        'seven_days_later': datetime.now() + timedelta(days=7),
-                        'error': "No district data available"
-                    }
-                    return render(request, 'index.html', context)
-                for district_data in districts_data:
-                    District.objects.get_or_create(
-                        name=district_data['name'],
-                        latitude=district_data['latitude'],
-                        longitude=district_data['longitude']
-                    )
-                districts = District.objects.all().order_by('name')
-            except Exception as e:
-                context = {
-                    'districts': [],
-                    'today': datetime.now(),
-                    'seven_days_later': datetime.now() + timedelta(days=7),
-                    'error': f"Error loading districts: {str(e)}"
-                }
-                return render(request, 'index.html', context)
+        try:
+            sort, limit = parse_top_districts_params(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        context = {
-            'districts': districts,
-            'today': datetime.now(),
-            'seven_days_later': datetime.now() + timedelta(days=7)
-        }
-        return render(request, 'index.html', context)
+        districts = get_registry().locations()
+        if not districts:
+            return Response({"error": "No data available"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        # One NDJSON record per district as soon as its forecasts arrive, then the ranking once all are in
+        return ndjson_response(stream_metrics_records(run_async_iter_districts(districts), sort, limit))
 
-    def post(self, request):
-        start_time = time.time()
-        districts = District.objects.all().order_by('name')
-        context = {
-            'districts': districts,
-            'today': datetime.now(),
-            'seven_days_later': datetime.now() + timedelta(days=7)
-        }
 
+class NearestDistrictsView(APIView):
+    def get(self, request):
         try:
-            current_district_name = request.POST.get('current_district')
-            destination_district_name = request.POST.get('destination_district')
-            travel_date_str = request.POST.get('travel_date')
+            latitude, longitude = parse_coordinates(request.query_params)
+            k = parse_positive(request.query_params, 'k', 1, maximum=MAX_NEAREST)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        nearest = get_registry().nearest(latitude, longitude, k)
+        metrics, metrics_age = get_metrics_by_name()
+        return metrics_response({
+            'latitude': latitude,
+            'longitude': longitude,
+            'districts': [nearby_district(record, distance, metrics) for record, distance in nearest]
+        }, metrics_age)
+
+
+class NearbyDistrictsView(APIView):
+    def get(self, request):
+        params = request.query_params
+        try:
+            latitude, longitude = parse_coordinates(params)
+            radius = parse_positive(params, 'radius', DEFAULT_RADIUS_KM, cast=float, maximum=MAX_RADIUS_KM)
+            limit = parse_positive(params, 'limit', DEFAULT_LIMIT)
+            sort = params.get('sort', DEFAULT_SORT)
+            if sort not in NEARBY_SORTS:
+                raise ValueError(f"sort must be one of: {', '.join(NEARBY_SORTS)}")
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-            if not all([current_district_name, destination_district_name, travel_date_str]):
-                raise ValueError("All fields (current district, destination district, travel date) are required")
+        metrics, metrics_age = get_metrics_by_name()
+        districts = [
+            nearby_district(record, distance, metrics)
+            for record, distance in get_registry().within(latitude, longitude, radius)
+        ]
+        if sort != 'distance':
+            # Coolest or cleanest first; districts without metrics go last, nearer ones break ties
+            field = 'avg_temperature' if sort == 'temperature' else 'avg_pm25'
+            districts.sort(key=lambda district: (district[field] is None, district[field] or 0,
+                                                 district['distance_km']))
+        return metrics_response({
+            'latitude': latitude,
+            'longitude': longitude,
+            'radius_km': radius,
+            'sort': sort,
+            'count': len(districts),
+            'districts': districts[:limit]
+        }, metrics_age)
 
-            current_district = District.objects.get(name=current_district_name)
-            destination_district = District.objects.get(name=destination_district_name)
-            travel_date = datetime.strptime(travel_date_str, '%Y-%m-%d').date()
-            today = datetime.now().date()
-            if travel_date < today or travel_date > (today + timedelta(days=7)):
-                raise ValueError("Travel date must be within the next 7 days from today")
+
+class HistoricalTopDistrictsView(APIView):
+    def get(self, request):
+        try:
+            sort, limit = parse_top_districts_params(request.query_params)
+            start, end = parse_history_range(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Served from the forecast history table only; no upstream calls
+        metrics = historical_metrics(get_registry(), start, end)
+        if not metrics:
+            return Response({"error": "No forecast history for this period"}, status=status.HTTP_404_NOT_FOUND)
+
+        response = HttpResponse(RankingIndex.build(metrics).top(sort, limit), content_type='application/json')
+        response['X-History-Range'] = f"{start.isoformat()}/{end.isoformat()}"
+        return response
+
+
+class DistrictHistoryView(APIView):
+    def get(self, request, name):
+        try:
+            start, end = parse_history_range(request.query_params)
+            record = get_registry().get(name)
+        except District.DoesNotExist:
+            return Response({"error": "District not found"}, status=status.HTTP_404_NOT_FOUND)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'name': record.name,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'days': district_history(record, start, end)
+        }, status=status.HTTP_200_OK)
+
+
+class TravelRecommendationView(View):
+    def get(self, request):
+        return render_index(request, get_registry())
+
+    def post(self, request):
+        start_time = time.perf_counter()
+        registry = get_registry()
+        context = index_context(registry)
+
+        try:
+            current_district_name, destination_district_name, travel_date = parse_travel_form(request.POST)
+            current_district = registry.get(current_district_name)
+            destination_district = registry.get(destination_district_name)
 
             # Fetch weather and air quality data asynchronously
             current_district_data = {'latitude': current_district.latitude, 'longitude': current_district.longitude}
@@ -146,60 +512,220 @@ class TravelRecommendationView(View):
             current_data, dest_data = run_async_fetch_travel(current_district_data, destination_district_data,
                                                              travel_date)
 
-            current_temp = current_data['temp']
-            current_pm25 = current_data['pm25']
-            dest_temp = dest_data['temp']
-            dest_pm25 = dest_data['pm25']
-
             # Generate recommendation
-            temp_diff = current_temp - dest_temp
-            pm25_diff = current_pm25 - dest_pm25
-            if temp_diff > 0 and pm25_diff > 0:
-                recommendation = "Recommended"
-                reason = f"Your destination is {temp_diff:.1f}°C cooler and has {pm25_diff:.1f} µg/m³ better air quality. Enjoy your trip!"
-            else:
-                recommendation = "Not Recommended"
-                reasons = []
-                if temp_diff <= 0:
-                    reasons.append(f"hotter by {abs(temp_diff):.1f}°C" if temp_diff < 0 else "same temperature")
-                if pm25_diff <= 0:
-                    reasons.append(
-                        f"worse air quality by {abs(pm25_diff):.1f} µg/m³" if pm25_diff < 0 else "same air quality")
-                reason = f"Your destination is {' and '.join(reasons)} than your current district. It’s better to stay where you are."
-
-            response_data = {
-                'recommendation': recommendation,
-                'reason': reason,
-                'current': {'temp': current_temp, 'pm25': current_pm25},
-                'destination': {'temp': dest_temp, 'pm25': dest_pm25}
-            }
-
-            elapsed_time = (time.time() - start_time) * 1000
-            logger.info(f"Travel recommendation processed in {elapsed_time:.2f} ms")
-            if elapsed_time > 500:
-                logger.warning(f"Response time exceeded 500 ms: {elapsed_time:.2f} ms")
+            response_data = build_recommendation(current_data, dest_data)
+
+            log_elapsed("Travel recommendation", start_time)
 
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                 context['recommendation'] = response_data
                 return render(request, 'index.html', context)
-            return Response(response_data, status=status.HTTP_200_OK)
+            return JsonResponse(response_data, status=status.HTTP_200_OK)
 
         except District.DoesNotExist:
             error_msg = "One or both selected districts are invalid"
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                 context['error'] = error_msg
                 return render(request, 'index.html', context)
-            return Response({"error": error_msg}, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse({"error": error_msg}, status=status.HTTP_400_BAD_REQUEST)
         except ValueError as e:
             error_msg = str(e)
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                 context['error'] = error_msg
                 return render(request, 'index.html', context)
-            return Response({"error": error_msg}, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse({"error": error_msg}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             logger.error(f"Error in travel recommendation: {str(e)}")
             error_msg = "An unexpected error occurred"
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                 context['error'] = error_msg
                 return render(request, 'index.html', context)
-            return Response({"error": error_msg}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            return JsonResponse({"error": error_msg}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MetricsView(View):
+    def get(self, request):
+        return HttpResponse(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+
+class TravelRecommendationBatchView(APIView):
+    def post(self, request):
+        start_time = time.perf_counter()
+
+        try:
+            trips = parse_batch_trips(request.data)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        districts = get_registry().by_name
+
+        results = [None] * len(trips)
+        valid_trips = []
+        for i, (origin, destination, travel_date_str) in enumerate(trips):
+            result = {'current_district': origin, 'destination_district': destination, 'travel_date': travel_date_str}
+            try:
+                if not all([origin, destination, travel_date_str]):
+                    raise ValueError("All fields (current district, destination district, travel date) are required")
+                travel_date = parse_travel_date(travel_date_str)
+                if not isinstance(origin, str) or not isinstance(destination, str) \
+                        or origin not in districts or destination not in districts:
+                    raise ValueError("One or both selected districts are invalid")
+            except (TypeError, ValueError) as e:
+                results[i] = {**result, 'error': str(e)}
+                continue
+            results[i] = result
+            valid_trips.append((i, origin, destination, travel_date))
+
+        # Each district's forecast is fetched once, however many trips it appears in
+        involved = {name for _, origin, destination, _ in valid_trips for name in (origin, destination)}
+        if valid_trips:
+            try:
+                store = run_async_fetch_store([
+                    {'name': name, 'latitude': districts[name].latitude, 'longitude': districts[name].longitude}
+                    for name in sorted(involved)
+                ])
+            except Exception as e:
+                logger.error(f"Error in batch travel recommendation: {str(e)}")
+                return Response({"error": "An unexpected error occurred"},
+                                status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            recommendations = compare_trips(store, [trip[1:] for trip in valid_trips])
+            for (i, _, _, _), recommendation in zip(valid_trips, recommendations):
+                results[i].update(recommendation)
+
+        log_elapsed(f"Batch travel recommendation ({len(trips)} trips)", start_time)
+        return Response({'results': results, 'districts_fetched': len(involved)}, status=status.HTTP_200_OK)
+
+
+class TravelRecommendationRangeView(APIView):
+    def post(self, request):
+        start_time = time.perf_counter()
+
+        try:
+            origin, destination, dates, windows = parse_travel_range(request.data)
+        except (TypeError, ValueError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        districts = get_registry().by_name
+        if origin not in districts or destination not in districts:
+            return Response({"error": "One or both selected districts are invalid"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # The forecasts already span the whole horizon: one fetch (usually a cache hit) per district, then every
+        # day and window is compared in the same pass
+        try:
+            store = run_async_fetch_store([
+                {'name': name, 'latitude': districts[name].latitude, 'longitude': districts[name].longitude}
+                for name in dict.fromkeys([origin, destination])
+            ])
+        except Exception as e:
+            logger.error(f"Error in travel recommendation range: {str(e)}")
+            return Response({"error": "An unexpected error occurred"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        days, best = compare_days(store, origin, destination, dates, windows)
+
+        log_elapsed(f"Travel recommendation range ({len(dates)} days)", start_time)
+        return Response({
+            'current_district': origin,
+            'destination_district': destination,
+            'windows': best,
+            'days': days
+        }, status=status.HTTP_200_OK)
+
+
+# Async-native variants, routed instead of the views above when running under ASGI (see urls.py).
+# They await the service coroutines on the server's event loop rather than blocking a thread on them.
+
+class AsyncTopDistrictsView(View):
+    async def get(self, request):
+        start_time = time.perf_counter()
+
+        try:
+            sort, limit = parse_top_districts_params(request.GET)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        rankings, metrics_age = await aget_rankings()
+
+        if not rankings:
+            return JsonResponse({"error": "No data available"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        log_elapsed("Top districts", start_time)
+
+        response = conditional_json(request, rankings.top(sort, limit), TOP_DISTRICTS_MAX_AGE)
+        response['X-Metrics-Age'] = str(int(metrics_age))
+        return response
+
+
+class AsyncRankDistrictsView(View):
+    async def get(self, request):
+        start_time = time.perf_counter()
+
+        try:
+            weights, first_hour, last_hour, limit = parse_ranking_params(request.GET)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        features, metrics_age = await aget_features()
+
+        if not features:
+            return JsonResponse({"error": "No data available"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        response = ranking_response(request, features, metrics_age, weights, first_hour, last_hour, limit)
+        log_elapsed("Rank districts", start_time)
+        return response
+
+
+class AsyncDistrictMetricsStreamView(View):
+    async def get(self, request):
+        try:
+            sort, limit = parse_top_districts_params(request.GET)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        districts = (await aget_registry()).locations()
+        if not districts:
+            return JsonResponse({"error": "No data available"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        return ndjson_response(astream_metrics_records(iter_district_metrics(districts), sort, limit))
+
+
+class AsyncTravelRecommendationView(View):
+    async def get(self, request):
+        return render_index(request, await aget_registry())
+
+    async def post(self, request):
+        start_time = time.perf_counter()
+        registry = await aget_registry()
+        context = index_context(registry)
+        is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+        try:
+            current_district_name, destination_district_name, travel_date = parse_travel_form(request.POST)
+            current_district = registry.get(current_district_name)
+            destination_district = registry.get(destination_district_name)
+
+            current_data, dest_data = await fetch_travel_metrics(
+                {'latitude': current_district.latitude, 'longitude': current_district.longitude},
+                {'latitude': destination_district.latitude, 'longitude': destination_district.longitude},
+                travel_date
+            )
+            response_data = build_recommendation(current_data, dest_data)
+
+            log_elapsed("Travel recommendation", start_time)
+
+            if is_ajax:
+                context['recommendation'] = response_data
+                return render(request, 'index.html', context)
+            return JsonResponse(response_data, status=status.HTTP_200_OK)
+
+        except District.DoesNotExist:
+            error_msg, error_status = "One or both selected districts are invalid", status.HTTP_400_BAD_REQUEST
+        except ValueError as e:
+            error_msg, error_status = str(e), status.HTTP_400_BAD_REQUEST
+        except Exception as e:
+            logger.error(f"Error in travel recommendation: {str(e)}")
+            error_msg, error_status = "An unexpected error occurred", status.HTTP_500_INTERNAL_SERVER_ERROR
+
+        if is_ajax:
+            context['error'] = error_msg
+            return render(request, 'index.html', context)
+        return JsonResponse({"error": error_msg}, status=error_status)
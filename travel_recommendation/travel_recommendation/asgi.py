@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'travel_recommendation.settings')
+# Serve the async-native district views, which await upstream calls on this server's event loop
+os.environ.setdefault('DISTRICTS_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -30,6 +31,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'districts.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -125,4 +127,80 @@ LOGGING = {
             'level': 'INFO',
         },
     },
-}
\ No newline at end of file
+}
+
+# Open-Meteo upstream
+# Fetch all districts with multi-location requests instead of one request per district and endpoint
+
+OPEN_METEO_BATCH_FETCH = True
+OPEN_METEO_BATCH_CHUNK_SIZE = 50
+
+# Upstream rate limit and circuit breaker
+# Adaptive token bucket per host (halved on 429, paused by Retry-After). After BREAKER_THRESHOLD consecutive
+# failures a host is not called for BREAKER_COOLDOWN seconds, and the last cached forecasts are served instead.
+OPEN_METEO_RATE_LIMIT = 10.0
+OPEN_METEO_RATE_BURST = 10
+OPEN_METEO_MAX_CONCURRENT = 5
+OPEN_METEO_BREAKER_THRESHOLD = 5
+OPEN_METEO_BREAKER_COOLDOWN = 30
+
+# Latency budget for /travel-recommendation/, in seconds. Slow upstream calls are hedged after the recent p95;
+# when the budget runs out the response uses cached forecasts, if there are any, and is flagged "degraded".
+TRAVEL_LATENCY_BUDGET = 0.4
+OPEN_METEO_HEDGE_DELAY = 0.2
+
+# Forecast freshness
+# Seconds before a cached forecast is refreshed, per variable. With incremental refresh, a stale forecast
+# is only re-requested from the current hour to the end of the 7-day window and merged into the stored series.
+OPEN_METEO_FRESHNESS = {'temperature_2m': 3 * 3600, 'pm2_5': 6 * 3600}
+OPEN_METEO_INCREMENTAL_REFRESH = True
+
+# District metrics snapshot
+# Served stale-while-revalidate: requests get the last good snapshot while a single worker recomputes it.
+# Refresh out of band with `python manage.py refresh_metrics --loop`, or set METRICS_REFRESH_IN_PROCESS
+# to run the refresher as a background thread in every worker.
+
+METRICS_REFRESH_INTERVAL = 6 * 3600
+METRICS_REFRESH_IN_PROCESS = False
+# A refresh with forecasts for fewer than this share of districts keeps the previous snapshot
+METRICS_MIN_COVERAGE = 0.5
+
+# Every refresh also writes the snapshot to this file, so a worker starting with an empty cache
+# serves it immediately instead of fetching forecasts inline. None disables it.
+METRICS_SNAPSHOT_FILE = BASE_DIR / 'metrics_snapshot.bin'
+
+# Cache
+# One SQLite file shared by all worker processes on the host, so forecasts are fetched once per host
+# and the metrics lock works across workers. Values use the compact districts.codec encoding.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'districts.cache_backend.SQLiteCache',
+        'LOCATION': BASE_DIR / 'cache.sqlite3',
+        'TIMEOUT': 86400,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    # Rendered template fragments, per process: the district <select> options, keyed by the registry version
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'districts-fragments',
+    },
+}
+
+# Seconds browsers and proxies may reuse a /top-districts/ ranking before revalidating it with its ETag
+TOP_DISTRICTS_MAX_AGE = 300
+
+# Upstream connection pool
+# Requests run on one long-lived event loop per process with a keep-alive session per upstream host.
+
+OPEN_METEO_POOL_SIZE = 100
+OPEN_METEO_POOL_SIZE_PER_HOST = 10
+OPEN_METEO_DNS_CACHE_TTL = 300
+OPEN_METEO_KEEPALIVE_TIMEOUT = 60
+
+# Async views
+# asgi.py enables the async-native district views; WSGI deployments keep the synchronous ones.
+
+DISTRICTS_ASYNC_VIEWS = os.environ.get('DISTRICTS_ASYNC_VIEWS') == '1'